@@ -1,9 +1,65 @@
 from __future__ import annotations
-from fastapi import FastAPI, Query, Body, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query, Body, HTTPException, Header, Request
+from fastapi.responses import Response, StreamingResponse
 from typing import Optional, Dict, Any
-from .service import download_candles, DownloadRequest
+from .service import download_candles, DownloadRequest, resolve_range
+from .utils import parse_timeframe
 
-app = FastAPI(title="Bybit Candles Downloader", version="1.0.0")
+# Блокировка в CACHE_DIR: её держит единственный воркер, в котором работают WS_INGEST и WATCHLIST
+BACKGROUND_LOCK_NAME = '.background.lock'
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Фоновые задачи вместе с API: WS-воркер свечей (WS_INGEST), планировщик обновлений (WATCHLIST)
+    и возобновление пакетных задач (/candles/jobs).
+
+    WS-воркер и планировщик запускает только один воркер uvicorn — тот, кто взял неблокирующую блокировку
+    CACHE_DIR/.background.lock; остальные обслуживают только API (иначе N воркеров — N подключений к WS
+    и N-кратный трафик списка наблюдения). Блокировка снимается при выходе или падении владельца.
+    """
+    from filelock import FileLock, Timeout
+    from .config import get_settings
+    from .ws_ingest import KlineIngestor, parse_subscriptions
+    from .scheduler import RefreshScheduler, parse_watchlist
+    settings = get_settings()
+    subs = parse_subscriptions(settings.ws_ingest)
+    watchlist = parse_watchlist(settings.watchlist)
+    owner = None
+    if subs or watchlist:
+        owner = FileLock(str(settings.cache_dir / BACKGROUND_LOCK_NAME), timeout=0)
+        try:
+            owner.acquire()
+        except Timeout:
+            owner = None
+    ingestor = KlineIngestor(subs) if subs and owner is not None else None
+    scheduler = RefreshScheduler(watchlist) if watchlist and owner is not None else None
+    tasks = []
+    if ingestor is not None:
+        tasks.append(asyncio.create_task(ingestor.run()))
+    if scheduler is not None:
+        tasks.append(asyncio.create_task(scheduler.run()))
+    app.state.ingestor = ingestor
+    app.state.scheduler = scheduler
+    # незавершённые фоновые пакеты, брошенные упавшим/перезапущенным воркером
+    from .jobs import get_job_manager
+    jobs = get_job_manager()
+    jobs.resume()
+    try:
+        yield
+    finally:
+        jobs.shutdown()
+        if ingestor is not None:
+            await ingestor.stop()
+        if scheduler is not None:
+            scheduler.stop()
+        for task in tasks:
+            task.cancel()
+        if owner is not None:
+            owner.release()
+
+app = FastAPI(title="Bybit Candles Downloader", version="1.0.0", lifespan=lifespan)
 
 @app.get('/health')
 def health() -> Dict[str, str]:
@@ -19,14 +75,21 @@ def candles_download(
     days_back: Optional[int] = Query(None),
     months_back: Optional[int] = Query(None),
     years_back: Optional[int] = Query(None),
+    start_ms: Optional[int] = Query(None, description='Начало диапазона, мс UTC (вместо *_back)'),
+    end_ms: Optional[int] = Query(None, description='Конец диапазона, мс UTC (включительно)'),
     out_dir: Optional[str] = Query(None),
+    resample: Optional[bool] = Query(None, description='Собрать из более мелкого закэшированного таймфрейма (по умолчанию RESAMPLE_FROM_BASE)'),
+    offline: bool = Query(False, description='Только кэш, без запросов в Bybit'),
+    max_staleness_sec: Optional[int] = Query(None, description='Допустимое отставание кэша от последнего закрытого бара, сек'),
     body: Optional[dict] = Body(None)
 ) -> Dict[str, Any]:
     try:
         req = DownloadRequest(
             symbol=symbol, timeframe=timeframe, category=category,
             candles_back=candles_back, hours_back=hours_back, days_back=days_back,
-            months_back=months_back, years_back=years_back, out_dir=out_dir
+            months_back=months_back, years_back=years_back, out_dir=out_dir,
+            start_ms=start_ms, end_ms=end_ms, resample=resample,
+            offline=offline, max_staleness_sec=max_staleness_sec
         )
         return download_candles(req)
     except ValueError as e:
@@ -34,8 +97,58 @@ def candles_download(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get('/candles')
+def candles_range(
+    symbol: str = Query(..., description='Например BTCUSDT'),
+    timeframe: str = Query(..., description='Например 30m, 1h, 4h, D, W, M'),
+    category: str = Query('linear', description='spot | linear | inverse'),
+    candles_back: Optional[int] = Query(None),
+    hours_back: Optional[int] = Query(None),
+    days_back: Optional[int] = Query(None),
+    months_back: Optional[int] = Query(None),
+    years_back: Optional[int] = Query(None),
+    start_ms: Optional[int] = Query(None, description='Начало диапазона, мс UTC (вместо *_back)'),
+    end_ms: Optional[int] = Query(None, description='Конец диапазона, мс UTC (включительно)'),
+    offline: bool = Query(False, description='Только кэш, без запросов в Bybit'),
+    max_staleness_sec: Optional[int] = Query(None, description='Допустимое отставание кэша от последнего закрытого бара, сек'),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+) -> Response:
+    """Свечи прямо из кэша потоком (chunked), без записи файла в out_dir.
+    Формат по Accept: text/csv (по умолчанию), application/x-ndjson, application/vnd.apache.arrow.stream.
+    Ответ несёт ETag/Last-Modified по партициям диапазона; условный запрос с неизменившимся диапазоном получает 304.
+    """
+    from .streaming import negotiate_media_type, stream_frames
+    from .cache import CandleCache
+    from .http_cache import make_etag, validator_headers, is_not_modified
+    media_type = negotiate_media_type(accept)
+    if media_type is None:
+        raise HTTPException(status_code=406, detail='Поддерживаются: text/csv, application/x-ndjson, application/vnd.apache.arrow.stream')
+    try:
+        rng = resolve_range(DownloadRequest(
+            symbol=symbol, timeframe=timeframe, category=category,
+            candles_back=candles_back, hours_back=hours_back, days_back=days_back,
+            months_back=months_back, years_back=years_back, start_ms=start_ms, end_ms=end_ms,
+            offline=offline, max_staleness_sec=max_staleness_sec
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    cache = CandleCache()
+    sigs = cache.range_signatures(rng.key, rng.start_ms, rng.end_ms) if rng.rows else []
+    etag = make_etag(rng.key.symbol, rng.key.interval, rng.start_ms, rng.end_ms, rng.rows, media_type, sigs)
+    last_modified_ms = max(s[0] for s in sigs) // 1_000_000 if sigs else None
+    headers = {'X-Candles-Rows': str(rng.rows), 'X-Candles-Timeframe': rng.friendly_tf,
+               **validator_headers(etag, last_modified_ms)}
+    if is_not_modified(if_none_match, if_modified_since, etag=etag, last_modified_ms=last_modified_ms):
+        return Response(status_code=304, headers=headers)
+    frames = cache.iter_range(rng.key, rng.start_ms, rng.end_ms, populate=False) if rng.rows else iter(())
+    return StreamingResponse(stream_frames(frames, media_type), media_type=media_type, headers=headers)
+
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import List
 
 class BatchDownloadBody(BaseModel):
@@ -54,15 +167,40 @@ def _validate_one_mode(body: BatchDownloadBody) -> None:
     if len(provided) != 1:
         raise HTTPException(status_code=422, detail='Укажите ровно один параметр из: candles_back | hours_back | days_back | months_back | years_back')
 
+def _batch_body(body: Optional[BatchDownloadBody], symbols: Optional[str], **query: Any) -> BatchDownloadBody:
+    """Параметры пакета из JSON-тела и/или query: символы объединяются, остальные поля тела приоритетнее query."""
+    data = {k: v for k, v in query.items() if v is not None}
+    if body is not None:
+        data.update(body.model_dump(exclude_unset=True))
+    data['symbols'] = list(body.symbols) if body is not None else []
+    if symbols:
+        data['symbols'].extend([s.strip() for s in symbols.split(',') if s.strip()])
+    try:
+        merged = BatchDownloadBody(**data)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    _validate_one_mode(merged)
+    return merged
+
 @app.post('/candles/download/batch')
-def candles_download_batch(body: BatchDownloadBody, symbols: Optional[str] = Query(None, description='Список символов через запятую, например BTCUSDT,ETHUSDT')):
-    _validate_one_mode(body)
+def candles_download_batch(
+    body: Optional[BatchDownloadBody] = Body(None),
+    symbols: Optional[str] = Query(None, description='Список символов через запятую, например BTCUSDT,ETHUSDT'),
+    timeframe: Optional[str] = Query(None),
+    category: Optional[str] = Query(None),
+    candles_back: Optional[int] = Query(None),
+    hours_back: Optional[int] = Query(None),
+    days_back: Optional[int] = Query(None),
+    months_back: Optional[int] = Query(None),
+    years_back: Optional[int] = Query(None),
+    out_dir: Optional[str] = Query(None),
+):
+    body = _batch_body(body, symbols, timeframe=timeframe, category=category, candles_back=candles_back,
+                       hours_back=hours_back, days_back=days_back, months_back=months_back,
+                       years_back=years_back, out_dir=out_dir)
     try:
         from .service import batch_download
-        symbols_list = list(body.symbols)
-        if symbols:
-            symbols_list.extend([s.strip() for s in symbols.split(',') if s.strip()])
-        res = batch_download(symbols_list,
+        res = batch_download(
             body.symbols, timeframe=body.timeframe, category=body.category,
             candles_back=body.candles_back, hours_back=body.hours_back, days_back=body.days_back,
             months_back=body.months_back, years_back=body.years_back, out_dir=body.out_dir
@@ -72,3 +210,138 @@ def candles_download_batch(body: BatchDownloadBody, symbols: Optional[str] = Que
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post('/candles/jobs', status_code=202)
+def candles_jobs_submit(
+    body: Optional[BatchDownloadBody] = Body(None),
+    symbols: Optional[str] = Query(None, description='Список символов через запятую, например BTCUSDT,ETHUSDT'),
+    timeframe: Optional[str] = Query(None),
+    category: Optional[str] = Query(None),
+    candles_back: Optional[int] = Query(None),
+    hours_back: Optional[int] = Query(None),
+    days_back: Optional[int] = Query(None),
+    months_back: Optional[int] = Query(None),
+    years_back: Optional[int] = Query(None),
+    out_dir: Optional[str] = Query(None),
+) -> Dict[str, Any]:
+    """Пакетная выгрузка в фоне: сразу возвращает job_id, прогресс — GET /candles/jobs/{job_id}."""
+    body = _batch_body(body, symbols, timeframe=timeframe, category=category, candles_back=candles_back,
+                       hours_back=hours_back, days_back=days_back, months_back=months_back,
+                       years_back=years_back, out_dir=out_dir)
+    try:
+        from .jobs import get_job_manager
+        return get_job_manager().submit(
+            body.symbols, timeframe=body.timeframe, category=body.category, out_dir=body.out_dir,
+            candles_back=body.candles_back, hours_back=body.hours_back, days_back=body.days_back,
+            months_back=body.months_back, years_back=body.years_back
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get('/candles/jobs')
+def candles_jobs_list() -> List[Dict[str, Any]]:
+    from .jobs import get_job_manager
+    return get_job_manager().list_jobs()
+
+def _job_call(method: str, job_id: str) -> Any:
+    from .jobs import get_job_manager
+    try:
+        return getattr(get_job_manager(), method)(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f'Задача не найдена: {job_id}')
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get('/candles/jobs/{job_id}')
+def candles_job_progress(job_id: str) -> Dict[str, Any]:
+    """Статус задачи и прогресс по символам: pages, bars_fetched, rows, ошибки; eta_sec — оценка до завершения."""
+    return _job_call('progress', job_id)
+
+@app.post('/candles/jobs/{job_id}/cancel')
+def candles_job_cancel(job_id: str) -> Dict[str, Any]:
+    return _job_call('cancel', job_id)
+
+@app.get('/candles/jobs/{job_id}/results')
+def candles_job_results(job_id: str) -> List[Dict[str, Any]]:
+    """Итоги завершённых символов в формате /candles/download/batch."""
+    return _job_call('results', job_id)
+
+
+@app.get('/candles/cache/stats')
+def candles_cache_stats() -> Dict[str, int]:
+    """Статистика процессного LRU партиций: записи, байты, попадания/промахи, вытеснения."""
+    from .cache import get_frame_cache
+    return get_frame_cache().stats()
+
+@app.get('/candles/cache/index')
+def candles_cache_index(
+    symbol: Optional[str] = Query(None, description='Фильтр по символу, например BTCUSDT'),
+    timeframe: Optional[str] = Query(None, description='Фильтр по таймфрейму, например 1m, 1h, D'),
+) -> List[Dict[str, Any]]:
+    """Покрытие кэша по ключам (первый/последний бар, строки, пропуски, время обновления) из meta.json, без чтения баров."""
+    try:
+        from .cache import cache_index
+        api_interval = parse_timeframe(timeframe)[0] if timeframe else None
+        return cache_index(symbol=symbol, api_interval=api_interval)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get('/candles/ingest/stats')
+def candles_ingest_stats(request: Request) -> Dict[str, Any]:
+    """Состояние WS-воркера свечей: подписки, живые ключи, счётчики сообщений/баров/переподключений."""
+    from .ws_ingest import is_live
+    ingestor = getattr(request.app.state, 'ingestor', None)
+    if ingestor is None:
+        return {'enabled': False}
+    return {
+        'enabled': True,
+        'topics': [ingestor.topic(k) for k in ingestor.keys],
+        'live': [ingestor.topic(k) for k in ingestor.keys if is_live(k)],
+        **ingestor.stats,
+    }
+
+@app.get('/candles/watchlist')
+def candles_watchlist(request: Request) -> Dict[str, Any]:
+    """Список наблюдения планировщика и отставание каждого ключа от последнего закрытого бара (staleness_ms)."""
+    scheduler = getattr(request.app.state, 'scheduler', None)
+    if scheduler is None:
+        return {'enabled': False, 'items': []}
+    return {'enabled': True, 'runs': scheduler.runs, 'items': scheduler.status()}
+
+@app.get('/candles/gaps')
+def candles_gaps(
+    symbol: Optional[str] = Query(None, description='Фильтр по символу, например BTCUSDT'),
+    timeframe: Optional[str] = Query(None, description='Фильтр по таймфрейму, например 1m, 1h, D'),
+) -> List[Dict[str, Any]]:
+    """Отчёт о пропусках в кэше по всем ключам (symbol, interval)."""
+    try:
+        from .gaps import build_gap_index
+        api_interval = parse_timeframe(timeframe)[0] if timeframe else None
+        return build_gap_index(symbol=symbol, api_interval=api_interval)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post('/candles/gaps/repair')
+def candles_gaps_repair(
+    symbol: str = Query(..., description='Например BTCUSDT'),
+    timeframe: str = Query(..., description='Например 30m, 1h, 4h, D, W, M'),
+    category: str = Query('linear', description='spot | linear | inverse'),
+) -> Dict[str, Any]:
+    """Докачать только недостающие окна ключа и вернуть обновлённый отчёт о пропусках."""
+    try:
+        from .gaps import repair_gaps
+        from .cache import CandleCache, CacheKey
+        from .bybit_client import BybitClient
+        api_interval = parse_timeframe(timeframe)[0]
+        key = CacheKey(symbol=symbol.upper(), interval=api_interval)
+        return repair_gaps(CandleCache(), BybitClient(), key, category=category)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,214 @@
+from __future__ import annotations
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+import httpx
+
+from .bybit_client import AsyncBybitClient, PageProgress, page_progress
+from .cache import CandleCache, CacheKey
+from .config import get_settings
+from .utils import parse_timeframe, plan_page_windows, atomic_path, now_ms
+
+MANIFEST_VERSION = 1
+# Манифест на диск — не чаще раза в столько секунд (и всегда в конце/при прерывании)
+MANIFEST_SAVE_INTERVAL_SEC = 5.0
+
+def _to_ranges(flags: bytearray) -> List[List[int]]:
+    """Битовая карта выполненных окон -> список отрезков [i, j] (включительно) для JSON."""
+    out: List[List[int]] = []
+    start = None
+    for i, f in enumerate(flags):
+        if f and start is None:
+            start = i
+        elif not f and start is not None:
+            out.append([start, i - 1])
+            start = None
+    if start is not None:
+        out.append([start, len(flags) - 1])
+    return out
+
+def _from_ranges(ranges: List[List[int]], n: int) -> bytearray:
+    flags = bytearray(n)
+    for a, b in ranges:
+        flags[a:b + 1] = b'\x01' * (b - a + 1)
+    return flags
+
+class BootstrapManifest:
+    """План выгрузки (окна страниц по каждому символу) и отметки выполненных окон.
+
+    Окно отмечается выполненным только после того, как его бары записаны в кэш, поэтому при возобновлении
+    достаточно докачать неотмеченные. Границы диапазона фиксируются при создании: повторный запуск с
+    *_back продолжает тот же план, а не сдвигает его к текущему моменту.
+    """
+    def __init__(self, path: Path, data: Dict[str, Any]):
+        self.path = path
+        self.data = data
+        _, _, self.interval_ms = parse_timeframe(data['interval'])
+        self._windows: Dict[str, List[Tuple[int, int]]] = {}
+        self._done: Dict[str, bytearray] = {}
+        for sym, st in data['symbols'].items():
+            self._init_symbol(sym, st)
+
+    def _init_symbol(self, sym: str, st: Dict[str, Any]) -> None:
+        windows = plan_page_windows(self.data['start_ms'], self.data['end_ms'], self.interval_ms, self.data['limit'])
+        self._windows[sym] = windows
+        self._done[sym] = _from_ranges(st.get('done', []), len(windows))
+
+    @classmethod
+    def load_or_create(cls, path: Path, *, symbols: List[str], interval: str, category: str,
+                       start_ms: int, end_ms: int, limit: int) -> 'BootstrapManifest':
+        if path.exists():
+            data = json.loads(path.read_text(encoding='utf-8'))
+            if (data.get('version'), data['interval'], data['category'], data['limit']) != (MANIFEST_VERSION, interval, category, limit):
+                raise ValueError(f'Манифест {path} составлен для другого плана (interval/category/limit) — укажите другой --manifest или --fresh')
+        else:
+            data = {'version': MANIFEST_VERSION, 'interval': interval, 'category': category, 'limit': limit,
+                    'start_ms': start_ms, 'end_ms': end_ms, 'created_ms': now_ms(), 'symbols': {}}
+        m = cls(path, data)
+        for sym in symbols:
+            if sym not in data['symbols']:
+                data['symbols'][sym] = {'done': [], 'bars': 0}
+                m._init_symbol(sym, data['symbols'][sym])
+        return m
+
+    @property
+    def symbols(self) -> List[str]:
+        return list(self.data['symbols'])
+
+    def windows(self, sym: str) -> List[Tuple[int, int]]:
+        return self._windows[sym]
+
+    def pending(self, sym: str) -> List[int]:
+        return [i for i, f in enumerate(self._done[sym]) if not f]
+
+    def mark_done(self, sym: str, idx: List[int], bars: int) -> None:
+        flags = self._done[sym]
+        for i in idx:
+            flags[i] = 1
+        self.data['symbols'][sym]['bars'] += bars
+
+    def totals(self) -> Tuple[int, int]:
+        """(выполнено окон, всего окон)."""
+        return sum(sum(f) for f in self._done.values()), sum(len(f) for f in self._done.values())
+
+    def save(self) -> None:
+        for sym, flags in self._done.items():
+            self.data['symbols'][sym]['done'] = _to_ranges(flags)
+        self.data['updated_ms'] = now_ms()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_path(self.path) as tmp:
+            tmp.write_text(json.dumps(self.data), encoding='utf-8')
+
+class _Throughput:
+    def __init__(self, manifest: BootstrapManifest, out: TextIO):
+        self.manifest = manifest
+        self.out = out
+        self.started = time.monotonic()
+        self.requests = PageProgress()
+        self.bars = 0
+
+    def line(self) -> str:
+        done, total = self.manifest.totals()
+        elapsed = max(1e-9, time.monotonic() - self.started)
+        bars_s = self.bars / elapsed
+        req_s = self.requests.pages / elapsed
+        pct = 100.0 * done / total if total else 100.0
+        return (f'[bootstrap] windows {done}/{total} ({pct:.1f}%)  bars {self.bars}  '
+                f'{bars_s:.0f} bars/s  {req_s:.2f} req/s  elapsed {elapsed:.0f}s')
+
+    def report(self) -> None:
+        print(self.line(), file=self.out, flush=True)
+
+async def run_bootstrap(manifest: BootstrapManifest, *, cache: Optional[CandleCache] = None,
+                        concurrency: Optional[int] = None, flush_pages: Optional[int] = None,
+                        progress_sec: float = 10.0, out: Optional[TextIO] = None,
+                        client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+    """Выкачать все неотмеченные окна манифеста пулом из concurrency корутин под общим лимитом процесса.
+
+    Бары копятся по символу и пишутся в кэш раз в flush_pages окон (и в конце), после записи окна отмечаются
+    в манифесте. При ошибке или прерывании уже полученные окна записываются, манифест сохраняется.
+    """
+    settings = get_settings()
+    cache = cache or CandleCache()
+    concurrency = max(1, concurrency or settings.bybit_async_concurrency)
+    flush_pages = max(1, flush_pages or settings.backfill_checkpoint_pages)
+    category = manifest.data['category']
+    interval = manifest.data['interval']
+    stats = _Throughput(manifest, out or sys.stdout)
+    page_progress.set(stats.requests)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for sym in manifest.symbols:
+        for i in manifest.pending(sym):
+            queue.put_nowait((sym, i))
+    buffers: Dict[str, Dict[str, list]] = {s: {'bars': [], 'idx': []} for s in manifest.symbols}
+    saved_at = [time.monotonic()]
+
+    def write(sym: str, bars: List[List[str]]) -> None:
+        key = CacheKey(symbol=sym, interval=interval)
+        with cache.lock(key):
+            cache.append_bars(key, bars)
+
+    async def flush(sym: str) -> None:
+        buf = buffers[sym]
+        bars, idx = buf['bars'], buf['idx']
+        if not idx:
+            return
+        buffers[sym] = {'bars': [], 'idx': []}
+        if bars:
+            await asyncio.to_thread(write, sym, bars)
+        manifest.mark_done(sym, idx, len(bars))
+        stats.bars += len(bars)
+        if time.monotonic() - saved_at[0] >= MANIFEST_SAVE_INTERVAL_SEC:
+            await asyncio.to_thread(manifest.save)
+            saved_at[0] = time.monotonic()
+
+    async def worker(api: AsyncBybitClient, sem: asyncio.Semaphore) -> None:
+        while True:
+            try:
+                sym, i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start, end = manifest.windows(sym)[i]
+            page = await api.fetch_window(sem, category=category, symbol=sym, interval=interval, start=start, end=end)
+            buf = buffers[sym]
+            buf['bars'].extend(b for b in page if start <= int(b[0]) <= end)
+            buf['idx'].append(i)
+            if len(buf['idx']) >= flush_pages:
+                await flush(sym)
+
+    async def reporter() -> None:
+        while True:
+            await asyncio.sleep(progress_sec)
+            stats.report()
+
+    async def run(http: httpx.AsyncClient) -> None:
+        api = AsyncBybitClient(client=http, concurrency=concurrency)
+        sem = asyncio.Semaphore(concurrency)
+        workers = [asyncio.create_task(worker(api, sem)) for _ in range(concurrency)]
+        ticker = asyncio.create_task(reporter())
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for t in workers + [ticker]:
+                t.cancel()
+            await asyncio.gather(*workers, ticker, return_exceptions=True)
+            for sym in manifest.symbols:
+                await flush(sym)
+            await asyncio.to_thread(manifest.save)
+
+    if client is not None:
+        await run(client)
+    else:
+        async with httpx.AsyncClient() as http:
+            await run(http)
+    stats.report()
+    done, total = manifest.totals()
+    return {'windows_done': done, 'windows_total': total, 'bars': stats.bars, 'requests': stats.requests.pages}
+
+def default_manifest_path(friendly_tf: str, category: str) -> Path:
+    return get_settings().data_dir / 'bootstrap' / f'{friendly_tf}_{category}.json'
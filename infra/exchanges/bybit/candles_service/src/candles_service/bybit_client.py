@@ -1,45 +1,95 @@
 from __future__ import annotations
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Optional, Dict, Any, Tuple, Callable
+from contextvars import ContextVar
+import asyncio
+import httpx
 import requests
 from .config import get_settings
-from .utils import now_ms
+from .utils import now_ms, parse_timeframe, plan_page_windows
+from .ratelimit import TokenBucket, get_rate_limiter, BYBIT_RATE_LIMIT_CODE
 
 import time
 
+class PageProgress:
+    """Счётчик страниц и баров, полученных от Bybit в текущем контексте (например, символ пакетной задачи).
+    on_page вызывается после каждой страницы; исключение из него прерывает выгрузку.
+    """
+    def __init__(self, on_page: Optional[Callable[['PageProgress'], None]] = None):
+        self.pages = 0
+        self.bars = 0
+        self.on_page = on_page
+
+    def add(self, bars: int) -> None:
+        self.pages += 1
+        self.bars += bars
+        if self.on_page is not None:
+            self.on_page(self)
+
+class BybitAPIError(RuntimeError):
+    """Ответ Bybit с retCode != 0."""
+    def __init__(self, ret_code: Any, ret_msg: Any):
+        super().__init__(f"Bybit error: {ret_code} {ret_msg}")
+        self.ret_code = ret_code
+        self.ret_msg = ret_msg
+
+def is_rate_limited(e: BaseException) -> bool:
+    """Ошибка означает превышение лимита: retCode 10006 или HTTP 429 (requests или httpx). Текст сообщения
+    не разбираем — в нём есть URL запроса, а 13-значные start/end легко содержат '10006'."""
+    if isinstance(e, BybitAPIError):
+        return e.ret_code == BYBIT_RATE_LIMIT_CODE
+    response = getattr(e, 'response', None)
+    return isinstance(e, (requests.HTTPError, httpx.HTTPStatusError)) and getattr(response, 'status_code', None) == 429
+
+# Ставится вызывающим кодом на время выгрузки; контекст наследуется и корутинами asyncio.run в том же потоке
+page_progress: ContextVar[Optional[PageProgress]] = ContextVar('page_progress', default=None)
+
+def _note_page(result: Dict[str, Any]) -> None:
+    progress = page_progress.get()
+    if progress is not None:
+        progress.add(len(result.get('list', [])))
+
 class BybitClient:
     """Минимальный REST-клиент для /v5/market/kline.
     Документация: https://bybit-exchange.github.io/docs/v5/market/kline
     Параметры: category (spot|linear|inverse), symbol (BTCUSDT), interval (1|3|..|D|W|M),
     start, end (мс), limit (1..1000; по умолчанию 200).
     """
-    def __init__(self, session: Optional[requests.Session] = None):
+    def __init__(self, session: Optional[requests.Session] = None, limiter: Optional[TokenBucket] = None):
         self.s = session or requests.Session()
         self.settings = get_settings()
-        self._min_interval = 1.0 / max(0.1, self.settings.bybit_qps)
-        self._last_request_ts = 0.0
+        # Лимитер общий для процесса: сколько бы клиентов ни работало параллельно, суммарный QPS один
+        self.limiter = limiter or get_rate_limiter()
 
     def _request(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Одна попытка запроса к /v5/market/kline через общий лимитер."""
         url = f"{self.settings.bybit_base_url.rstrip('/')}/v5/market/kline"
+        self.limiter.acquire()
+        r = self.s.get(url, params=params, timeout=self.settings.request_timeout_sec)
+        self.limiter.update_from_headers(r.headers)
+        r.raise_for_status()
+        data = r.json()
+        if data.get('retCode') != 0:
+            raise BybitAPIError(data.get('retCode'), data.get('retMsg'))
+        return data['result']
+
+    def _request_with_retries(self, params: Dict[str, Any]) -> Dict[str, Any]:
         attempt = 0
         while True:
-            # QPS limiter
-            now = time.monotonic()
-            wait = self._min_interval - (now - self._last_request_ts)
-            if wait > 0:
-                time.sleep(wait)
             try:
-                r = self.s.get(url, params=params, timeout=self.settings.request_timeout_sec)
-                self._last_request_ts = time.monotonic()
-                r.raise_for_status()
-                data = r.json()
-                if data.get('retCode') != 0:
-                    raise RuntimeError(f"Bybit error: {data.get('retCode')} {data.get('retMsg')}")
-                return data['result']
+                result = self._request(params)
             except Exception as e:
                 attempt += 1
                 if attempt > self.settings.bybit_max_retries:
                     raise
-                time.sleep(self.settings.bybit_retry_backoff_sec * attempt)
+                backoff = self.settings.bybit_retry_backoff_sec * attempt
+                if is_rate_limited(e):
+                    # Превышен лимит — притормаживаем всех клиентов процесса, ожидание сделает acquire()
+                    self.limiter.block_for(backoff)
+                else:
+                    time.sleep(backoff)
+            else:
+                _note_page(result)
+                return result
 
     def fetch_klines_page(self, *, category: str, symbol: str, interval: str, limit: int = 200,
                           end: Optional[int] = None, start: Optional[int] = None) -> List[List[str]]:
@@ -54,7 +104,7 @@ class BybitClient:
         if start is not None:
             params['start'] = int(start)
 
-        result = self._request(params)
+        result = self._request_with_retries(params)
         return result.get('list', [])
 
     def fetch_until(self, *, category: str, symbol: str, interval: str,
@@ -80,8 +130,126 @@ class BybitClient:
                 break
         return combined
 
+    def fetch_range(self, *, category: str, symbol: str, interval: str, start_ms: int, end_ms: int) -> List[List[str]]:
+        """Синхронная обёртка над AsyncBybitClient.fetch_range (вызывать из потоков без запущенного event loop)."""
+        return asyncio.run(AsyncBybitClient(limiter=self.limiter).fetch_range(
+            category=category, symbol=symbol, interval=interval, start_ms=start_ms, end_ms=end_ms))
+
     def update_forward(self, *, category: str, symbol: str, interval: str, from_exclusive_ms: int) -> List[List[str]]:
+        """Все бары после from_exclusive_ms до текущего момента.
+
+        Bybit на запрос со start/end отдаёт самые свежие limit баров окна, поэтому при отставании больше
+        чем на страницу одной страницы мало (в кэше осталась бы дыра) — тогда качаем все окна через fetch_range.
+        """
         end = now_ms()
+        _, _, interval_ms = parse_timeframe(interval)
+        windows = plan_page_windows(from_exclusive_ms + 1, end, interval_ms, self.settings.max_bars_per_request)
+        if len(windows) > 1:
+            return self.fetch_range(category=category, symbol=symbol, interval=interval,
+                                    start_ms=from_exclusive_ms + 1, end_ms=end)
         page = self.fetch_klines_page(category=category, symbol=symbol, interval=interval,
                                       start=from_exclusive_ms + 1, end=end, limit=self.settings.max_bars_per_request)
         return page
+
+
+class AsyncBybitClient:
+    """Асинхронный клиент /v5/market/kline (httpx) с параллельной выгрузкой страниц.
+
+    Бары идут с регулярным шагом, поэтому окна страниц для диапазона вычисляются заранее (plan_page_windows)
+    и запрашиваются конкурентно — не более BYBIT_ASYNC_CONCURRENCY одновременно, в темпе общего лимитера процесса.
+    """
+    def __init__(self, client: Optional[httpx.AsyncClient] = None, limiter: Optional[TokenBucket] = None,
+                 concurrency: Optional[int] = None):
+        self.settings = get_settings()
+        self.limiter = limiter or get_rate_limiter()
+        self.concurrency = max(1, concurrency or self.settings.bybit_async_concurrency)
+        self._client = client
+
+    async def _request(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        url = f"{self.settings.bybit_base_url.rstrip('/')}/v5/market/kline"
+        await self.limiter.acquire_async()
+        r = await self._client.get(url, params=params, timeout=self.settings.request_timeout_sec)
+        self.limiter.update_from_headers(r.headers)
+        r.raise_for_status()
+        data = r.json()
+        if data.get('retCode') != 0:
+            raise BybitAPIError(data.get('retCode'), data.get('retMsg'))
+        return data['result']
+
+    async def _request_with_retries(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            try:
+                result = await self._request(params)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.settings.bybit_max_retries:
+                    raise
+                backoff = self.settings.bybit_retry_backoff_sec * attempt
+                if is_rate_limited(e):
+                    self.limiter.block_for(backoff)
+                else:
+                    await asyncio.sleep(backoff)
+            else:
+                _note_page(result)
+                return result
+
+    async def fetch_klines_page(self, *, category: str, symbol: str, interval: str, limit: int = 200,
+                                end: Optional[int] = None, start: Optional[int] = None) -> List[List[str]]:
+        params: Dict[str, Any] = {
+            'category': category,
+            'symbol': symbol,
+            'interval': interval,
+            'limit': min(max(1, limit), self.settings.max_bars_per_request),
+        }
+        if end is not None:
+            params['end'] = int(end)
+        if start is not None:
+            params['start'] = int(start)
+        result = await self._request_with_retries(params)
+        return result.get('list', [])
+
+    async def fetch_window(self, sem: asyncio.Semaphore, *, category: str, symbol: str, interval: str,
+                           start: int, end: int) -> List[List[str]]:
+        """Все бары окна [start, end] (обычно одна страница; лишнее дочитывается курсором), запросы — под sem.
+        Вызывать внутри открытого клиента (fetch_range или свой httpx.AsyncClient в конструкторе)."""
+        limit = self.settings.max_bars_per_request
+        out: List[List[str]] = []
+        cursor = end
+        while True:
+            async with sem:
+                page = await self.fetch_klines_page(category=category, symbol=symbol, interval=interval,
+                                                    start=start, end=cursor, limit=limit)
+            out.extend(page)
+            if len(page) < limit or int(page[-1][0]) <= start:
+                return out
+            # В окне оказалось больше баров, чем по расчёту (неравные месяцы и т.п.) — дочитываем курсором
+            cursor = int(page[-1][0]) - 1
+
+    async def _fetch_range(self, *, category: str, symbol: str, interval: str,
+                           start_ms: int, end_ms: int) -> List[List[str]]:
+        _, _, interval_ms = parse_timeframe(interval)
+        windows = plan_page_windows(start_ms, end_ms, interval_ms, self.settings.max_bars_per_request)
+        sem = asyncio.Semaphore(self.concurrency)
+        pages = await asyncio.gather(*(
+            self.fetch_window(sem, category=category, symbol=symbol, interval=interval, start=ws, end=we)
+            for ws, we in windows
+        ))
+        out: List[List[str]] = []
+        for page in reversed(pages):
+            out.extend(bar for bar in page if start_ms <= int(bar[0]) <= end_ms)
+        return out
+
+    async def fetch_range(self, *, category: str, symbol: str, interval: str,
+                          start_ms: int, end_ms: int) -> List[List[str]]:
+        """Все бары с start_ms <= время открытия <= end_ms, от новых к старым (порядок страниц Bybit)."""
+        if self._client is not None:
+            return await self._fetch_range(category=category, symbol=symbol, interval=interval,
+                                           start_ms=start_ms, end_ms=end_ms)
+        async with httpx.AsyncClient() as client:
+            self._client = client
+            try:
+                return await self._fetch_range(category=category, symbol=symbol, interval=interval,
+                                               start_ms=start_ms, end_ms=end_ms)
+            finally:
+                self._client = None
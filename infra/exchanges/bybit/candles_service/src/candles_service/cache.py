@@ -1,75 +1,583 @@
 from __future__ import annotations
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Iterator, Any, Iterable
+import json
+import numpy as np
 import pandas as pd
+from filelock import FileLock
 
 from .config import get_settings
-from .utils import iso_from_ms
+from .utils import iso_series_from_ms, atomic_path, now_ms, parse_timeframe
+
+CANDLE_COLUMNS = ['timestamp_ms','start_time_iso','open','high','low','close','volume','turnover']
+# Типы колонок, которые хранятся в партициях и возвращаются load() (start_time_iso добавляется при выгрузке, см. with_iso)
+STORED_DTYPES: Dict[str, str] = {
+    'timestamp_ms': 'int64',
+    'open': 'float64',
+    'high': 'float64',
+    'low': 'float64',
+    'close': 'float64',
+    'volume': 'float64',
+    'turnover': 'float64',
+}
+LEGACY_CSV_NAME = 'candles.csv'
+LOCK_NAME = '.lock'
+PARTITION_SUFFIX = '.parquet'
+META_NAME = 'meta.json'
 
 @dataclass
 class CacheKey:
     symbol: str
     interval: str  # Bybit API token
 
+def empty_candles_df() -> pd.DataFrame:
+    return pd.DataFrame({c: pd.Series(dtype=t) for c, t in STORED_DTYPES.items()})
+
+def _month_bounds_ms(month: str) -> Tuple[int, int]:
+    """Границы партиции 'YYYY-MM' в мс (UTC): [начало месяца, начало следующего)."""
+    y, m = (int(x) for x in month.split('-'))
+    start = datetime(y, m, 1, tzinfo=timezone.utc)
+    end = datetime(y + (m // 12), m % 12 + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp()*1000), int(end.timestamp()*1000)
+
+def _month_labels(ts_ms: pd.Series) -> pd.Series:
+    return pd.to_datetime(ts_ms, unit='ms', utc=True).dt.strftime('%Y-%m')
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Приводит кадр к хранимой схеме: типизированные колонки, сортировка, без дублей."""
+    out = df[list(STORED_DTYPES)].astype(STORED_DTYPES)
+    return out.drop_duplicates(subset=['timestamp_ms']).sort_values('timestamp_ms', ascending=True).reset_index(drop=True)
+
+def _open_bar(api_interval: str, open_ms: Optional[int], new_ts: np.ndarray, now: int) -> Optional[int]:
+    """Начало бара, записанного ещё открытым (его OHLCV неполный), после записи баров new_ts в момент now.
+
+    Отметка снимается, когда этот бар перезаписан уже после закрытия; если открытым записан более свежий бар,
+    отметка остаётся на старом — он так и не был исправлен.
+    """
+    from .resample import bucket_lengths_ms
+    if open_ms is not None and open_ms in new_ts and now >= open_ms + int(bucket_lengths_ms([open_ms], api_interval)[0]):
+        open_ms = None
+    last = int(new_ts.max())
+    if now < last + int(bucket_lengths_ms([last], api_interval)[0]) and open_ms is None:
+        open_ms = last
+    return open_ms
+
+def with_iso(df: pd.DataFrame) -> pd.DataFrame:
+    """Копия кадра с колонкой start_time_iso (схема CANDLE_COLUMNS) — считается только при выгрузке."""
+    df = df.copy()
+    df.insert(1, 'start_time_iso', iso_series_from_ms(df['timestamp_ms']))
+    return df
+
+PartitionId = str                   # абсолютный путь файла партиции
+FileSignature = Tuple[int, int]     # (st_mtime_ns, st_size)
+
+class FrameLRU:
+    """Процессный LRU прочитанных партиций с бюджетом памяти в байтах.
+
+    Запись валидна, пока совпадает сигнатура файла (mtime_ns, size): партицию, переписанную другим
+    процессом, перечитаем с диска. Запись через CandleCache сразу кладёт новый кадр в LRU (write-through).
+    Кадры в LRU общие — вызывающий код не должен их изменять.
+    """
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = max(0, int(budget_bytes))
+        self._lock = threading.Lock()
+        self._items: 'OrderedDict[PartitionId, Tuple[FileSignature, pd.DataFrame, int]]' = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def peek(self, pid: PartitionId, sig: FileSignature) -> Optional[pd.DataFrame]:
+        """Как get(), но без учёта в статистике и без изменения порядка вытеснения."""
+        with self._lock:
+            item = self._items.get(pid)
+            return item[1] if item is not None and item[0] == sig else None
+
+    def get(self, pid: PartitionId, sig: FileSignature) -> Optional[pd.DataFrame]:
+        with self._lock:
+            item = self._items.get(pid)
+            if item is None or item[0] != sig:
+                if item is not None:
+                    self._drop(pid)
+                self.misses += 1
+                return None
+            self._items.move_to_end(pid)
+            self.hits += 1
+            return item[1]
+
+    def put(self, pid: PartitionId, sig: FileSignature, df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if pid in self._items:
+                self._drop(pid)
+            if size > self.budget_bytes:
+                return
+            self._items[pid] = (sig, df, size)
+            self._bytes += size
+            while self._bytes > self.budget_bytes:
+                self._drop(next(iter(self._items)))
+                self.evictions += 1
+
+    def invalidate(self, pid: PartitionId) -> None:
+        with self._lock:
+            if pid in self._items:
+                self._drop(pid)
+
+    def _drop(self, pid: PartitionId) -> None:
+        _, _, size = self._items.pop(pid)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'bytes': self._bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+_frames_lock = threading.Lock()
+_frames: Optional[FrameLRU] = None
+
+def get_frame_cache() -> FrameLRU:
+    """Общий для процесса LRU партиций (создаётся лениво с бюджетом FRAME_CACHE_MB)."""
+    global _frames
+    with _frames_lock:
+        if _frames is None:
+            _frames = FrameLRU(get_settings().frame_cache_mb * 1024 * 1024)
+        return _frames
+
+def _file_signature(path: Path) -> FileSignature:
+    st = path.stat()
+    return st.st_mtime_ns, st.st_size
+
+# Сводки meta.json, уже сверенные с партициями в этом процессе: путь meta.json -> (его сигнатура, сводка)
+_meta_lock = threading.Lock()
+_metas: Dict[str, Tuple[FileSignature, Dict[str, Any]]] = {}
+
+def _remember_meta(path: Path, meta: Dict[str, Any]) -> None:
+    with _meta_lock:
+        _metas[str(path)] = (_file_signature(path), meta)
+
 class CandleCache:
-    """Файловый кэш (CSV) по ключу (symbol, interval).
-    Структура CSV: timestamp_ms,start_time_iso,open,high,low,close,volume,turnover
-    Время хранится в мс (UTC). Файл отсортирован по времени по возрастанию. Дубликаты удаляются по ключу timestamp_ms.
+    """Файловый кэш по ключу (symbol, interval), партиционированный по календарным месяцам (UTC).
+    Раскладка: cache/<SYMBOL>/<interval>/<YYYY-MM>.parquet — колонки timestamp_ms (int64), open, high, low,
+    close, volume, turnover (float64). Колонка start_time_iso не хранится: её добавляет with_iso() при выгрузке.
+    Внутри партиции строки отсортированы по времени, дубликаты по timestamp_ms удалены.
+    Чтение с диапазоном затрагивает только пересекающиеся партиции, запись — только изменённые.
+    Старый формат (один candles.csv на ключ) мигрируется при первом обращении к ключу.
+    Прочитанные партиции держатся в процессном LRU (FrameLRU), повторные чтения не ходят на диск.
+    Сводка по ключу (первый/последний бар, число строк, пропуски, время обновления) лежит в meta.json рядом
+    с партициями и обновляется при каждой записи — планированию запросов не нужно читать сами бары (см. meta()).
     """
-    def __init__(self):
+    def __init__(self, frames: Optional[FrameLRU] = None):
         self.settings = get_settings()
+        self.frames = frames or get_frame_cache()
 
-    def _path(self, key: CacheKey) -> Path:
-        # Храним по дереву: cache/<SYMBOL>/<interval>/candles.csv
+    def _dir(self, key: CacheKey) -> Path:
+        # Храним по дереву: cache/<SYMBOL>/<interval>/<YYYY-MM>.parquet
         d = (self.settings.cache_dir / key.symbol.upper() / key.interval)
         d.mkdir(parents=True, exist_ok=True)
-        return (d / 'candles.csv').resolve()
+        return d.resolve()
+
+    def _partition_path(self, key: CacheKey, month: str) -> Path:
+        return self._dir(key) / f'{month}{PARTITION_SUFFIX}'
+
+    def lock(self, key: CacheKey) -> FileLock:
+        """Межпроцессная блокировка ключа (файл .lock в каталоге ключа) — общая для всех воркеров uvicorn."""
+        return FileLock(str(self._dir(key) / LOCK_NAME), timeout=self.settings.cache_lock_timeout_sec)
+
+    def partitions(self, key: CacheKey) -> List[str]:
+        """Отсортированный список месяцев 'YYYY-MM', для которых есть партиции."""
+        if (self._dir(key) / LEGACY_CSV_NAME).exists():
+            migrate_legacy_csv(self, key)
+        return self._list_partitions(key)
+
+    def _list_partitions(self, key: CacheKey) -> List[str]:
+        return sorted(p.name[:-len(PARTITION_SUFFIX)] for p in self._dir(key).glob(f'*{PARTITION_SUFFIX}'))
+
+    def keys(self) -> List[CacheKey]:
+        """Все ключи, для которых в CACHE_DIR есть партиции или старый candles.csv."""
+        out: List[CacheKey] = []
+        root = self.settings.cache_dir
+        for d in sorted(p for p in root.glob('*/*') if p.is_dir()):
+            if any(d.glob(f'*{PARTITION_SUFFIX}')) or (d / LEGACY_CSV_NAME).exists():
+                out.append(CacheKey(symbol=d.parent.name, interval=d.name))
+        return out
 
-    def load(self, key: CacheKey) -> Optional[pd.DataFrame]:
-        p = self._path(key)
-        if not p.exists():
+    def load_timestamps(self, key: CacheKey) -> pd.Series:
+        """Только колонка timestamp_ms всех партиций (по возрастанию) — дешевле полного load()."""
+        months = self.partitions(key)
+        if not months:
+            return pd.Series([], dtype='int64', name='timestamp_ms')
+        parts = [self._read_partition(key, m, columns=['timestamp_ms'])['timestamp_ms'] for m in months]
+        return pd.concat(parts, ignore_index=True)
+
+    def _read_partition(self, key: CacheKey, month: str, columns: Optional[List[str]] = None,
+                        populate: bool = True) -> pd.DataFrame:
+        path = self._partition_path(key, month)
+        pid = str(path)
+        sig = _file_signature(path)
+        if columns is not None or not populate:
+            # Частичные и потоковые чтения LRU не наполняют, но пользуются им, если партиция уже в памяти
+            cached = self.frames.peek(pid, sig)
+            if cached is not None:
+                return cached[columns] if columns is not None else cached
+            return pd.read_parquet(path, columns=columns)
+        df = self.frames.get(pid, sig)
+        if df is None:
+            df = pd.read_parquet(path)
+            self.frames.put(pid, sig, df)
+        return df
+
+    def _write_partition(self, key: CacheKey, month: str, df: pd.DataFrame) -> None:
+        path = self._partition_path(key, month)
+        with atomic_path(path) as tmp:
+            df.to_parquet(tmp, index=False)
+        self.frames.put(str(path), _file_signature(path), df)
+
+    def _drop_partition(self, key: CacheKey, month: str) -> None:
+        path = self._partition_path(key, month)
+        path.unlink(missing_ok=True)
+        self.frames.invalidate(str(path))
+
+    def _months_in_range(self, key: CacheKey, start_ms: Optional[int], end_ms: Optional[int]) -> List[str]:
+        selected = []
+        for month in self.partitions(key):
+            lo, hi = _month_bounds_ms(month)
+            if start_ms is not None and hi <= start_ms:
+                continue
+            if end_ms is not None and lo > end_ms:
+                continue
+            selected.append(month)
+        return selected
+
+    def iter_range(self, key: CacheKey, start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+                   populate: bool = True, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """Бары с start_ms <= timestamp_ms <= end_ms по одной партиции за раз (по возрастанию времени).
+        populate=False — не класть прочитанное в LRU (длинные потоковые выгрузки не вытесняют горячие ключи).
+        columns — только эти колонки (timestamp_ms обязательна).
+        """
+        for month in self._months_in_range(key, start_ms, end_ms):
+            df = self._read_partition(key, month, columns=columns, populate=populate)
+            if start_ms is not None:
+                df = df[df['timestamp_ms'] >= start_ms]
+            if end_ms is not None:
+                df = df[df['timestamp_ms'] <= end_ms]
+            if not df.empty:
+                yield df
+
+    def load(self, key: CacheKey, start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+             columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        """Прочитать кэш ключа (целиком или только бары с start_ms <= timestamp_ms <= end_ms).
+        Возвращает None, если для ключа нет ни одной партиции.
+        """
+        if not self.partitions(key):
             return None
-        df = pd.read_csv(p)
-        if 'timestamp_ms' not in df.columns:
+        parts = list(self.iter_range(key, start_ms, end_ms, columns=columns))
+        if not parts:
+            empty = empty_candles_df()
+            return empty[columns] if columns is not None else empty
+        return pd.concat(parts, ignore_index=True)
+
+    def load_tail(self, key: CacheKey, n: int, end_ms: Optional[int] = None,
+                  columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Последние n баров с timestamp_ms <= end_ms: партиции читаются с конца, пока не наберётся n строк."""
+        parts: List[pd.DataFrame] = []
+        got = 0
+        for month in reversed(self._months_in_range(key, None, end_ms)):
+            df = self._read_partition(key, month, columns=columns)
+            if end_ms is not None:
+                df = df[df['timestamp_ms'] <= end_ms]
+            parts.append(df)
+            got += len(df)
+            if got >= n:
+                break
+        if not parts:
+            empty = empty_candles_df()
+            return empty[columns] if columns is not None else empty
+        return pd.concat(reversed(parts), ignore_index=True).tail(n).reset_index(drop=True)
+
+    def _partition_timestamps(self, key: CacheKey, month: str, start_ms: Optional[int],
+                              end_ms: Optional[int]) -> np.ndarray:
+        ts = self._read_partition(key, month, columns=['timestamp_ms'])['timestamp_ms'].to_numpy()
+        if start_ms is not None:
+            ts = ts[ts >= start_ms]
+        if end_ms is not None:
+            ts = ts[ts <= end_ms]
+        return ts
+
+    def span(self, key: CacheKey, start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+             last_n: Optional[int] = None) -> Tuple[Optional[int], Optional[int], int]:
+        """(первый бар, последний бар, число строк) выборки start_ms <= timestamp_ms <= end_ms,
+        а с last_n — её последних last_n баров. Считается по сводке meta.json: партиции целиком внутри
+        выборки не читаются, метки читаются только у граничных (и у той, где начинаются последние last_n)."""
+        meta = self.meta(key)
+        if meta is None:
+            return None, None, 0
+        # [месяц, первый, последний, строк, метки или None]
+        picked: List[List[Any]] = []
+        for month, pm in sorted(meta['partitions'].items()):
+            if (start_ms is not None and pm['last_ms'] < start_ms) or (end_ms is not None and pm['first_ms'] > end_ms):
+                continue
+            if (start_ms is None or pm['first_ms'] >= start_ms) and (end_ms is None or pm['last_ms'] <= end_ms):
+                picked.append([month, pm['first_ms'], pm['last_ms'], pm['rows'], None])
+                continue
+            ts = self._partition_timestamps(key, month, start_ms, end_ms)
+            if len(ts):
+                picked.append([month, int(ts[0]), int(ts[-1]), len(ts), ts])
+        if last_n is not None:
+            got = 0
+            for i in range(len(picked) - 1, -1, -1):
+                month, _, last, rows, ts = picked[i]
+                if got + rows >= last_n:
+                    skip = rows - (last_n - got)
+                    if skip:
+                        if ts is None:
+                            ts = self._partition_timestamps(key, month, start_ms, end_ms)
+                        picked[i] = [month, int(ts[skip]), last, rows - skip, None]
+                    picked = picked[i:]
+                    break
+                got += rows
+        if not picked:
+            return None, None, 0
+        return picked[0][1], picked[-1][2], sum(p[3] for p in picked)
+
+    def _meta_path(self, key: CacheKey) -> Path:
+        return self._dir(key) / META_NAME
+
+    def _read_meta(self, key: CacheKey) -> Dict[str, Any]:
+        path = self._meta_path(key)
+        try:
+            return json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {'partitions': {}}
+
+    def _partition_meta(self, key: CacheKey, month: str, ts: np.ndarray) -> Dict[str, Any]:
+        from .gaps import find_gaps
+        return {
+            'sig': list(_file_signature(self._partition_path(key, month))),
+            'first_ms': int(ts[0]),
+            'last_ms': int(ts[-1]),
+            'rows': int(len(ts)),
+            'gaps': [[a, b] for a, b in find_gaps(ts, key.interval)],
+        }
+
+    def _write_meta(self, key: CacheKey, parts: Dict[str, Dict[str, Any]], updated_ms: Optional[int],
+                    open_ms: Optional[int] = None) -> Dict[str, Any]:
+        """Свести записи партиций в сводку ключа и атомарно записать meta.json."""
+        from .gaps import _max_spacing_ms
+        months = sorted(parts)
+        _, _, interval_ms = parse_timeframe(key.interval)
+        gaps: List[List[int]] = []
+        prev: Optional[Dict[str, Any]] = None
+        for m in months:
+            e = parts[m]
+            if prev is not None and e['first_ms'] - prev['last_ms'] > _max_spacing_ms(key.interval):
+                gaps.append([prev['last_ms'] + interval_ms, e['first_ms'] - 1])
+            gaps.extend(e['gaps'])
+            prev = e
+        meta = {
+            'symbol': key.symbol.upper(),
+            'interval': key.interval,
+            'first_ms': parts[months[0]]['first_ms'] if months else None,
+            'last_ms': parts[months[-1]]['last_ms'] if months else None,
+            'rows': sum(parts[m]['rows'] for m in months),
+            'gaps': gaps,
+            'missing_bars': int(sum((b - a) // interval_ms + 1 for a, b in gaps)),
+            'updated_ms': updated_ms,
+            'open_ms': open_ms,
+            'partitions': {m: parts[m] for m in months},
+        }
+        with atomic_path(self._meta_path(key)) as tmp:
+            tmp.write_text(json.dumps(meta), encoding='utf-8')
+        _remember_meta(self._meta_path(key), meta)
+        return meta
+
+    def _update_meta(self, key: CacheKey, written: Dict[str, pd.DataFrame], dropped: Iterable[str] = (),
+                     new_ts: Optional[np.ndarray] = None) -> None:
+        """Обновить meta.json после записи: пересчитываются только записанные/удалённые партиции.
+        new_ts — метки записанных баров: по ним ведётся open_ms (см. _open_bar)."""
+        stored = self._read_meta(key)
+        parts = stored.get('partitions', {})
+        for month, df in written.items():
+            parts[month] = self._partition_meta(key, month, df['timestamp_ms'].to_numpy())
+        for month in dropped:
+            parts.pop(month, None)
+        now = now_ms()
+        open_ms = stored.get('open_ms')
+        if new_ts is not None and len(new_ts):
+            open_ms = _open_bar(key.interval, open_ms, new_ts, now)
+        self._write_meta(key, parts, now, open_ms)
+
+    def range_signatures(self, key: CacheKey, start_ms: Optional[int], end_ms: Optional[int]) -> List[List[int]]:
+        """Сигнатуры (mtime_ns, размер) партиций, пересекающих диапазон, — версия его баров без чтения данных."""
+        meta = self.meta(key)
+        if meta is None:
+            return []
+        return [meta['partitions'][m]['sig'] for m in self._months_in_range(key, start_ms, end_ms)]
+
+    def meta(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        """Сводка по ключу без чтения баров: first_ms, last_ms, rows, gaps ([start, end] включительно),
+        missing_bars, updated_ms (время последней записи, мс), open_ms (бар, записанный ещё открытым и с тех пор
+        не перезаписанный, иначе None). None — у ключа нет партиций.
+
+        meta.json пишется после партиций под блокировкой ключа, поэтому ему доверяем: пока его (mtime, размер)
+        не изменились с последней сверки в этом процессе, сводка отдаётся из памяти без обращения к партициям.
+        Новый meta.json сверяется с файлами партиций по (mtime, размер); если партиция менялась в обход сводки
+        (сбой между записью партиции и сводки, ручная правка), перечитывается только её timestamp_ms.
+        """
+        path = self._meta_path(key)
+        try:
+            sig = _file_signature(path)
+        except OSError:
+            sig = None
+        with _meta_lock:
+            hit = _metas.get(str(path))
+        if sig is not None and hit is not None and hit[0] == sig:
+            return hit[1]
+        months = self.partitions(key)
+        if not months:
             return None
-        df = df.drop_duplicates(subset=['timestamp_ms']).sort_values('timestamp_ms', ascending=True).reset_index(drop=True)
-        return df
+        stored = self._read_meta(key)
+        parts = stored.get('partitions', {})
+        changed = set(parts) != set(months)
+        fresh: Dict[str, Dict[str, Any]] = {}
+        for month in months:
+            e = parts.get(month)
+            if e is None or e.get('sig') != list(_file_signature(self._partition_path(key, month))):
+                ts = self._read_partition(key, month, columns=['timestamp_ms'])['timestamp_ms'].to_numpy()
+                e = self._partition_meta(key, month, ts)
+                changed = True
+            fresh[month] = e
+        if not changed:
+            _remember_meta(path, stored)
+            return stored
+        return self._write_meta(key, fresh, stored.get('updated_ms') or now_ms(), stored.get('open_ms'))
 
     def save(self, key: CacheKey, df: pd.DataFrame) -> Path:
-        p = self._path(key)
-        p.parent.mkdir(parents=True, exist_ok=True)
-        df.to_csv(p, index=False)
-        return p
+        """Полностью заменить содержимое ключа кадром df (лишние партиции удаляются)."""
+        d = self._dir(key)
+        df = _normalize(df)
+        written: Dict[str, pd.DataFrame] = {}
+        for month, part in df.groupby(_month_labels(df['timestamp_ms']), sort=True):
+            part = part.reset_index(drop=True)
+            self._write_partition(key, month, part)
+            written[month] = part
+        dropped = [m for m in self.partitions(key) if m not in written]
+        for month in dropped:
+            self._drop_partition(key, month)
+        self._update_meta(key, written, dropped, new_ts=df['timestamp_ms'].to_numpy())
+        return d
 
     def merge_and_save(self, key: CacheKey, bars: List[List[str]]) -> pd.DataFrame:
+        """Слить новые бары с кэшем. Перезаписываются только партиции тех месяцев, куда попали новые бары.
+        При совпадении timestamp_ms побеждает уже сохранённая строка. Возвращает весь кэш ключа.
+        """
         if not bars:
             existing = self.load(key)
-            return existing if existing is not None else pd.DataFrame(columns=['timestamp_ms','start_time_iso','open','high','low','close','volume','turnover'])
-        df_new = self._bars_to_df(bars)
-        df_existing = self.load(key)
-        if df_existing is None or df_existing.empty:
-            merged = df_new
-        else:
-            merged = pd.concat([df_existing, df_new], ignore_index=True)
-            merged = merged.drop_duplicates(subset=['timestamp_ms']).sort_values('timestamp_ms', ascending=True).reset_index(drop=True)
-        self.save(key, merged)
-        return merged
+            return existing if existing is not None else empty_candles_df()
+        self.merge_frame(key, self._bars_to_df(bars))
+        return self.load(key)
+
+    def append_bars(self, key: CacheKey, bars: List[List[str]], prefer_new: bool = False) -> List[str]:
+        """Как merge_and_save, но без перечитывания всего кэша. Возвращает список перезаписанных месяцев.
+        prefer_new=True — при совпадении timestamp_ms побеждает новый бар (закрытый бар вместо сохранённого открытого).
+        """
+        if not bars:
+            return []
+        return self.merge_frame(key, self._bars_to_df(bars), prefer_new=prefer_new)
+
+    def merge_frame(self, key: CacheKey, df_new: pd.DataFrame, prefer_new: bool = False) -> List[str]:
+        """Слить кадр со свечами с партициями кэша. Возвращает список перезаписанных месяцев."""
+        if df_new.empty:
+            return []
+        return self._merge_partitions(key, _normalize(df_new), set(self.partitions(key)), prefer_new=prefer_new)
+
+    def _merge_partitions(self, key: CacheKey, df_new: pd.DataFrame, existing_months: set,
+                          prefer_new: bool = False) -> List[str]:
+        written: Dict[str, pd.DataFrame] = {}
+        for month, part in df_new.groupby(_month_labels(df_new['timestamp_ms']), sort=True):
+            if month in existing_months:
+                frames = [part, self._read_partition(key, month)] if prefer_new else [self._read_partition(key, month), part]
+                part = _normalize(pd.concat(frames, ignore_index=True))
+            part = part.reset_index(drop=True)
+            self._write_partition(key, month, part)
+            written[month] = part
+        self._update_meta(key, written, new_ts=df_new['timestamp_ms'].to_numpy())
+        return list(written)
 
     @staticmethod
     def _bars_to_df(bars: List[List[str]]) -> pd.DataFrame:
-        rows = []
-        for item in bars:
-            ts = int(item[0])
-            rows.append({
-                'timestamp_ms': ts,
-                'start_time_iso': iso_from_ms(ts),
-                'open': float(item[1]),
-                'high': float(item[2]),
-                'low': float(item[3]),
-                'close': float(item[4]),
-                'volume': float(item[5]),
-                'turnover': float(item[6]),
-            })
-        df = pd.DataFrame(rows).sort_values('timestamp_ms', ascending=True).reset_index(drop=True)
-        return df
+        """Разбор страницы kline Bybit ([start, open, high, low, close, volume, turnover] строками) без цикла по строкам:
+        один массив NumPy и векторные приведения типов к хранимой схеме.
+        """
+        if not bars:
+            return empty_candles_df()
+        arr = np.array(bars, dtype=object)
+        ts = arr[:, 0].astype('int64')
+        values = arr[:, 1:7].astype('float64')
+        order = np.argsort(ts, kind='stable')
+        data = {'timestamp_ms': ts[order]}
+        for i, col in enumerate(list(STORED_DTYPES)[1:]):
+            data[col] = values[order, i]
+        return pd.DataFrame(data)
+
+def migrate_legacy_csv(cache: CandleCache, key: CacheKey) -> int:
+    """Одноразовая миграция cache/<SYMBOL>/<interval>/candles.csv в месячные партиции.
+    При совпадении timestamp_ms приоритет у уже существующих партиций. После записи CSV удаляется.
+    Возвращает число перенесённых строк (без дублей по timestamp_ms).
+    """
+    legacy = cache._dir(key) / LEGACY_CSV_NAME
+    if not legacy.exists():
+        return 0
+    df = pd.read_csv(legacy)
+    rows = 0
+    if 'timestamp_ms' in df.columns and not df.empty:
+        df = _normalize(df)
+        cache._merge_partitions(key, df, set(cache._list_partitions(key)))
+        rows = int(len(df))
+    legacy.unlink(missing_ok=True)
+    return rows
+
+def cache_index(cache: Optional[CandleCache] = None, *, symbol: Optional[str] = None,
+                api_interval: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Сводки meta.json по всем ключам кэша (опционально — только по символу и/или интервалу), без партиций."""
+    cache = cache or CandleCache()
+    out: List[Dict[str, Any]] = []
+    for key in cache.keys():
+        if symbol is not None and key.symbol != symbol.upper():
+            continue
+        if api_interval is not None and key.interval != api_interval:
+            continue
+        meta = cache.meta(key)
+        if meta is None:
+            continue
+        out.append({
+            'symbol': meta['symbol'],
+            'interval': meta['interval'],
+            'timeframe': parse_timeframe(meta['interval'])[1],
+            'first_ms': meta['first_ms'],
+            'last_ms': meta['last_ms'],
+            'rows': meta['rows'],
+            'gaps': len(meta['gaps']),
+            'missing_bars': meta['missing_bars'],
+            'partitions': len(meta['partitions']),
+            'updated_ms': meta['updated_ms'],
+        })
+    return out
+
+def migrate_legacy_cache() -> Dict[str, int]:
+    """Мигрировать все ключи старого CSV-формата в CACHE_DIR. Возвращает {'SYMBOL/interval': rows}."""
+    cache = CandleCache()
+    migrated: Dict[str, int] = {}
+    for legacy in sorted(cache.settings.cache_dir.glob(f'*/*/{LEGACY_CSV_NAME}')):
+        key = CacheKey(symbol=legacy.parent.parent.name, interval=legacy.parent.name)
+        migrated[f'{key.symbol}/{key.interval}'] = migrate_legacy_csv(cache, key)
+    return migrated
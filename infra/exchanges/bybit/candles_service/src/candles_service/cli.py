@@ -43,7 +43,10 @@ def _parse_args(argv: List[str]) -> argparse.Namespace:
     return p.parse_args(argv)
 
 def main(argv: Optional[List[str]] = None) -> int:
-    ns = _parse_args(argv or sys.argv[1:])
+    argv = argv or sys.argv[1:]
+    if argv and argv[0] == 'bootstrap':
+        return bootstrap_main(argv[1:])
+    ns = _parse_args(argv)
     symbols: List[str] = list(ns.symbols or [])
     if ns.symbols_file:
         path = Path(ns.symbols_file)
@@ -67,13 +70,81 @@ def main(argv: Optional[List[str]] = None) -> int:
     # Красивый вывод
     if res:
         print('Downloaded:')
-        for r in res:
-        if r.get('ok'):
-            x = r['result']
+        for x in res:
             print(f" - {x['symbol']:>10s}  {x['timeframe']:>4s}  {x['rows']:>6d} rows  -> {x['saved_file']}")
-        else:
-            print(f" - {r.get('symbol','?'):>10s}  ERROR  {r.get('error','')}")
     return 0
 
+def _parse_bootstrap_args(argv: List[str]) -> argparse.Namespace:
+    p = argparse.ArgumentParser(prog='candles-bootstrap',
+                                description='Bulk history bootstrap into the candle cache (resumable)')
+    p.add_argument('--symbols', '-s', nargs='+', help='Список символов через пробел, например: BTCUSDT ETHUSDT', default=[])
+    p.add_argument('--symbols-file', help='Путь к файлу со списком символов (по одному в строке)')
+    p.add_argument('--timeframe', '-t', required=True, help='Например 1m, 30m, 1h, D')
+    p.add_argument('--category', default='linear', choices=['spot','linear','inverse'])
+    g = p.add_mutually_exclusive_group(required=True)
+    g.add_argument('--hours-back', type=int)
+    g.add_argument('--days-back', type=int)
+    g.add_argument('--months-back', type=int)
+    g.add_argument('--years-back', type=int)
+    g.add_argument('--start-ms', type=int, help='Начало диапазона, мс UTC')
+    p.add_argument('--end-ms', type=int, help='Конец диапазона, мс UTC (по умолчанию — сейчас)')
+    p.add_argument('--manifest', help='Файл чекпоинтов (по умолчанию DATA_DIR/bootstrap/<timeframe>_<category>.json)')
+    p.add_argument('--fresh', action='store_true', help='Начать заново, удалив существующий манифест')
+    p.add_argument('--concurrency', type=int, help='Сколько окон качать одновременно (по умолчанию BYBIT_ASYNC_CONCURRENCY)')
+    p.add_argument('--flush-pages', type=int, help='Раз в сколько окон символа писать в кэш (по умолчанию BACKFILL_CHECKPOINT_PAGES)')
+    p.add_argument('--progress-sec', type=float, default=10.0, help='Период вывода прогресса, сек')
+    return p.parse_args(argv)
+
+def _read_symbols(symbols: List[str], symbols_file: Optional[str]) -> List[str]:
+    out = list(symbols or [])
+    if symbols_file:
+        with Path(symbols_file).open('r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    out.append(line)
+    return list(dict.fromkeys(s.upper() for s in out))
+
+def bootstrap_main(argv: List[str]) -> int:
+    """candles-bootstrap: все окна страниц планируются заранее и качаются общим пулом, прогресс — в манифесте."""
+    import asyncio
+    from .bootstrap import BootstrapManifest, run_bootstrap, default_manifest_path
+    from .service import _targets, _validate_and_mode
+    from .config import get_settings
+    from .utils import now_ms
+
+    ns = _parse_bootstrap_args(argv)
+    try:
+        symbols = _read_symbols(ns.symbols, ns.symbols_file)
+        if not symbols:
+            raise ValueError('Empty symbols list')
+        api_interval, friendly_tf, _ = parse_timeframe(ns.timeframe)
+        req = DownloadRequest(symbol=symbols[0], timeframe=ns.timeframe, category=ns.category,
+                              hours_back=ns.hours_back, days_back=ns.days_back, months_back=ns.months_back,
+                              years_back=ns.years_back, start_ms=ns.start_ms, end_ms=ns.end_ms)
+        start_ms, _ = _targets(*_validate_and_mode(req))
+        path = Path(ns.manifest) if ns.manifest else default_manifest_path(friendly_tf, ns.category)
+        if ns.fresh and path.exists():
+            path.unlink()
+        manifest = BootstrapManifest.load_or_create(
+            path, symbols=symbols, interval=api_interval, category=ns.category,
+            start_ms=start_ms, end_ms=ns.end_ms if ns.end_ms is not None else now_ms(),
+            limit=get_settings().max_bars_per_request)
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 2
+    done, total = manifest.totals()
+    print(f'[bootstrap] {len(manifest.symbols)} symbols, {total} windows, {done} already done; manifest: {manifest.path}', flush=True)
+    try:
+        res = asyncio.run(run_bootstrap(manifest, concurrency=ns.concurrency, flush_pages=ns.flush_pages,
+                                        progress_sec=ns.progress_sec))
+    except KeyboardInterrupt:
+        print(f'Interrupted; progress saved to {manifest.path}', file=sys.stderr)
+        return 130
+    except Exception as e:
+        print(f'Error: {e}; progress saved to {manifest.path}', file=sys.stderr)
+        return 1
+    return 0 if res['windows_done'] == res['windows_total'] else 1
+
 if __name__ == '__main__':
     raise SystemExit(main())
@@ -1,18 +1,39 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 
+# Значения читаются при создании Settings (default_factory), а не при импорте модуля,
+# чтобы get_settings() учитывал переменные окружения, выставленные позже (тесты, CLI).
 @dataclass(frozen=True)
 class Settings:
-    bybit_base_url: str = os.getenv("BYBIT_BASE_URL", "https://api.bybit.com")
-    request_timeout_sec: int = int(os.getenv("REQUEST_TIMEOUT_SEC", "10"))
-    max_bars_per_request: int = int(os.getenv("MAX_BARS_PER_REQUEST", "1000"))
-    data_dir: Path = Path(os.getenv("DATA_DIR", "./data")).resolve()
-    cache_dir: Path = Path(os.getenv("CACHE_DIR", "./cache")).resolve()
-    enable_cache: bool = os.getenv("ENABLE_CACHE", "true").lower() != "false"
-    bybit_qps: float = float(os.getenv("BYBIT_QPS", "5"))
-    bybit_max_retries: int = int(os.getenv("BYBIT_MAX_RETRIES", "3"))
-    bybit_retry_backoff_sec: float = float(os.getenv("BYBIT_RETRY_BACKOFF_SEC", "0.5"))
+    bybit_base_url: str = field(default_factory=lambda: os.getenv("BYBIT_BASE_URL", "https://api.bybit.com"))
+    request_timeout_sec: int = field(default_factory=lambda: int(os.getenv("REQUEST_TIMEOUT_SEC", "10")))
+    max_bars_per_request: int = field(default_factory=lambda: int(os.getenv("MAX_BARS_PER_REQUEST", "1000")))
+    data_dir: Path = field(default_factory=lambda: Path(os.getenv("DATA_DIR", "./data")).resolve())
+    cache_dir: Path = field(default_factory=lambda: Path(os.getenv("CACHE_DIR", "./cache")).resolve())
+    enable_cache: bool = field(default_factory=lambda: os.getenv("ENABLE_CACHE", "true").lower() != "false")
+    bybit_qps: float = field(default_factory=lambda: float(os.getenv("BYBIT_QPS", "5")))
+    bybit_max_retries: int = field(default_factory=lambda: int(os.getenv("BYBIT_MAX_RETRIES", "3")))
+    bybit_retry_backoff_sec: float = field(default_factory=lambda: float(os.getenv("BYBIT_RETRY_BACKOFF_SEC", "0.5")))
+    # Сколько страниц AsyncBybitClient.fetch_range запрашивает одновременно
+    bybit_async_concurrency: int = field(default_factory=lambda: int(os.getenv("BYBIT_ASYNC_CONCURRENCY", "8")))
+    # Как часто (в страницах) сбрасывать накопленные при доливе назад бары в кэш
+    backfill_checkpoint_pages: int = field(default_factory=lambda: int(os.getenv("BACKFILL_CHECKPOINT_PAGES", "20")))
+    # Бюджет процессного LRU прочитанных партиций кэша, МБ (0 — не держать в памяти)
+    frame_cache_mb: int = field(default_factory=lambda: int(os.getenv("FRAME_CACHE_MB", "256")))
+    # Сколько ждать межпроцессную блокировку ключа кэша, сек (-1 — без ограничения)
+    cache_lock_timeout_sec: float = field(default_factory=lambda: float(os.getenv("CACHE_LOCK_TIMEOUT_SEC", "600")))
+    # Собирать старшие таймфреймы из самого мелкого закэшированного интервала символа (по умолчанию выключено)
+    resample_from_base: bool = field(default_factory=lambda: os.getenv("RESAMPLE_FROM_BASE", "false").lower() == "true")
+    # Публичный WebSocket Bybit V5 (к адресу добавляется /<category>)
+    bybit_ws_url: str = field(default_factory=lambda: os.getenv("BYBIT_WS_URL", "wss://stream.bybit.com/v5/public"))
+    # Подписки WS-воркера свечей: SYMBOL:TIMEFRAME через запятую (пусто — воркер не запускается вместе с API)
+    ws_ingest: str = field(default_factory=lambda: os.getenv("WS_INGEST", ""))
+    # Список наблюдения планировщика обновлений: SYMBOL:TIMEFRAME[:CATEGORY] через запятую (пусто — выключен)
+    watchlist: str = field(default_factory=lambda: os.getenv("WATCHLIST", ""))
+    # Состояние фоновых пакетных задач (/candles/jobs) и число потоков на процесс для их символов
+    jobs_dir: Path = field(default_factory=lambda: Path(os.getenv("JOBS_DIR", "./jobs")).resolve())
+    batch_job_workers: int = field(default_factory=lambda: int(os.getenv("BATCH_JOB_WORKERS", "8")))
 
 def get_settings() -> Settings:
     s = Settings()
@@ -0,0 +1,75 @@
+from __future__ import annotations
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .bybit_client import BybitClient
+from .cache import CandleCache, CacheKey
+from .utils import parse_timeframe
+
+_DAY_MS = 24 * 60 * 60 * 1000
+
+def _max_spacing_ms(api_interval: str) -> int:
+    """Максимальный допустимый шаг между соседними барами. Месячные бары неравной длины — до 31 дня."""
+    _, _, interval_ms = parse_timeframe(api_interval)
+    return 31 * _DAY_MS if api_interval == 'M' else interval_ms
+
+def find_gaps(timestamps: pd.Series, api_interval: str) -> List[Tuple[int, int]]:
+    """Пропуски в отсортированной по возрастанию колонке timestamp_ms.
+
+    Возвращает окна [start_ms, end_ms] (включительно), в которых по регулярной сетке interval_ms
+    должны быть бары, но их нет в кэше.
+    """
+    ts = np.asarray(timestamps, dtype='int64')
+    if len(ts) < 2:
+        return []
+    _, _, interval_ms = parse_timeframe(api_interval)
+    diffs = np.diff(ts)
+    idx = np.nonzero(diffs > _max_spacing_ms(api_interval))[0]
+    return [(int(ts[i]) + interval_ms, int(ts[i + 1]) - 1) for i in idx]
+
+def key_gap_report(cache: CandleCache, key: CacheKey) -> Dict[str, Any]:
+    """Отчёт о пропусках ключа по его meta.json (бары не читаются, см. CandleCache.meta)."""
+    meta = cache.meta(key)
+    _, friendly_tf, _ = parse_timeframe(key.interval)
+    return {
+        'symbol': key.symbol,
+        'interval': key.interval,
+        'timeframe': friendly_tf,
+        'rows': meta['rows'] if meta else 0,
+        'first_ms': meta['first_ms'] if meta else None,
+        'last_ms': meta['last_ms'] if meta else None,
+        'missing_bars': meta['missing_bars'] if meta else 0,
+        'gaps': [{'start_ms': start, 'end_ms': end} for start, end in (meta['gaps'] if meta else [])],
+    }
+
+def build_gap_index(cache: Optional[CandleCache] = None, *, symbol: Optional[str] = None,
+                    api_interval: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Индекс пропусков по всем ключам кэша (опционально — только по символу и/или интервалу)."""
+    cache = cache or CandleCache()
+    out: List[Dict[str, Any]] = []
+    for key in cache.keys():
+        if symbol is not None and key.symbol != symbol.upper():
+            continue
+        if api_interval is not None and key.interval != api_interval:
+            continue
+        out.append(key_gap_report(cache, key))
+    return out
+
+def repair_gaps(cache: CandleCache, client: BybitClient, key: CacheKey, *, category: str) -> Dict[str, Any]:
+    """Докачать только недостающие окна ключа. Пропуски, которых нет и на бирже (техработы), останутся в отчёте."""
+    meta = cache.meta(key)
+    gaps = meta['gaps'] if meta else []
+    fetched = 0
+    for start, end in gaps:
+        # под блокировкой ключа, как и остальные писатели: иначе параллельное дописывание партиции потеряет бары
+        with cache.lock(key):
+            bars = client.fetch_range(category=category, symbol=key.symbol, interval=key.interval,
+                                      start_ms=start, end_ms=end)
+            if bars:
+                cache.append_bars(key, bars)
+                fetched += len(bars)
+    report = key_gap_report(cache, key)
+    report['repaired_bars'] = fetched
+    return report
@@ -0,0 +1,35 @@
+from __future__ import annotations
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+def make_etag(*parts: Any) -> str:
+    """Сильный ETag из частей версии (сигнатуры файлов, границы диапазона, формат ответа)."""
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+    return f'"{digest}"'
+
+def http_date(ts_ms: int) -> str:
+    return formatdate(ts_ms / 1000, usegmt=True)
+
+def validator_headers(etag: str, last_modified_ms: Optional[int]) -> Dict[str, str]:
+    """ETag/Last-Modified и no-cache: клиент и прокси хранят ответ, но каждый раз ревалидируют его."""
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if last_modified_ms is not None:
+        headers['Last-Modified'] = http_date(last_modified_ms)
+    return headers
+
+def is_not_modified(if_none_match: Optional[str], if_modified_since: Optional[str], *,
+                    etag: str, last_modified_ms: Optional[int]) -> bool:
+    """Проверка условного GET (RFC 9110): If-None-Match (слабое сравнение, '*') важнее If-Modified-Since."""
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        strip = lambda t: t[2:] if t.startswith('W/') else t
+        return '*' in tags or strip(etag) in {strip(t) for t in tags}
+    if if_modified_since is None or last_modified_ms is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    # Last-Modified передаётся с точностью до секунды
+    return last_modified_ms // 1000 <= int(since.timestamp())
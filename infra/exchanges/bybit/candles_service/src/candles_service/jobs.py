@@ -0,0 +1,290 @@
+from __future__ import annotations
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from filelock import FileLock, Timeout
+
+from .bybit_client import PageProgress, page_progress
+from .config import get_settings
+from .service import DownloadRequest, download_candles, _validate_and_mode
+from .utils import parse_timeframe, now_ms, atomic_path
+
+JOB_DONE = 'done'
+JOB_CANCELLED = 'cancelled'
+JOB_TERMINAL = {JOB_DONE, JOB_CANCELLED}
+SYMBOL_TERMINAL = {'done', 'error', 'cancelled'}
+# Промежуточный прогресс (страницы) пишется на диск не чаще раза в столько секунд
+PERSIST_INTERVAL_SEC = 1.0
+
+MODE_FIELDS = ('candles_back', 'hours_back', 'days_back', 'months_back', 'years_back', 'start_ms', 'end_ms')
+
+class JobCancelled(Exception):
+    pass
+
+class JobStore:
+    """Состояние задач — по JSON-файлу на задачу в JOBS_DIR (пишется атомарно).
+
+    <id>.lock — блокировка владельца: её держит процесс, который выполняет задачу, и она снимается ОС при его смерти.
+    <id>.cancel — маркер отмены, его видит владелец из любого воркера.
+    """
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path(root) if root is not None else get_settings().jobs_dir
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, job_id: str) -> Path:
+        return self.root / f'{job_id}.json'
+
+    def save(self, job: Dict[str, Any]) -> None:
+        with atomic_path(self._path(job['job_id'])) as tmp:
+            tmp.write_text(json.dumps(job, ensure_ascii=False), encoding='utf-8')
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        p = self._path(job_id)
+        if not p.exists():
+            return None
+        return json.loads(p.read_text(encoding='utf-8'))
+
+    def all(self) -> List[Dict[str, Any]]:
+        jobs = [json.loads(p.read_text(encoding='utf-8')) for p in self.root.glob('*.json')]
+        return sorted(jobs, key=lambda j: j['created_ms'])
+
+    def owner_lock(self, job_id: str) -> FileLock:
+        # thread_local=False: берём при запуске задачи, отпускаем из потока, закончившего последний символ
+        return FileLock(str(self.root / f'{job_id}.lock'), thread_local=False)
+
+    def request_cancel(self, job_id: str) -> None:
+        (self.root / f'{job_id}.cancel').touch()
+
+    def cancel_requested(self, job_id: str) -> bool:
+        return (self.root / f'{job_id}.cancel').exists()
+
+def _symbol_state() -> Dict[str, Any]:
+    return {'status': 'pending', 'pages': 0, 'bars_fetched': 0, 'rows': None,
+            'started_ms': None, 'finished_ms': None, 'result': None, 'error': None}
+
+class JobManager:
+    """Пакетные выгрузки в фоне: задача = список символов с общими параметрами download_candles.
+
+    Символы выполняются пулом потоков (BATCH_JOB_WORKERS на процесс). Состояние (статус и прогресс по символам)
+    сохраняется в JobStore при каждом переходе символа и не реже PERSIST_INTERVAL_SEC во время выгрузки;
+    после перезапуска resume() подхватывает незавершённые задачи и докачивает только незавершённые символы —
+    уже выкачанное к тому моменту лежит в кэше.
+    """
+    def __init__(self, store: Optional[JobStore] = None, max_workers: Optional[int] = None,
+                 download: Callable[[DownloadRequest], Dict[str, Any]] = download_candles):
+        self.store = store or JobStore()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or get_settings().batch_job_workers,
+                                        thread_name_prefix='candles-job')
+        self._download = download
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._owners: Dict[str, FileLock] = {}
+        self._persisted_at: Dict[str, float] = {}
+
+    def submit(self, symbols: List[str], *, timeframe: str, category: str = 'linear',
+               out_dir: Optional[str] = None, **mode: Optional[int]) -> Dict[str, Any]:
+        unknown = set(mode) - set(MODE_FIELDS)
+        if unknown:
+            raise ValueError(f'Неизвестные параметры: {", ".join(sorted(unknown))}')
+        syms = list(dict.fromkeys(s.strip().upper() for s in symbols if s and s.strip()))
+        if not syms:
+            raise ValueError('Empty symbols list')
+        parse_timeframe(timeframe)
+        params = {'timeframe': timeframe, 'category': category, 'out_dir': out_dir,
+                  **{k: v for k, v in mode.items() if v is not None}}
+        _validate_and_mode(DownloadRequest(symbol=syms[0], **params))
+        ts = now_ms()
+        job = {'job_id': uuid.uuid4().hex, 'status': 'queued', 'created_ms': ts, 'updated_ms': ts,
+               'started_ms': None, 'finished_ms': None, 'params': params,
+               'symbols': {s: _symbol_state() for s in syms}}
+        owner = self.store.owner_lock(job['job_id'])
+        owner.acquire()
+        self._start(job, owner)
+        return self.progress(job['job_id'])
+
+    def resume(self) -> List[str]:
+        """Подхватить незавершённые задачи, которые не выполняет ни один живой процесс."""
+        resumed: List[str] = []
+        for job in self.store.all():
+            if job['status'] in JOB_TERMINAL or job['job_id'] in self._jobs:
+                continue
+            owner = self.store.owner_lock(job['job_id'])
+            try:
+                owner.acquire(timeout=0)
+            except Timeout:
+                continue
+            for st in job['symbols'].values():
+                if st['status'] not in SYMBOL_TERMINAL:
+                    st.update(_symbol_state())
+            self._start(job, owner)
+            resumed.append(job['job_id'])
+        return resumed
+
+    def _start(self, job: Dict[str, Any], owner: FileLock) -> None:
+        job_id = job['job_id']
+        with self._lock:
+            self._jobs[job_id] = job
+            self._owners[job_id] = owner
+            pending = [s for s, st in job['symbols'].items() if st['status'] == 'pending']
+            self._maybe_finish(job)
+            self._persist(job)
+        for sym in pending:
+            self._pool.submit(self._run_symbol, job_id, sym)
+
+    def _persist(self, job: Dict[str, Any], force: bool = True) -> None:
+        t = time.monotonic()
+        if not force and t - self._persisted_at.get(job['job_id'], 0.0) < PERSIST_INTERVAL_SEC:
+            return
+        job['updated_ms'] = now_ms()
+        self.store.save(job)
+        self._persisted_at[job['job_id']] = t
+
+    def _maybe_finish(self, job: Dict[str, Any]) -> None:
+        if job['status'] in JOB_TERMINAL or not all(st['status'] in SYMBOL_TERMINAL for st in job['symbols'].values()):
+            return
+        job['status'] = JOB_CANCELLED if self.store.cancel_requested(job['job_id']) else JOB_DONE
+        job['finished_ms'] = now_ms()
+        # сначала итог на диск, потом блокировку: иначе resume() другого воркера увидел бы незавершённую задачу
+        self._persist(job)
+        owner = self._owners.pop(job['job_id'], None)
+        if owner is not None:
+            owner.release()
+
+    def _run_symbol(self, job_id: str, sym: str) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            st = job['symbols'][sym]
+            if self.store.cancel_requested(job_id):
+                st['status'] = 'cancelled'
+                self._maybe_finish(job)
+                self._persist(job)
+                return
+            st['status'] = 'running'
+            st['started_ms'] = now_ms()
+            if job['status'] == 'queued':
+                job['status'] = 'running'
+                job['started_ms'] = st['started_ms']
+            self._persist(job)
+
+        def on_page(p: PageProgress) -> None:
+            with self._lock:
+                st['pages'] = p.pages
+                st['bars_fetched'] = p.bars
+                self._persist(job, force=False)
+            if self.store.cancel_requested(job_id):
+                raise JobCancelled()
+
+        token = page_progress.set(PageProgress(on_page))
+        try:
+            res = self._download(DownloadRequest(symbol=sym, **job['params']))
+            outcome = {'status': 'done', 'result': res, 'rows': res.get('rows')}
+        except JobCancelled:
+            outcome = {'status': 'cancelled'}
+        except Exception as e:
+            outcome = {'status': 'error', 'error': str(e)}
+        finally:
+            page_progress.reset(token)
+        with self._lock:
+            st.update(outcome, finished_ms=now_ms())
+            self._maybe_finish(job)
+            self._persist(job)
+
+    def _get(self, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return json.loads(json.dumps(job))
+        job = self.store.load(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def progress(self, job_id: str) -> Dict[str, Any]:
+        """Статус задачи и прогресс по символам (страницы, бары, строки) с оценкой оставшегося времени."""
+        job = self._get(job_id)
+        states = job['symbols']
+        counts: Dict[str, int] = {}
+        for st in states.values():
+            counts[st['status']] = counts.get(st['status'], 0) + 1
+        finished = sum(counts.get(s, 0) for s in SYMBOL_TERMINAL)
+        eta_sec = None
+        if job['status'] not in JOB_TERMINAL and job['started_ms'] and finished:
+            elapsed = (now_ms() - job['started_ms']) / 1000.0
+            eta_sec = round(elapsed / finished * (len(states) - finished), 1)
+        return {
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'cancel_requested': self.store.cancel_requested(job_id),
+            'created_ms': job['created_ms'],
+            'started_ms': job['started_ms'],
+            'finished_ms': job['finished_ms'],
+            'params': job['params'],
+            'total': len(states),
+            'counts': counts,
+            'eta_sec': eta_sec,
+            'symbols': {s: {k: v for k, v in st.items() if k != 'result'} for s, st in states.items()},
+        }
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        return [{k: v for k, v in self.progress(j['job_id']).items() if k != 'symbols'} for j in self.store.all()]
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        """Отменить задачу: ожидающие символы не начнутся, выполняемые прервутся на ближайшей странице."""
+        self._get(job_id)
+        self.store.request_cancel(job_id)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                for st in job['symbols'].values():
+                    if st['status'] == 'pending':
+                        st['status'] = 'cancelled'
+                self._maybe_finish(job)
+                self._persist(job)
+        if job is None:
+            # задачу никто не выполняет (упавший воркер) — закрываем прямо в хранилище
+            owner = self.store.owner_lock(job_id)
+            try:
+                owner.acquire(timeout=0)
+            except Timeout:
+                return self.progress(job_id)
+            try:
+                job = self.store.load(job_id)
+                if job['status'] not in JOB_TERMINAL:
+                    for st in job['symbols'].values():
+                        if st['status'] not in SYMBOL_TERMINAL:
+                            st['status'] = 'cancelled'
+                    job['status'] = JOB_CANCELLED
+                    job['finished_ms'] = now_ms()
+                    self._persist(job)
+            finally:
+                owner.release()
+        return self.progress(job_id)
+
+    def results(self, job_id: str) -> List[Dict[str, Any]]:
+        """Итоги завершённых символов в формате batch_download: ok/result или ok=False/error."""
+        out: List[Dict[str, Any]] = []
+        for sym, st in self._get(job_id)['symbols'].items():
+            if st['status'] == 'done':
+                out.append({'ok': True, 'result': st['result']})
+            elif st['status'] in ('error', 'cancelled'):
+                out.append({'ok': False, 'error': st['error'] or 'cancelled', 'symbol': sym})
+        return out
+
+    def shutdown(self) -> None:
+        """Остановить пул, не дожидаясь выполняемых символов: незавершённое подхватит resume() при следующем запуске."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+_manager_lock = threading.Lock()
+_manager: Optional[JobManager] = None
+
+def get_job_manager() -> JobManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
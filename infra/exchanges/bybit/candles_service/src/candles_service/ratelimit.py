@@ -0,0 +1,128 @@
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from typing import Callable, Mapping, Optional
+
+from .config import get_settings
+
+# Заголовки ответа Bybit V5 с состоянием лимита: https://bybit-exchange.github.io/docs/v5/rate-limit
+HEADER_STATUS = 'X-Bapi-Limit-Status'
+HEADER_RESET = 'X-Bapi-Limit-Reset-Timestamp'
+
+BYBIT_RATE_LIMIT_CODE = 10006
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    v = headers.get(name)
+    if v is None:
+        return None
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Потокобезопасный token bucket на весь процесс.
+
+    Базовая скорость — rate запросов/сек с запасом capacity токенов. Если Bybit прислал заголовки лимита,
+    скорость до момента сброса окна подстраивается под остаток: remaining / (reset - now),
+    при исчерпании остатка все клиенты ждут сброса окна.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 wall_clock: Callable[[], float] = time.time,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.base_rate = max(0.1, float(rate))
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.base_rate)
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._rate = self.base_rate
+        self._rate_until = 0.0
+        self._blocked_until = 0.0
+        self._tokens = self.capacity
+        self._updated = clock()
+
+    @property
+    def rate(self) -> float:
+        with self._lock:
+            self._refill(self._clock())
+            return self._rate
+
+    def _refill(self, now: float) -> None:
+        if self._rate_until and now >= self._rate_until:
+            # окно лимита сброшено — возвращаемся к базовой скорости
+            self._rate = self.base_rate
+            self._rate_until = 0.0
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def _try_take(self) -> float:
+        """Взять токен, если можно (вернёт 0.0), иначе вернуть, сколько секунд подождать до следующей попытки."""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if now >= self._blocked_until and self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return max(self._blocked_until - now, (1.0 - self._tokens) / self._rate)
+
+    def acquire(self) -> float:
+        """Взять токен, при необходимости подождав. Возвращает суммарное время ожидания в секундах."""
+        waited = 0.0
+        while True:
+            wait = self._try_take()
+            if wait <= 0:
+                return waited
+            self._sleep(wait)
+            waited += wait
+
+    async def acquire_async(self) -> float:
+        """То же, что acquire(), но ждёт через asyncio.sleep, не блокируя event loop."""
+        waited = 0.0
+        while True:
+            wait = self._try_take()
+            if wait <= 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def block_for(self, seconds: float) -> None:
+        """Остановить выдачу токенов всем клиентам на seconds (например, после ошибки 10006)."""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._blocked_until = max(self._blocked_until, now + max(0.0, seconds))
+            self._tokens = 0.0
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Подстроить скорость по X-Bapi-Limit-Status (остаток) и X-Bapi-Limit-Reset-Timestamp (мс UTC)."""
+        remaining = _header_int(headers, HEADER_STATUS)
+        reset_ms = _header_int(headers, HEADER_RESET)
+        if remaining is None or reset_ms is None:
+            return
+        until_reset = reset_ms / 1000.0 - self._wall_clock()
+        if until_reset <= 0:
+            return
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if remaining <= 0:
+                self._blocked_until = max(self._blocked_until, now + until_reset)
+                self._tokens = 0.0
+                return
+            self._rate = max(0.1, remaining / until_reset)
+            self._rate_until = now + until_reset
+            self._tokens = min(self._tokens, float(remaining))
+
+_shared_lock = threading.Lock()
+_shared: Optional[TokenBucket] = None
+
+def get_rate_limiter() -> TokenBucket:
+    """Общий для всех BybitClient в процессе лимитер (создаётся лениво со скоростью BYBIT_QPS)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = TokenBucket(get_settings().bybit_qps)
+        return _shared
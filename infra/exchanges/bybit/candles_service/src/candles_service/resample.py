@@ -0,0 +1,153 @@
+from __future__ import annotations
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .bybit_client import BybitClient
+from .cache import CandleCache, CacheKey, STORED_DTYPES, empty_candles_df
+from .utils import now_ms, parse_timeframe
+
+_DAY_MS = 24 * 60 * 60 * 1000
+_WEEK_MS = 7 * _DAY_MS
+# Недельные бары Bybit начинаются в понедельник 00:00 UTC; 1970-01-05 — первый понедельник эпохи
+_WEEK_ANCHOR_MS = 4 * _DAY_MS
+
+def bucket_starts(ts_ms: np.ndarray, api_interval: str) -> np.ndarray:
+    """Начало бара таймфрейма api_interval, в который попадает каждая метка (мс UTC)."""
+    ts = np.asarray(ts_ms, dtype='int64')
+    if api_interval == 'M':
+        return ts.astype('datetime64[ms]').astype('datetime64[M]').astype('datetime64[ms]').astype('int64')
+    if api_interval == 'W':
+        return ts - (ts - _WEEK_ANCHOR_MS) % _WEEK_MS
+    _, _, interval_ms = parse_timeframe(api_interval)
+    return ts - ts % interval_ms
+
+def bucket_lengths_ms(starts: np.ndarray, api_interval: str) -> np.ndarray:
+    """Длительность каждого бара (для M — длина календарного месяца)."""
+    starts = np.asarray(starts, dtype='int64')
+    if api_interval == 'M':
+        months = starts.astype('datetime64[ms]').astype('datetime64[M]')
+        return ((months + 1).astype('datetime64[ms]').astype('int64') - starts)
+    _, _, interval_ms = parse_timeframe(api_interval)
+    return np.full(len(starts), interval_ms, dtype='int64')
+
+def bucket_range(start_ms: int, end_ms: int, api_interval: str) -> np.ndarray:
+    """Начала всех баров api_interval, пересекающих [start_ms, end_ms]."""
+    first = int(bucket_starts(np.array([start_ms]), api_interval)[0])
+    if api_interval == 'M':
+        months = np.arange(np.datetime64(first, 'ms').astype('datetime64[M]'),
+                           np.datetime64(end_ms, 'ms').astype('datetime64[M]') + 1)
+        return months.astype('datetime64[ms]').astype('int64')
+    step = _WEEK_MS if api_interval == 'W' else parse_timeframe(api_interval)[2]
+    return np.arange(first, end_ms + 1, step, dtype='int64')
+
+def bucket_back(end_ms: int, api_interval: str, n: int) -> int:
+    """Начало бара, отстоящего на n-1 баров назад от бара, содержащего end_ms."""
+    last = int(bucket_starts(np.array([end_ms]), api_interval)[0])
+    if api_interval == 'M':
+        month = np.datetime64(last, 'ms').astype('datetime64[M]') - (n - 1)
+        return int(month.astype('datetime64[ms]').astype('int64'))
+    step = _WEEK_MS if api_interval == 'W' else parse_timeframe(api_interval)[2]
+    return last - (n - 1) * step
+
+def can_derive(base_interval: str, target_interval: str) -> bool:
+    """Бар target ровно собирается из баров base (base мельче и границы совпадают)."""
+    if base_interval == target_interval:
+        return False
+    base_ms = parse_timeframe(base_interval)[2]
+    if target_interval == 'M':
+        return base_interval not in ('W', 'M') and _DAY_MS % base_ms == 0
+    if base_interval in ('W', 'M'):
+        return False
+    target_ms = parse_timeframe(target_interval)[2]
+    return base_ms < target_ms and target_ms % base_ms == 0
+
+def resample_bars(df: pd.DataFrame, base_interval: str, target_interval: str) -> pd.DataFrame:
+    """Агрегировать бары base в target: open — первый, high — max, low — min, close — последний,
+    volume/turnover — сумма. Кроме колонок хранимой схемы возвращает n_bars и complete
+    (бар собран из полного числа баров base).
+    """
+    if df.empty:
+        out = empty_candles_df()
+        out['n_bars'] = pd.Series(dtype='int64')
+        out['complete'] = pd.Series(dtype='bool')
+        return out
+    df = df.sort_values('timestamp_ms', kind='stable')
+    buckets = bucket_starts(df['timestamp_ms'].to_numpy(), target_interval)
+    g = df.groupby(buckets, sort=True)
+    out = pd.DataFrame({
+        'open': g['open'].first(),
+        'high': g['high'].max(),
+        'low': g['low'].min(),
+        'close': g['close'].last(),
+        'volume': g['volume'].sum(),
+        'turnover': g['turnover'].sum(),
+        'n_bars': g['timestamp_ms'].count(),
+    })
+    out.insert(0, 'timestamp_ms', out.index.to_numpy(dtype='int64'))
+    out = out.reset_index(drop=True)
+    expected = bucket_lengths_ms(out['timestamp_ms'].to_numpy(), target_interval) // parse_timeframe(base_interval)[2]
+    out['complete'] = out['n_bars'].to_numpy() == expected
+    return out.astype({**STORED_DTYPES, 'n_bars': 'int64'})
+
+def finest_base_interval(cache: CandleCache, symbol: str, target_interval: str) -> Optional[str]:
+    """Самый мелкий закэшированный интервал символа, из которого можно собрать target."""
+    candidates = [k.interval for k in cache.keys()
+                  if k.symbol == symbol.upper() and can_derive(k.interval, target_interval)]
+    return min(candidates, key=lambda i: parse_timeframe(i)[2]) if candidates else None
+
+def _contiguous_spans(values: np.ndarray, positions: np.ndarray) -> List[Tuple[int, int]]:
+    """Группы подряд идущих позиций -> (первое значение, последнее значение)."""
+    spans: List[Tuple[int, int]] = []
+    if len(positions) == 0:
+        return spans
+    breaks = np.nonzero(np.diff(positions) > 1)[0]
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(positions) - 1]))
+    for s, e in zip(starts, ends):
+        spans.append((int(values[positions[s]]), int(values[positions[e]])))
+    return spans
+
+def derive_range(cache: CandleCache, client: Optional[BybitClient], base_df: pd.DataFrame, symbol: str, *,
+                 base_interval: str, target_interval: str, category: str,
+                 start_ms: int, end_ms: int, now: Optional[int] = None) -> pd.DataFrame:
+    """Бары target_interval за [start_ms, end_ms], собранные из base_df.
+
+    Бары, которые из base собрать целиком нельзя (нет покрытия, дыры), берутся из кэша target, а чего нет и там —
+    докачиваются из Bybit только по непокрытым окнам (client=None — без сети, только кэш).
+    Неполным допускается только текущий, ещё открытый бар — содержащий now (по умолчанию — текущий момент);
+    бар из прошлого, обрезанный end_ms, собирается целиком, как и остальные пропуски.
+    """
+    expected = bucket_range(start_ms, end_ms, target_interval)
+    if len(expected) == 0:
+        return empty_candles_df()
+    base_sel = base_df[(base_df['timestamp_ms'] >= int(expected[0])) & (base_df['timestamp_ms'] <= end_ms)]
+    derived = resample_bars(base_sel, base_interval, target_interval)
+    current = int(bucket_starts(np.array([now_ms() if now is None else now]), target_interval)[0])
+    ok = derived['complete'] | (derived['timestamp_ms'] == current)
+    derived = derived.loc[ok, list(STORED_DTYPES)]
+
+    missing_pos = np.nonzero(~np.isin(expected, derived['timestamp_ms'].to_numpy()))[0]
+    if len(missing_pos) == 0:
+        return derived.reset_index(drop=True)
+
+    key = CacheKey(symbol=symbol.upper(), interval=target_interval)
+    lengths = bucket_lengths_ms(expected, target_interval)
+    parts = [derived]
+    for span_start, span_last in _contiguous_spans(expected, missing_pos):
+        span_end = span_last + int(lengths[np.searchsorted(expected, span_last)]) - 1
+        cached = cache.load(key, span_start, span_end)
+        have = set(cached['timestamp_ms'].tolist()) if cached is not None else set()
+        want = expected[(expected >= span_start) & (expected <= span_last)]
+        if client is not None and not all(int(t) in have for t in want):
+            with cache.lock(key):
+                bars = client.fetch_range(category=category, symbol=symbol, interval=target_interval,
+                                          start_ms=span_start, end_ms=span_end)
+                if bars:
+                    cache.append_bars(key, bars)
+            cached = cache.load(key, span_start, span_end)
+        if cached is not None and not cached.empty:
+            parts.append(cached)
+    out = pd.concat(parts, ignore_index=True)
+    return out.drop_duplicates(subset=['timestamp_ms']).sort_values('timestamp_ms').reset_index(drop=True)
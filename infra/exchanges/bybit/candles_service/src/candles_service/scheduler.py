@@ -0,0 +1,176 @@
+from __future__ import annotations
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .bybit_client import BybitClient
+from .cache import CandleCache, CacheKey
+from .config import get_settings
+from .resample import bucket_starts, bucket_lengths_ms
+from .utils import parse_timeframe, now_ms
+
+log = logging.getLogger(__name__)
+
+@dataclass
+class WatchItem:
+    key: CacheKey
+    category: str
+    friendly_tf: str
+    last_bar_ms: Optional[int] = None
+    refreshed_at_ms: Optional[int] = None
+    error: Optional[str] = None
+
+# Ключи, которые в этом процессе обновляет запущенный планировщик, и их состояние
+_watched_lock = threading.Lock()
+_watched: Dict[Tuple[str, str], WatchItem] = {}
+
+def is_watched(key: CacheKey) -> bool:
+    with _watched_lock:
+        return (key.symbol, key.interval) in _watched
+
+def watched_item(key: CacheKey) -> Optional[WatchItem]:
+    """Состояние ключа в запущенном планировщике (None — ключ не в списке наблюдения)."""
+    with _watched_lock:
+        return _watched.get((key.symbol, key.interval))
+
+def _set_watched(items: Iterable[WatchItem], watched: bool) -> None:
+    with _watched_lock:
+        for item in items:
+            if watched:
+                _watched[(item.key.symbol, item.key.interval)] = item
+            else:
+                _watched.pop((item.key.symbol, item.key.interval), None)
+
+def parse_watchlist(spec: str) -> List[Tuple[str, str, str]]:
+    """'BTCUSDT:1h,ETHUSDT:1m:spot' -> [('BTCUSDT', '1h', 'linear'), ('ETHUSDT', '1m', 'spot')]."""
+    out: List[Tuple[str, str, str]] = []
+    for item in (s.strip() for s in spec.split(',')):
+        if not item:
+            continue
+        parts = item.split(':')
+        if len(parts) not in (2, 3) or not all(parts):
+            raise ValueError(f'Ожидается SYMBOL:TIMEFRAME[:CATEGORY], получено: {item}')
+        parse_timeframe(parts[1])
+        out.append((parts[0].upper(), parts[1], parts[2] if len(parts) == 3 else 'linear'))
+    return out
+
+def _bar_end_ms(start_ms: int, api_interval: str) -> int:
+    return start_ms + int(bucket_lengths_ms(np.array([start_ms]), api_interval)[0])
+
+def next_close_ms(now: int, api_interval: str) -> int:
+    """Ближайшая граница закрытия бара интервала после now."""
+    return _bar_end_ms(int(bucket_starts(np.array([now]), api_interval)[0]), api_interval)
+
+def staleness_ms(last_bar_ms: Optional[int], api_interval: str, now: int) -> Optional[int]:
+    """На сколько кэш отстаёт от последнего закрытого бара: 0 — последний закрытый (или текущий) бар уже в кэше."""
+    if last_bar_ms is None:
+        return None
+    current = int(bucket_starts(np.array([now]), api_interval)[0])
+    return max(0, current - _bar_end_ms(last_bar_ms, api_interval))
+
+class RefreshScheduler:
+    """Фоновое обновление кэша по списку наблюдения (symbol, timeframe, category).
+
+    Просыпается на границах закрытия баров (interval_ms из parse_timeframe; W и M — по календарю) плюс settle_sec,
+    пока Bybit закрывает бар, и обновляет все ключи, чей бар закрылся. Одновременно идёт не больше BYBIT_QPS обновлений —
+    остальное выравнивает общий лимитер процесса. Пока планировщик запущен, ключи отмечены в is_watched(),
+    и запросы по ним берут данные из кэша, не дожидаясь сети, — пока последнее обновление ключа удачно и не отстало
+    (см. watched_item).
+    """
+    def __init__(self, watchlist: Iterable[Tuple[str, str, str]], *, cache: Optional[CandleCache] = None,
+                 client: Optional[BybitClient] = None, settle_sec: float = 2.0,
+                 clock: Callable[[], int] = now_ms, sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep):
+        self.items: List[WatchItem] = []
+        for symbol, tf, category in watchlist:
+            api_interval, friendly_tf, _ = parse_timeframe(tf)
+            self.items.append(WatchItem(CacheKey(symbol=symbol.upper(), interval=api_interval), category, friendly_tf))
+        if not self.items:
+            raise ValueError('Пустой список наблюдения')
+        self.cache = cache or CandleCache()
+        self.client = client or BybitClient()
+        self.settle_sec = settle_sec
+        self.concurrency = max(1, int(get_settings().bybit_qps))
+        self._clock = clock
+        self._sleep = sleep
+        self._stopping = False
+        self.runs = 0
+
+    def refresh_item(self, item: WatchItem) -> int:
+        """Дотянуть ключ до текущего момента. Последний сохранённый бар перезапрашивается:
+        он мог быть записан ещё не закрытым. Пустой ключ получает одну страницу свежих баров.
+        """
+        key = item.key
+        with self.cache.lock(key):
+            meta = self.cache.meta(key)
+            last = meta['last_ms'] if meta else None
+            if last is None:
+                bars = self.client.fetch_klines_page(category=item.category, symbol=key.symbol, interval=key.interval,
+                                                     limit=get_settings().max_bars_per_request)
+            else:
+                bars = self.client.update_forward(category=item.category, symbol=key.symbol, interval=key.interval,
+                                                  from_exclusive_ms=last - 1)
+            self.cache.append_bars(key, bars, prefer_new=True)
+        starts = [int(b[0]) for b in bars] + ([last] if last is not None else [])
+        if starts:
+            item.last_bar_ms = max(starts)
+        item.refreshed_at_ms = self._clock()
+        return len(bars)
+
+    async def refresh(self, items: List[WatchItem]) -> int:
+        """Обновить ключи пачкой: не больше concurrency одновременно, ошибки ключа не мешают остальным."""
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def one(item: WatchItem) -> int:
+            async with sem:
+                try:
+                    n = await asyncio.to_thread(self.refresh_item, item)
+                    item.error = None
+                    return n
+                except Exception as e:
+                    item.error = str(e)
+                    log.warning('Обновление %s/%s не удалось: %s', item.key.symbol, item.friendly_tf, e)
+                    return 0
+
+        self.runs += 1
+        return sum(await asyncio.gather(*(one(i) for i in items)))
+
+    def due(self, boundary_ms: int) -> List[WatchItem]:
+        """Ключи, у которых на boundary_ms закрывается бар."""
+        return [i for i in self.items if int(bucket_starts(np.array([boundary_ms]), i.key.interval)[0]) == boundary_ms]
+
+    def next_wakeup_ms(self, now: int) -> int:
+        return min(next_close_ms(now, i.key.interval) for i in self.items)
+
+    async def run(self) -> None:
+        """Первичное обновление всех ключей, затем — на каждой границе закрытия баров до stop()."""
+        _set_watched(self.items, True)
+        try:
+            await self.refresh(self.items)
+            while not self._stopping:
+                boundary = self.next_wakeup_ms(self._clock())
+                await self._sleep(max(0.0, (boundary - self._clock()) / 1000.0) + self.settle_sec)
+                if self._stopping:
+                    break
+                await self.refresh(self.due(boundary))
+        finally:
+            _set_watched(self.items, False)
+
+    def stop(self) -> None:
+        self._stopping = True
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = self._clock()
+        return [{
+            'symbol': i.key.symbol,
+            'timeframe': i.friendly_tf,
+            'category': i.category,
+            'last_bar_ms': i.last_bar_ms,
+            'refreshed_at_ms': i.refreshed_at_ms,
+            'staleness_ms': staleness_ms(i.last_bar_ms, i.key.interval, now),
+            'next_refresh_ms': next_close_ms(now, i.key.interval),
+            'error': i.error,
+        } for i in self.items]
@@ -1,17 +1,22 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List
 
+import numpy as np
 import pandas as pd
 from datetime import datetime, timezone, timedelta
 from dateutil.relativedelta import relativedelta
 
 from .config import get_settings
-from .utils import parse_timeframe, now_ms
-import concurrent.futures
+from .utils import parse_timeframe, now_ms, plan_page_windows, atomic_path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .bybit_client import BybitClient
-from .cache import CandleCache, CacheKey
+from .cache import CandleCache, CacheKey, empty_candles_df, with_iso
+from .singleflight import SingleFlight
+from .resample import finest_base_interval, derive_range, bucket_back, bucket_range, bucket_starts
+from .ws_ingest import is_live
+from .scheduler import watched_item, staleness_ms
 
 @dataclass
 class DownloadRequest:
@@ -24,6 +29,26 @@ class DownloadRequest:
     months_back: Optional[int] = None
     years_back: Optional[int] = None
     out_dir: Optional[str] = None
+    # Явный диапазон (мс UTC): start_ms — ещё один режим наравне с *_back, end_ms — верхняя граница для любого режима
+    start_ms: Optional[int] = None
+    end_ms: Optional[int] = None
+    # Собрать таймфрейм из более мелкого закэшированного интервала (None — по RESAMPLE_FROM_BASE)
+    resample: Optional[bool] = None
+    # Только кэш, без запросов в Bybit (что есть — то и отдаём)
+    offline: bool = False
+    # Допустимое отставание кэша от последнего закрытого бара, сек: пока оно не превышено, вперёд не дотягиваем
+    max_staleness_sec: Optional[int] = None
+
+@dataclass
+class CandleRange:
+    """Итог планирования запроса: ключ кэша и точные границы выдачи (включительно)."""
+    key: CacheKey
+    friendly_tf: str
+    mode: str
+    value: int
+    start_ms: Optional[int]
+    end_ms: Optional[int]
+    rows: int
 
 def _validate_and_mode(req: DownloadRequest) -> Tuple[str, int]:
     provided = {k: v for k, v in {
@@ -32,12 +57,17 @@ def _validate_and_mode(req: DownloadRequest) -> Tuple[str, int]:
         'days_back': req.days_back,
         'months_back': req.months_back,
         'years_back': req.years_back,
+        'start_ms': req.start_ms,
     }.items() if v is not None}
     if len(provided) != 1:
-        raise ValueError('Ровно один из параметров обязателен: candles_back | hours_back | days_back | months_back | years_back')
+        raise ValueError('Ровно один из параметров обязателен: candles_back | hours_back | days_back | months_back | years_back | start_ms')
     mode, value = next(iter(provided.items()))
     if value <= 0:
         raise ValueError(f'{mode} должен быть положительным')
+    if req.end_ms is not None and mode == 'start_ms' and req.end_ms < value:
+        raise ValueError('end_ms должен быть не меньше start_ms')
+    if req.max_staleness_sec is not None and req.max_staleness_sec < 0:
+        raise ValueError('max_staleness_sec должен быть неотрицательным')
     return mode, int(value)
 
 def _friendly_suffix(mode: str, value: int) -> str:
@@ -62,51 +92,190 @@ def _output_path(base: Path, symbol: str, friendly_tf: str, start_ms: int, end_m
     fname = f"candles_{start_date}-{end_date}.csv"
     return _symbol_tf_dir(base, symbol, friendly_tf) / fname
 
-def _ensure_cache_for_range(cache: CandleCache, client: BybitClient, symbol: str, api_interval: str,
-                            *, category: str, target_start_ms: Optional[int], need_count: Optional[int]) -> pd.DataFrame:
+def _coverage_ok(rows: int, earliest_ms: Optional[int], *, target_start_ms: Optional[int], need_count: Optional[int]) -> bool:
+    if need_count is not None and rows < need_count:
+        return False
+    if target_start_ms is not None and (earliest_ms is None or earliest_ms > target_start_ms):
+        return False
+    return True
+
+def _coverage_from(cache: CandleCache, key: CacheKey, meta: Optional[Dict[str, Any]], *,
+                   need_count: Optional[int], end_ms: Optional[int]) -> Tuple[int, Optional[int]]:
+    """(число строк, начало истории) для плана доливки назад.
+
+    Для candles_back с end_ms в прошлом выдаются только бары <= end_ms — их и считаем (по сводке партиций,
+    читается только партиция с end_ms), а если end_ms раньше начала кэша, доливаем назад прямо от end_ms
+    (бары между ним и кэшем запросу не нужны).
+    """
+    if need_count is None or end_ms is None:
+        return (meta['rows'], meta['first_ms']) if meta else (0, None)
+    if meta is None or end_ms < meta['first_ms']:
+        return 0, end_ms + 1
+    if end_ms >= meta['last_ms']:
+        return meta['rows'], meta['first_ms']
+    return cache.span(key, end_ms=end_ms)[2], meta['first_ms']
+
+def _backfill_history(cache: CandleCache, client: BybitClient, key: CacheKey, symbol: str, *, category: str,
+                      earliest_ms: Optional[int], rows: int,
+                      target_start_ms: Optional[int], need_count: Optional[int]) -> int:
+    """«Доливает» историю назад страницами, двигая end-курсор от earliest_ms (None — от текущего момента).
+
+    Страницы копятся в памяти и сливаются в кэш одним append_bars раз в BACKFILL_CHECKPOINT_PAGES страниц
+    (чекпоинт, чтобы падение не стоило всего прогресса) и в конце. Так стоимость растёт линейно с числом страниц.
+    Возвращает число полученных баров.
+    """
+    settings = get_settings()
+    checkpoint_every = max(1, settings.backfill_checkpoint_pages)
+    if need_count is None and target_start_ms is not None:
+        # Глубина задана временем — окна страниц известны заранее, качаем их конкурентно
+        _, _, interval_ms = parse_timeframe(key.interval)
+        end_ms = earliest_ms - 1 if earliest_ms is not None else now_ms()
+        windows = plan_page_windows(target_start_ms, end_ms, interval_ms, settings.max_bars_per_request)
+        if len(windows) > 1:
+            return _backfill_windows(cache, client, key, symbol, category=category,
+                                     windows=windows, checkpoint_every=checkpoint_every)
+    pending: List[List[str]] = []
+    fetched = 0
+    pages = 0
+    while not _coverage_ok(rows, earliest_ms, target_start_ms=target_start_ms, need_count=need_count):
+        limit = settings.max_bars_per_request
+        if need_count is not None:
+            limit = min(limit, max(1, need_count - rows))
+        end = earliest_ms - 1 if earliest_ms is not None else None
+        page = client.fetch_klines_page(category=category, symbol=symbol, interval=key.interval, end=end, limit=limit)
+        if not page:
+            break
+        pending.extend(page)
+        fetched += len(page)
+        rows += len(page)
+        # Bybit отдаёт страницу от новых к старым
+        earliest_ms = int(page[-1][0])
+        pages += 1
+        if pages % checkpoint_every == 0:
+            cache.append_bars(key, pending)
+            pending = []
+    if pending:
+        cache.append_bars(key, pending)
+    return fetched
+
+def _backfill_windows(cache: CandleCache, client: BybitClient, key: CacheKey, symbol: str, *, category: str,
+                      windows: List[Tuple[int, int]], checkpoint_every: int) -> int:
+    """Конкурентная выгрузка заранее рассчитанных окон пачками по checkpoint_every, от новых к старым.
+    Каждая пачка сразу сливается в кэш (чекпоинт). Пустая пачка означает, что раньше истории нет.
+    """
+    fetched = 0
+    for hi in range(len(windows), 0, -checkpoint_every):
+        chunk = windows[max(0, hi - checkpoint_every):hi]
+        bars = client.fetch_range(category=category, symbol=symbol, interval=key.interval,
+                                  start_ms=chunk[0][0], end_ms=chunk[-1][1])
+        if not bars:
+            break
+        cache.append_bars(key, bars)
+        fetched += len(bars)
+    return fetched
+
+def _is_fresh(key: CacheKey, meta: Optional[Dict[str, Any]], max_staleness_ms: int) -> bool:
+    """Дотягивать вперёд нечего: ключ обновляется в фоне (WS; список наблюдения — если последнее обновление
+    ключа удалось и не отстало больше чем на max_staleness_ms) или последний закрытый бар (с тем же допуском)
+    уже в кэше — новый бар не может появиться раньше закрытия текущего.
+    """
+    if is_live(key):
+        return True
+    item = watched_item(key)
+    if (item is not None and item.error is None and item.last_bar_ms is not None
+            and staleness_ms(item.last_bar_ms, key.interval, now_ms()) <= max_staleness_ms):
+        return True
+    if meta is None:
+        return False
+    now = now_ms()
+    lag = staleness_ms(meta['last_ms'], key.interval, now)
+    if meta.get('open_ms') is not None:
+        # бар, записанный открытым, — не закрытый: последний закрытый в кэше — предыдущий
+        current = int(bucket_starts(np.array([now]), key.interval)[0])
+        lag = max(lag, current - meta['open_ms'])
+    return lag <= max_staleness_ms
+
+def _ensure_coverage(cache: CandleCache, client: BybitClient, symbol: str, api_interval: str,
+                     *, category: str, target_start_ms: Optional[int], need_count: Optional[int],
+                     end_ms: Optional[int] = None, max_staleness_ms: int = 0) -> Optional[Dict[str, Any]]:
     """Гарантируем, что кэш покрывает требуемый диапазон по времени или количеству.
 
     1) Если кэш пуст — качаем последовательно страницы от «свежих» в прошлое до выполнения условий.
-    2) Иначе: дотягиваем вперёд новые бары, затем при необходимости «доливаем» назад, двигая end-курсор.
+    2) Иначе: дотягиваем вперёд новые бары (только если они уже могли закрыться, см. _is_fresh) вместе с баром,
+       записанным ещё открытым (meta['open_ms']), затем при необходимости «доливаем» назад, двигая end-курсор.
+    План строится по meta.json ключа (первый/последний бар, число строк) — сами бары не читаются
+    (кроме меток партиции с end_ms для candles_back, см. _coverage_from), и свежий кэш, покрывающий запрос,
+    отдаётся без единого запроса в Bybit.
+    Возвращает сводку ключа после заполнения (None — на бирже нет ни одного бара).
     """
     key = CacheKey(symbol=symbol.upper(), interval=api_interval)
-    df = cache.load(key)
-    if df is None:
-        df = pd.DataFrame(columns=['timestamp_ms','start_time_iso','open','high','low','close','volume','turnover'])
-
-    now = now_ms()
+    meta = cache.meta(key)
 
-    if df.empty:
+    if meta is None:
         # Начальная загрузка
-        bars = client.fetch_until(category=category, symbol=symbol, interval=api_interval,
-                                  need_count=need_count, start_threshold_ms=target_start_ms)
-        df = cache.merge_and_save(key, bars)
+        _, earliest = _coverage_from(cache, key, None, need_count=need_count, end_ms=end_ms)
+        changed = _backfill_history(cache, client, key, symbol, category=category, earliest_ms=earliest, rows=0,
+                                    target_start_ms=target_start_ms, need_count=need_count)
     else:
         # Дотянуть новые бары «вперёд»
-        last_ts = int(df['timestamp_ms'].iloc[-1])
-        forward = client.update_forward(category=category, symbol=symbol, interval=api_interval, from_exclusive_ms=last_ts)
+        forward: List[List[str]] = []
+        if not _is_fresh(key, meta, max_staleness_ms):
+            # бар, записанный открытым, перезапрашиваем вместе с новыми — закрытая версия заменит сохранённую
+            since = meta['last_ms'] if meta.get('open_ms') is None else min(meta['open_ms'], meta['last_ms']) - 1
+            forward = client.update_forward(category=category, symbol=symbol, interval=api_interval,
+                                            from_exclusive_ms=since)
         if forward:
-            df = cache.merge_and_save(key, forward)
+            cache.append_bars(key, forward, prefer_new=True)
+            meta = cache.meta(key)
+        # Доливаем назад страницами
+        rows, earliest = _coverage_from(cache, key, meta, need_count=need_count, end_ms=end_ms)
+        changed = len(forward) + _backfill_history(
+            cache, client, key, symbol, category=category, earliest_ms=earliest, rows=rows,
+            target_start_ms=target_start_ms, need_count=need_count)
 
-        # Проверка необходимости «назад»
-        def coverage_ok() -> bool:
-            ok = True
-            if need_count is not None and len(df) < need_count:
-                ok = False
-            if target_start_ms is not None and (df.empty or int(df['timestamp_ms'].iloc[0]) > target_start_ms):
-                ok = False
-            return ok
+    if changed:
+        meta = cache.meta(key)
+    return meta
 
-        # Доливаем назад страницами
-        while not coverage_ok():
-            earliest = int(df['timestamp_ms'].iloc[0]) if not df.empty else now
-            page = client.fetch_klines_page(category=category, symbol=symbol, interval=api_interval,
-                                            end=earliest - 1, limit=get_settings().max_bars_per_request)
-            if not page:
-                break
-            df = cache.merge_and_save(key, page)
-            # цикл продолжится пока не покроем условия или не иссякнут данные
+# Одновременные заполнения кэша одного ключа внутри процесса схлопываются в один вызов
+_cache_fills = SingleFlight()
+
+def _fill_cache(cache: CandleCache, client: BybitClient, symbol: str, api_interval: str,
+                *, category: str, target_start_ms: Optional[int], need_count: Optional[int],
+                end_ms: Optional[int] = None, offline: bool = False,
+                max_staleness_ms: int = 0) -> Optional[Dict[str, Any]]:
+    """_ensure_coverage под single-flight (в процессе) и файловой блокировкой ключа (между воркерами).
+
+    Ведомые получают сводку ведущего; если его диапазона или свежести не хватает (ведущий просил меньше) —
+    дозаполняют сами, уже под блокировкой и по тёплому кэшу. offline=True — только сводка кэша, без сети и блокировок.
+    """
+    key = CacheKey(symbol=symbol.upper(), interval=api_interval)
+    if offline:
+        return cache.meta(key)
+
+    def fill() -> Optional[Dict[str, Any]]:
+        with cache.lock(key):
+            return _ensure_coverage(cache, client, symbol, api_interval, category=category,
+                                    target_start_ms=target_start_ms, need_count=need_count, end_ms=end_ms,
+                                    max_staleness_ms=max_staleness_ms)
+
+    meta, leader = _cache_fills.do((key.symbol, key.interval), fill)
+    if not leader:
+        rows, earliest = _coverage_from(cache, key, meta, need_count=need_count, end_ms=end_ms)
+        if (not _coverage_ok(rows, earliest, target_start_ms=target_start_ms, need_count=need_count)
+                or not _is_fresh(key, meta, max_staleness_ms)):
+            meta = fill()
+    return meta
 
+def _load_selection(cache: CandleCache, key: CacheKey, *, target_start_ms: Optional[int], need_count: Optional[int],
+                    end_ms: Optional[int], columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Прочитать из кэша только выдаваемые бары (те же, что отбирает _select), не трогая остальные партиции."""
+    if need_count is not None:
+        return cache.load_tail(key, need_count, end_ms=end_ms, columns=columns)
+    df = cache.load(key, target_start_ms, end_ms, columns=columns)
+    if df is None:
+        df = empty_candles_df()
+        return df[columns] if columns is not None else df
     return df
 
 def _compute_target_start_ms(mode: str, value: int) -> int:
@@ -160,35 +329,90 @@ def batch_download(symbols: List[str], *, timeframe: str, category: str = 'linea
             out.append(fut.result())
     return out
 
+def _targets(mode: str, value: int) -> Tuple[Optional[int], Optional[int]]:
+    """(target_start_ms, need_count) для режима запроса."""
+    if mode == 'candles_back':
+        return None, value
+    if mode == 'start_ms':
+        return value, None
+    factor = {
+        'hours_back': 60*60*1000,
+        'days_back': 24*60*60*1000,
+        'months_back': 30*24*60*60*1000,
+        'years_back': 365*24*60*60*1000,
+    }[mode]
+    return now_ms() - value * factor, None
+
+def _freshness(req: DownloadRequest) -> Dict[str, Any]:
+    """Параметры свежести запроса для _fill_cache."""
+    return {'offline': req.offline, 'max_staleness_ms': (req.max_staleness_sec or 0) * 1000}
+
+def _select(df: pd.DataFrame, *, target_start_ms: Optional[int], need_count: Optional[int],
+            end_ms: Optional[int]) -> pd.DataFrame:
+    if end_ms is not None:
+        df = df[df['timestamp_ms'] <= end_ms]
+    if need_count is not None:
+        return df.tail(need_count)
+    return df[df['timestamp_ms'] >= target_start_ms]
+
+def resolve_range(req: DownloadRequest) -> CandleRange:
+    """Заполнить кэш под запрос и вернуть точные границы выдачи — без выгрузки данных: границы и число строк
+    берутся из сводки партиций (CandleCache.span), метки читаются только у граничных партиций.
+    Сами бары потом читаются из кэша по партициям (CandleCache.iter_range).
+    """
+    mode, value = _validate_and_mode(req)
+    api_interval, friendly_tf, _ = parse_timeframe(req.timeframe)
+    target_start_ms, need_count = _targets(mode, value)
+    cache = CandleCache()
+    _fill_cache(cache, BybitClient(), req.symbol, api_interval, category=req.category,
+                target_start_ms=target_start_ms, need_count=need_count, end_ms=req.end_ms, **_freshness(req))
+    key = CacheKey(symbol=req.symbol.upper(), interval=api_interval)
+    first, last, rows = cache.span(key, None if need_count is not None else target_start_ms, req.end_ms,
+                                   last_n=need_count)
+    return CandleRange(key, friendly_tf, mode, value, first, last, rows)
+
+def _derive_candles(cache: CandleCache, client: BybitClient, req: DownloadRequest, *, base_interval: str,
+                    api_interval: str, target_start_ms: Optional[int], need_count: Optional[int]) -> pd.DataFrame:
+    """Свечи api_interval, собранные из кэша base_interval.
+
+    Базовый ключ только дотягивается вперёд (назад его не доливаем: это стоило бы в разы больше запросов,
+    чем качать целевой таймфрейм); то, что из базы собрать нельзя, derive_range берёт из Bybit по окнам.
+    """
+    _fill_cache(cache, client, req.symbol, base_interval, category=req.category,
+                target_start_ms=None, need_count=1, **_freshness(req))
+    end_ms = min(req.end_ms, now_ms()) if req.end_ms is not None else now_ms()
+    start_ms = target_start_ms if need_count is None else bucket_back(end_ms, api_interval, need_count)
+    # из базы нужны только бары, попадающие в корзины [start_ms, end_ms]
+    base_df = cache.load(CacheKey(symbol=req.symbol.upper(), interval=base_interval),
+                         int(bucket_range(start_ms, start_ms, api_interval)[0]), end_ms)
+    if base_df is None:
+        base_df = empty_candles_df()
+    df = derive_range(cache, None if req.offline else client, base_df, req.symbol, base_interval=base_interval,
+                      target_interval=api_interval, category=req.category, start_ms=start_ms, end_ms=end_ms,
+                      now=now_ms())
+    return _select(df, target_start_ms=target_start_ms, need_count=need_count, end_ms=req.end_ms)
+
 def download_candles(req: DownloadRequest) -> Dict[str, Any]:
     settings = get_settings()
     mode, value = _validate_and_mode(req)
     api_interval, friendly_tf, interval_ms = parse_timeframe(req.timeframe)
-
-    need_count: Optional[int] = None
-    target_start_ms: Optional[int] = None
-    if mode == 'candles_back':
-        need_count = value
-    else:
-        factor = {
-            'hours_back': 60*60*1000,
-            'days_back': 24*60*60*1000,
-            'months_back': 30*24*60*60*1000,
-            'years_back': 365*24*60*60*1000,
-        }[mode]
-        target_start_ms = now_ms() - value * factor
+    target_start_ms, need_count = _targets(mode, value)
 
     cache = CandleCache()
     client = BybitClient()
 
-    df = _ensure_cache_for_range(cache, client, req.symbol, api_interval,
-                                 category=req.category, target_start_ms=target_start_ms, need_count=need_count)
-
-    if need_count is not None:
-        df_out = df.tail(need_count).copy()
+    resample = settings.resample_from_base if req.resample is None else req.resample
+    base_interval = finest_base_interval(cache, req.symbol, api_interval) if resample else None
+    if base_interval is not None:
+        df_out = _derive_candles(cache, client, req, base_interval=base_interval, api_interval=api_interval,
+                                 target_start_ms=target_start_ms, need_count=need_count).copy()
     else:
-        df_out = df[df['timestamp_ms'] >= target_start_ms].copy()
-
+        _fill_cache(cache, client, req.symbol, api_interval, category=req.category,
+                    target_start_ms=target_start_ms, need_count=need_count, end_ms=req.end_ms,
+                    **_freshness(req))
+        key = CacheKey(symbol=req.symbol.upper(), interval=api_interval)
+        df_out = _load_selection(cache, key, target_start_ms=target_start_ms, need_count=need_count,
+                                 end_ms=req.end_ms).copy()
     df_out = df_out.sort_values('timestamp_ms', ascending=True).reset_index(drop=True)
 
     out_dir = Path(req.out_dir).resolve() if req.out_dir else settings.data_dir
@@ -196,7 +420,8 @@ def download_candles(req: DownloadRequest) -> Dict[str, Any]:
     end_ms = int(df_out['timestamp_ms'].iloc[-1]) if not df_out.empty else now_ms()
     out_path = _output_path(out_dir, req.symbol, friendly_tf, start_ms, end_ms)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    df_out.to_csv(out_path, index=False)
+    with atomic_path(out_path) as tmp:
+        with_iso(df_out).to_csv(tmp, index=False)
 
     return {
         'saved_file': str(out_path),
@@ -206,4 +431,5 @@ def download_candles(req: DownloadRequest) -> Dict[str, Any]:
         'category': req.category,
         'mode': mode,
         'value': value,
+        'resampled_from': parse_timeframe(base_interval)[1] if base_interval else None,
     }
@@ -0,0 +1,86 @@
+from __future__ import annotations
+import io
+from typing import Iterable, Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from .cache import CANDLE_COLUMNS, STORED_DTYPES, with_iso
+
+MEDIA_CSV = 'text/csv'
+MEDIA_NDJSON = 'application/x-ndjson'
+MEDIA_ARROW = 'application/vnd.apache.arrow.stream'
+
+# Синонимы из Accept -> канонический тип ответа
+_MEDIA_ALIASES = {
+    'text/csv': MEDIA_CSV,
+    'application/x-ndjson': MEDIA_NDJSON,
+    'application/ndjson': MEDIA_NDJSON,
+    'application/jsonl': MEDIA_NDJSON,
+    'application/vnd.apache.arrow.stream': MEDIA_ARROW,
+}
+
+# Максимум строк в одном куске потока (партиция 1m за месяц — ~45k строк)
+CHUNK_ROWS = 10_000
+
+def negotiate_media_type(accept: Optional[str]) -> Optional[str]:
+    """Выбрать формат по заголовку Accept (с учётом q). Пусто или */* — CSV; None — ничего подходящего."""
+    if not accept or not accept.strip():
+        return MEDIA_CSV
+    ranked = []
+    for pos, part in enumerate(accept.split(',')):
+        fields = [f.strip() for f in part.split(';')]
+        media = fields[0].lower()
+        q = 1.0
+        for f in fields[1:]:
+            if f.startswith('q='):
+                try:
+                    q = float(f[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            ranked.append((-q, pos, media))
+    for _, _, media in sorted(ranked):
+        if media in _MEDIA_ALIASES:
+            return _MEDIA_ALIASES[media]
+        if media in ('*/*', 'text/*'):
+            return MEDIA_CSV
+        if media == 'application/*':
+            return MEDIA_NDJSON
+    return None
+
+def _chunks(frames: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    for df in frames:
+        for i in range(0, len(df), CHUNK_ROWS):
+            yield df.iloc[i:i + CHUNK_ROWS]
+
+def _csv_stream(frames: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    yield (','.join(CANDLE_COLUMNS) + '\n').encode()
+    for chunk in _chunks(frames):
+        yield with_iso(chunk).to_csv(header=False, index=False).encode()
+
+def _ndjson_stream(frames: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    for chunk in _chunks(frames):
+        yield with_iso(chunk).to_json(orient='records', lines=True).encode().rstrip(b'\n') + b'\n'
+
+ARROW_SCHEMA = pa.schema([(c, pa.int64() if t == 'int64' else pa.float64()) for c, t in STORED_DTYPES.items()])
+
+def _arrow_stream(frames: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    # Arrow IPC stream: схема, затем по RecordBatch на кусок. Колонки типизированные, start_time_iso не нужен.
+    sink = io.BytesIO()
+    with ipc.new_stream(sink, ARROW_SCHEMA) as writer:
+        for chunk in _chunks(frames):
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=ARROW_SCHEMA, preserve_index=False))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+def stream_frames(frames: Iterable[pd.DataFrame], media_type: str) -> Iterator[bytes]:
+    """Ленивая сериализация кадров в выбранный формат: в памяти одновременно только один кусок."""
+    if media_type == MEDIA_ARROW:
+        return _arrow_stream(frames)
+    if media_type == MEDIA_NDJSON:
+        return _ndjson_stream(frames)
+    return _csv_stream(frames)
@@ -1,6 +1,13 @@
 from __future__ import annotations
+import os
+import uuid
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
-from typing import Tuple
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
 
 _MIN_TO_MS = 60_000
 _HOUR_TO_MS = 60 * _MIN_TO_MS
@@ -58,3 +65,43 @@ def now_ms() -> int:
 
 def iso_from_ms(ts_ms: int) -> str:
     return datetime.fromtimestamp(ts_ms/1000, tz=timezone.utc).isoformat()
+
+def iso_series_from_ms(ts_ms: pd.Series) -> pd.Series:
+    """Векторный аналог iso_from_ms для колонки timestamp_ms (формат datetime.isoformat для UTC).
+    Через numpy.datetime_as_string — на порядок быстрее Series.dt.strftime.
+    """
+    values = np.asarray(ts_ms, dtype='int64').astype('datetime64[ms]')
+    whole = values.astype('datetime64[s]')
+    # isoformat() добавляет микросекунды только если они ненулевые
+    has_frac = values != whole
+    text = np.where(has_frac, np.datetime_as_string(values.astype('datetime64[us]'), unit='us'),
+                    np.datetime_as_string(whole, unit='s'))
+    return pd.Series(np.char.add(text.astype(str), '+00:00'), index=ts_ms.index, name='start_time_iso')
+
+def plan_page_windows(start_ms: int, end_ms: int, interval_ms: int, limit: int) -> List[Tuple[int, int]]:
+    """Разбить [start_ms, end_ms] на окна [start, end] по limit баров шага interval_ms (по возрастанию времени).
+
+    Бары идут с регулярным шагом, поэтому все окна страниц можно вычислить заранее, без курсора
+    от предыдущей страницы. Первое окно выравнивается по сетке interval_ms.
+    """
+    if end_ms < start_ms:
+        return []
+    step = interval_ms * max(1, limit)
+    cur = start_ms - (start_ms % interval_ms)
+    windows: List[Tuple[int, int]] = []
+    while cur <= end_ms:
+        windows.append((cur, min(cur + step - 1, end_ms)))
+        cur += step
+    return windows
+
+@contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    """Временный путь рядом с path; при успешном выходе файл атомарно (os.replace) подменяет path.
+    Имя уникально для процесса и вызова, поэтому параллельные писатели не портят чужие временные файлы.
+    """
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp')
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
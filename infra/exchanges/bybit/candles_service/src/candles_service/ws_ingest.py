@@ -0,0 +1,194 @@
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import websockets
+
+from .bybit_client import BybitClient
+from .cache import CandleCache, CacheKey
+from .config import get_settings
+from .resample import bucket_starts
+from .utils import parse_timeframe, now_ms
+
+log = logging.getLogger(__name__)
+
+# Bybit принимает не больше 10 топиков в одном запросе subscribe
+SUBSCRIBE_BATCH = 10
+
+# Ключи, которые сейчас поддерживает живое WS-подключение в этом процессе: запросы по ним не ходят в REST вперёд
+_live_lock = threading.Lock()
+_live: Set[Tuple[str, str]] = set()
+
+def is_live(key: CacheKey) -> bool:
+    with _live_lock:
+        return (key.symbol, key.interval) in _live
+
+def _set_live(keys: Iterable[CacheKey], live: bool) -> None:
+    ids = {(k.symbol, k.interval) for k in keys}
+    with _live_lock:
+        if live:
+            _live.update(ids)
+        else:
+            _live.difference_update(ids)
+
+def parse_subscriptions(spec: str) -> List[Tuple[str, str]]:
+    """'BTCUSDT:1m,ETHUSDT:1h' -> [('BTCUSDT', '1m'), ('ETHUSDT', '1h')]."""
+    out: List[Tuple[str, str]] = []
+    for item in (s.strip() for s in spec.split(',')):
+        if not item:
+            continue
+        symbol, sep, tf = item.partition(':')
+        if not sep or not symbol or not tf:
+            raise ValueError(f'Ожидается SYMBOL:TIMEFRAME, получено: {item}')
+        parse_timeframe(tf)
+        out.append((symbol.upper(), tf))
+    return out
+
+def closed_bars(bars: List[List[str]], interval: str, now: int) -> List[List[str]]:
+    """Только закрытые бары: отбрасываем бар, в который попадает now (он ещё формируется)."""
+    current = int(bucket_starts(np.array([now]), interval)[0])
+    return [b for b in bars if int(b[0]) < current]
+
+class KlineIngestor:
+    """Подписка на публичные топики kline.<interval>.<symbol> Bybit V5 и дозапись закрытых баров в CandleCache.
+
+    Пишутся только бары с confirm=true (по одному на закрытие интервала), под файловой блокировкой ключа.
+    При каждом (пере)подключении после подписки то, что пропущено за время разрыва, докачивается через REST.
+    Пока подключение живо, ключи отмечены в is_live(), и запросы по ним обслуживаются из кэша без REST.
+    """
+    def __init__(self, subscriptions: Iterable[Tuple[str, str]], *, category: str = 'linear',
+                 url: Optional[str] = None, cache: Optional[CandleCache] = None,
+                 client: Optional[BybitClient] = None, ping_interval_sec: float = 20.0,
+                 reconnect_delay_sec: float = 1.0, max_reconnect_delay_sec: float = 30.0):
+        self.keys = [CacheKey(symbol=s.upper(), interval=parse_timeframe(tf)[0]) for s, tf in subscriptions]
+        if not self.keys:
+            raise ValueError('Пустой список подписок')
+        self.category = category
+        self.url = url or f'{get_settings().bybit_ws_url.rstrip("/")}/{category}'
+        self.cache = cache or CandleCache()
+        self.client = client or BybitClient()
+        self.ping_interval_sec = ping_interval_sec
+        self.reconnect_delay_sec = reconnect_delay_sec
+        self.max_reconnect_delay_sec = max_reconnect_delay_sec
+        self.stats: Dict[str, Any] = {'connects': 0, 'messages': 0, 'bars': 0, 'backfilled_bars': 0, 'last_error': None}
+        self._stopping = False
+        self._ws = None
+
+    @staticmethod
+    def topic(key: CacheKey) -> str:
+        return f'kline.{key.interval}.{key.symbol}'
+
+    def _key_for_topic(self, topic: str) -> Optional[CacheKey]:
+        parts = topic.split('.', 2)
+        if len(parts) != 3 or parts[0] != 'kline':
+            return None
+        return CacheKey(symbol=parts[2], interval=parts[1])
+
+    def _ingest(self, key: CacheKey, bars: List[List[str]]) -> None:
+        with self.cache.lock(key):
+            self.cache.append_bars(key, bars, prefer_new=True)
+        self.stats['bars'] += len(bars)
+
+    def _backfill_key(self, key: CacheKey) -> int:
+        """Докачать закрытые бары после последнего сохранённого (его тоже — он мог быть сохранён открытым).
+        Пустой ключ не трогаем: первичную загрузку делает обычный путь запроса.
+        """
+        with self.cache.lock(key):
+            meta = self.cache.meta(key)
+            if meta is None:
+                return 0
+            bars = self.client.update_forward(category=self.category, symbol=key.symbol, interval=key.interval,
+                                              from_exclusive_ms=meta['last_ms'] - 1)
+            bars = closed_bars(bars, key.interval, now_ms())
+            self.cache.append_bars(key, bars, prefer_new=True)
+        return len(bars)
+
+    async def backfill(self) -> int:
+        n = 0
+        for key in self.keys:
+            n += await asyncio.to_thread(self._backfill_key, key)
+        self.stats['backfilled_bars'] += n
+        return n
+
+    async def handle_message(self, raw: Any) -> None:
+        msg = json.loads(raw)
+        if msg.get('op') == 'subscribe' and not msg.get('success', True):
+            log.warning('Bybit отклонил подписку: %s', msg.get('ret_msg'))
+            return
+        key = self._key_for_topic(msg.get('topic', ''))
+        if key is None:
+            return
+        self.stats['messages'] += 1
+        bars = [[str(d['start']), d['open'], d['high'], d['low'], d['close'], d['volume'], d['turnover']]
+                for d in msg.get('data', []) if d.get('confirm')]
+        if bars:
+            await asyncio.to_thread(self._ingest, key, bars)
+
+    async def _ping(self, ws) -> None:
+        while True:
+            await asyncio.sleep(self.ping_interval_sec)
+            await ws.send(json.dumps({'op': 'ping'}))
+
+    async def run_once(self) -> None:
+        """Одно подключение: подписка, REST-догрузка пропущенного, чтение до разрыва."""
+        async with websockets.connect(self.url) as ws:
+            self._ws = ws
+            self.stats['connects'] += 1
+            topics = [self.topic(k) for k in self.keys]
+            for i in range(0, len(topics), SUBSCRIBE_BATCH):
+                await ws.send(json.dumps({'op': 'subscribe', 'args': topics[i:i + SUBSCRIBE_BATCH]}))
+            # догружаем после подписки: бары, закрывшиеся во время догрузки, придут в буфер сокета
+            await self.backfill()
+            _set_live(self.keys, True)
+            pinger = asyncio.create_task(self._ping(ws))
+            try:
+                async for raw in ws:
+                    await self.handle_message(raw)
+            finally:
+                pinger.cancel()
+                _set_live(self.keys, False)
+                self._ws = None
+
+    async def run(self) -> None:
+        """Работать до stop(): переподключение с экспоненциальной паузой после ошибок."""
+        delay = self.reconnect_delay_sec
+        while not self._stopping:
+            try:
+                await self.run_once()
+                delay = self.reconnect_delay_sec
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+                log.warning('WS kline: %s, переподключение через %.1f с', e, delay)
+            if self._stopping:
+                break
+            await asyncio.sleep(delay)
+            delay = min(self.max_reconnect_delay_sec, delay * 2)
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._ws is not None:
+            await self._ws.close()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    p = argparse.ArgumentParser(description='Поток закрытых свечей Bybit (WebSocket) в кэш')
+    p.add_argument('subscriptions', nargs='?', default=None,
+                   help='SYMBOL:TIMEFRAME через запятую, например BTCUSDT:1m,ETHUSDT:1h (по умолчанию WS_INGEST)')
+    p.add_argument('--category', default='linear', help='spot | linear | inverse')
+    args = p.parse_args(argv)
+    subs = parse_subscriptions(args.subscriptions or get_settings().ws_ingest)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(KlineIngestor(subs, category=args.category).run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,44 @@
+import asyncio
+import httpx
+from candles_service.bybit_client import AsyncBybitClient
+from candles_service.ratelimit import TokenBucket
+from candles_service.utils import plan_page_windows
+
+STEP = 60*60*1000
+START = 1_700_000_000_000 - (1_700_000_000_000 % STEP)
+
+def test_plan_page_windows():
+    windows = plan_page_windows(START + 5, START + 25*STEP, STEP, 10)
+    assert windows == [
+        (START, START + 10*STEP - 1),
+        (START + 10*STEP, START + 20*STEP - 1),
+        (START + 20*STEP, START + 25*STEP),
+    ]
+
+def test_fetch_range_concurrent_and_ordered(monkeypatch):
+    monkeypatch.setenv('MAX_BARS_PER_REQUEST', '10')
+    state = {'inflight': 0, 'max_inflight': 0, 'calls': 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        state['calls'] += 1
+        state['inflight'] += 1
+        state['max_inflight'] = max(state['max_inflight'], state['inflight'])
+        await asyncio.sleep(0.01)
+        state['inflight'] -= 1
+        start, end = int(request.url.params['start']), int(request.url.params['end'])
+        limit = int(request.url.params['limit'])
+        bars = [[str(t), '1', '2', '0.5', '1.5', '10', '15'] for t in range(start, end + 1, STEP)]
+        bars = list(reversed(bars))[:limit]
+        return httpx.Response(200, json={'retCode': 0, 'retMsg': 'OK', 'result': {'list': bars}})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = AsyncBybitClient(client=http, limiter=TokenBucket(1000, capacity=1000), concurrency=4)
+            return await client.fetch_range(category='linear', symbol='BTCUSDT', interval='60',
+                                            start_ms=START, end_ms=START + 99*STEP)
+
+    bars = asyncio.run(run())
+    ts = [int(b[0]) for b in bars]
+    assert ts == [START + i*STEP for i in range(99, -1, -1)]
+    assert state['calls'] == 10
+    assert 1 < state['max_inflight'] <= 4
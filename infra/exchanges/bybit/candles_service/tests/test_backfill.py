@@ -0,0 +1,47 @@
+import pytest
+from candles_service.bybit_client import BybitClient
+from candles_service.cache import CandleCache, CacheKey
+from candles_service.service import _ensure_coverage
+
+STEP = 60*60*1000
+LATEST = 1_700_000_000_000
+
+def fake_fetch_klines_page(self, *, category, symbol, interval, limit=200, end=None, start=None):
+    t = LATEST if end is None else end - (end % STEP)
+    return [[str(t - i*STEP), '1','2','0.5','1.5','10','15'] for i in range(limit)]
+
+def test_backfill_merges_once_per_checkpoint(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('MAX_BARS_PER_REQUEST', '10')
+    monkeypatch.setenv('BACKFILL_CHECKPOINT_PAGES', '4')
+    monkeypatch.setattr(BybitClient, 'fetch_klines_page', fake_fetch_klines_page)
+    merges = []
+    orig = CandleCache.append_bars
+    def counting_append(self, key, bars):
+        merges.append(len(bars))
+        return orig(self, key, bars)
+    monkeypatch.setattr(CandleCache, 'append_bars', counting_append)
+
+    meta = _ensure_coverage(CandleCache(), BybitClient(), 'BTCUSDT', '60', category='linear',
+                            target_start_ms=None, need_count=100)
+    assert meta['rows'] == 100
+    assert meta['last_ms'] == LATEST and meta['gaps'] == []
+    # 10 страниц: два чекпоинта по 4 страницы и финальный остаток
+    assert merges == [40, 40, 20]
+
+def test_backfill_checkpoint_survives_crash(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('MAX_BARS_PER_REQUEST', '10')
+    monkeypatch.setenv('BACKFILL_CHECKPOINT_PAGES', '2')
+    calls = {'n': 0}
+    def flaky(self, **kw):
+        calls['n'] += 1
+        if calls['n'] == 4:
+            raise RuntimeError('network down')
+        return fake_fetch_klines_page(self, **kw)
+    monkeypatch.setattr(BybitClient, 'fetch_klines_page', flaky)
+
+    with pytest.raises(RuntimeError):
+        _ensure_coverage(CandleCache(), BybitClient(), 'BTCUSDT', '60', category='linear',
+                         target_start_ms=None, need_count=100)
+    assert CandleCache().meta(CacheKey(symbol='BTCUSDT', interval='60'))['rows'] == 20
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+from candles_service.cache import CandleCache, with_iso
+from candles_service.utils import iso_from_ms
+
+def test_bars_to_df_vectorized():
+    bars = [
+        ['1700003600000', '37000.5', '37100', '36900.25', '37050', '12.5', '463125.0'],
+        ['1700000000000', '36950', '37010', '36800', '37000.5', '8', '295600'],
+    ]
+    df = CandleCache._bars_to_df(bars)
+    assert list(df['timestamp_ms']) == [1_700_000_000_000, 1_700_003_600_000]
+    assert df['timestamp_ms'].dtype == np.int64
+    assert df.dtypes.drop('timestamp_ms').eq(np.float64).all()
+    assert df.iloc[1].to_dict() == {
+        'timestamp_ms': 1_700_003_600_000, 'open': 37000.5, 'high': 37100.0, 'low': 36900.25,
+        'close': 37050.0, 'volume': 12.5, 'turnover': 463125.0,
+    }
+
+def test_iso_matches_scalar_isoformat():
+    ts = pd.Series([1_700_000_000_000, 1_700_000_000_123, 0])
+    assert list(with_iso(pd.DataFrame({'timestamp_ms': ts}))['start_time_iso']) == [iso_from_ms(int(t)) for t in ts]
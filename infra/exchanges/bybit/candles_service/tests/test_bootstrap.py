@@ -0,0 +1,75 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from candles_service import bybit_client, cli
+from candles_service.bootstrap import BootstrapManifest, run_bootstrap
+from candles_service.bybit_client import AsyncBybitClient
+from candles_service.cache import CandleCache, CacheKey
+from candles_service.ratelimit import TokenBucket
+
+STEP = 60*60*1000
+START = 1_700_000_000_000 - (1_700_000_000_000 % STEP)
+END = START + 95*STEP
+
+@pytest.fixture
+def fake_api(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('DATA_DIR', str(tmp_path/'data'))
+    monkeypatch.setenv('MAX_BARS_PER_REQUEST', '10')
+    monkeypatch.setenv('BYBIT_MAX_RETRIES', '0')
+    monkeypatch.setattr(bybit_client, 'get_rate_limiter', lambda: TokenBucket(1000, capacity=1000))
+    state = {'calls': [], 'fail_at': None}
+
+    async def fake_request(self, params):
+        state['calls'].append((params['symbol'], params['start']))
+        if state['fail_at'] is not None and len(state['calls']) == state['fail_at']:
+            raise RuntimeError('network down')
+        start, end, limit = params['start'], params['end'], params['limit']
+        bars = [[str(t), '1', '2', '0.5', '1.5', '10', '15'] for t in range(start, end + 1, STEP)]
+        return {'list': list(reversed(bars))[:limit]}
+
+    monkeypatch.setattr(AsyncBybitClient, '_request', fake_request)
+    return state
+
+def test_cli_bootstrap_fills_cache_and_reports(fake_api, tmp_path, capsys):
+    manifest = tmp_path/'m.json'
+    rc = cli.main(['bootstrap', '-s', 'BTCUSDT', 'ethusdt', '-t', '1h', '--start-ms', str(START),
+                   '--end-ms', str(END), '--manifest', str(manifest), '--concurrency', '3', '--flush-pages', '4'])
+    assert rc == 0
+    out = capsys.readouterr().out
+    assert '20 windows, 0 already done' in out
+    assert 'windows 20/20 (100.0%)  bars 192' in out and 'req/s' in out
+    for sym in ('BTCUSDT', 'ETHUSDT'):
+        df = CandleCache().load(CacheKey(sym, '60'))
+        assert len(df) == 96 and df['timestamp_ms'].iloc[0] == START
+    data = json.loads(manifest.read_text())
+    assert data['symbols']['BTCUSDT'] == {'done': [[0, 9]], 'bars': 96}
+
+def test_interrupted_run_resumes_remaining_windows(fake_api, tmp_path):
+    path = tmp_path/'m.json'
+    make = lambda: BootstrapManifest.load_or_create(path, symbols=['BTCUSDT'], interval='60', category='linear',
+                                                    start_ms=START, end_ms=END, limit=10)
+    fake_api['fail_at'] = 6
+    with pytest.raises(RuntimeError):
+        asyncio.run(run_bootstrap(make(), concurrency=1, flush_pages=2, out=io.StringIO()))
+    done, total = make().totals()
+    assert (done, total) == (5, 10)
+    assert len(CandleCache().load(CacheKey('BTCUSDT', '60'))) == 50
+
+    fake_api['fail_at'] = None
+    fake_api['calls'].clear()
+    res = asyncio.run(run_bootstrap(make(), concurrency=2, out=io.StringIO()))
+    assert res['windows_done'] == res['windows_total'] == 10
+    assert len(fake_api['calls']) == 5
+    assert len(CandleCache().load(CacheKey('BTCUSDT', '60'))) == 96
+
+def test_manifest_rejects_different_plan(fake_api, tmp_path):
+    path = tmp_path/'m.json'
+    BootstrapManifest.load_or_create(path, symbols=['BTCUSDT'], interval='60', category='linear',
+                                     start_ms=START, end_ms=END, limit=10).save()
+    with pytest.raises(ValueError):
+        BootstrapManifest.load_or_create(path, symbols=['BTCUSDT'], interval='1', category='linear',
+                                         start_ms=START, end_ms=END, limit=10)
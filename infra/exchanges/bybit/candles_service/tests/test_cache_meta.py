@@ -0,0 +1,134 @@
+import json
+
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from candles_service import cache as cache_mod
+from candles_service.api import app
+from candles_service.bybit_client import BybitClient
+from candles_service.cache import CandleCache, CacheKey
+from candles_service.service import DownloadRequest, download_candles, resolve_range
+
+STEP = 60*60*1000
+START = 1_698_793_200_000  # 2023-10-31 23:00 UTC: бары ключа ложатся в две месячные партиции
+
+def bars_at(ts_list):
+    return [[str(t), '1', '2', '0.5', '1.5', '10', '15'] for t in sorted(ts_list, reverse=True)]
+
+def test_meta_tracks_writes_and_cross_partition_gaps(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    cache = CandleCache()
+    key = CacheKey('BTCUSDT', '60')
+    assert cache.meta(key) is None
+    # 23:00 (октябрь), затем пропуск 00:00–01:00 на границе месяцев, затем 02:00–05:00 (ноябрь)
+    cache.append_bars(key, bars_at([START] + [START + i*STEP for i in range(3, 7)]))
+    meta = cache.meta(key)
+    assert sorted(meta['partitions']) == ['2023-10', '2023-11']
+    assert (meta['first_ms'], meta['last_ms'], meta['rows']) == (START, START + 6*STEP, 5)
+    assert meta['gaps'] == [[START + STEP, START + 3*STEP - 1]] and meta['missing_bars'] == 2
+    assert meta['updated_ms'] is not None
+
+    cache.append_bars(key, bars_at([START + STEP, START + 2*STEP]))
+    meta = cache.meta(key)
+    assert meta['rows'] == 7 and meta['gaps'] == [] and meta['missing_bars'] == 0
+
+def test_meta_recovers_from_stale_or_missing_manifest(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    cache = CandleCache()
+    key = CacheKey('BTCUSDT', '60')
+    cache.append_bars(key, bars_at([START + i*STEP for i in range(5)]))
+    path = cache._dir(key) / 'meta.json'
+    path.unlink()
+    assert cache.meta(key)['rows'] == 5 and path.exists()
+
+    # партиция переписана в обход meta.json — пересчитывается только она, когда процесс сверяет сводку заново
+    p = cache._partition_path(key, '2023-11')
+    df = pd.read_parquet(p)
+    df.iloc[:2].to_parquet(p, index=False)
+    cache_mod._metas.clear()                                 # новый процесс
+    meta = cache.meta(key)
+    assert meta['rows'] == 3 and meta['last_ms'] == START + 2*STEP
+    assert json.loads(path.read_text())['rows'] == 3
+
+def test_meta_trusted_until_manifest_changes(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    cache = CandleCache()
+    key = CacheKey('BTCUSDT', '60')
+    cache.append_bars(key, bars_at([START + i*STEP for i in range(5)]))
+    assert cache.meta(key)['rows'] == 5
+    # пока meta.json не менялся, партиции не перечисляются и не сверяются
+    scans = []
+    real = CandleCache.partitions
+    monkeypatch.setattr(CandleCache, 'partitions', lambda self, key: scans.append(key) or real(self, key))
+    assert cache.meta(key)['rows'] == 5
+    assert scans == []
+
+    # meta.json переписан другим процессом — сводка сверяется заново
+    path = cache._dir(key) / 'meta.json'
+    stored = json.loads(path.read_text())
+    stored['updated_ms'] = 42
+    path.write_text(json.dumps(stored) + ' ')
+    assert cache.meta(key)['updated_ms'] == 42
+    assert scans == [key]
+
+def test_tail_request_plans_from_meta_and_reads_only_needed_partitions(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('DATA_DIR', str(tmp_path/'data'))
+    cache = CandleCache()
+    key = CacheKey('BTCUSDT', '60')
+    # октябрь целиком и начало ноября
+    cache.append_bars(key, bars_at([START - i*STEP for i in range(200)] + [START + i*STEP for i in range(1, 30)]))
+    last = START + 29*STEP
+    monkeypatch.setattr(BybitClient, 'update_forward', lambda self, **kw: [])
+    monkeypatch.setattr(CandleCache, 'load_timestamps',
+                        lambda self, key: (_ for _ in ()).throw(AssertionError('full timestamp scan')))
+    read = []
+    orig = CandleCache._read_partition
+    def spy(self, key, month, columns=None, populate=True):
+        read.append(month)
+        return orig(self, key, month, columns=columns, populate=populate)
+    monkeypatch.setattr(CandleCache, '_read_partition', spy)
+
+    res = download_candles(DownloadRequest(symbol='BTCUSDT', timeframe='1h', candles_back=10))
+    assert res['rows'] == 10
+    assert set(read) == {'2023-11'}
+    out = pd.read_csv(res['saved_file'])
+    assert out['timestamp_ms'].iloc[-1] == last and out['timestamp_ms'].iloc[0] == last - 9*STEP
+
+def test_tail_with_end_ms_plans_from_manifest_and_reads_boundary_partitions(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('DATA_DIR', str(tmp_path/'data'))
+    cache = CandleCache()
+    key = CacheKey('BTCUSDT', '60')
+    # с сентября по декабрь: end_ms в ноябре, последние 150 баров до него начинаются в октябре
+    cache.append_bars(key, bars_at([START + i*STEP for i in range(-1000, 800)]))
+    monkeypatch.setattr(BybitClient, 'update_forward', lambda self, **kw: [])
+    read = []
+    orig = CandleCache._read_partition
+    def spy(self, key, month, columns=None, populate=True):
+        read.append(month)
+        return orig(self, key, month, columns=columns, populate=populate)
+    monkeypatch.setattr(CandleCache, '_read_partition', spy)
+
+    end = START + 100*STEP + 1
+    rng = resolve_range(DownloadRequest(symbol='BTCUSDT', timeframe='1h', candles_back=150, end_ms=end))
+    assert (rng.start_ms, rng.end_ms, rng.rows) == (START - 49*STEP, START + 100*STEP, 150)
+    assert set(read) == {'2023-10', '2023-11'}
+    # диапазон по времени: внутренние партиции берутся из сводки
+    read.clear()
+    assert cache.span(key, START - 900*STEP, START + 780*STEP) == (START - 900*STEP, START + 780*STEP, 1681)
+    assert set(read) == {'2023-09', '2023-12'}
+
+def test_cache_index_endpoint(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    cache = CandleCache()
+    cache.append_bars(CacheKey('BTCUSDT', '60'), bars_at([START + i*STEP for i in range(5) if i != 2]))
+    cache.append_bars(CacheKey('ETHUSDT', '1'), bars_at([START + i*60_000 for i in range(3)]))
+    client = TestClient(app)
+    resp = client.get('/candles/cache/index')
+    assert resp.status_code == 200, resp.text
+    assert [(x['symbol'], x['timeframe']) for x in resp.json()] == [('BTCUSDT', '1h'), ('ETHUSDT', '1m')]
+    [btc] = client.get('/candles/cache/index', params={'symbol': 'btcusdt', 'timeframe': '1h'}).json()
+    assert btc['rows'] == 4 and btc['gaps'] == 1 and btc['missing_bars'] == 1
+    assert (btc['first_ms'], btc['last_ms'], btc['partitions']) == (START, START + 4*STEP, 2)
+    assert client.get('/candles/cache/index', params={'timeframe': 'bogus'}).status_code == 422
@@ -0,0 +1,46 @@
+import pandas as pd
+from candles_service.cache import CandleCache, CacheKey, migrate_legacy_cache, with_iso, CANDLE_COLUMNS
+
+def make_bars(start_ms: int, step_ms: int, n: int):
+    return [[str(start_ms + i*step_ms), '1','2','0.5','1.5','10','15'] for i in range(n)]
+
+DAY = 24*60*60*1000
+JAN_30 = 1_706_572_800_000  # 2024-01-30T00:00:00Z
+
+def test_partitions_by_month_and_range_read(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    cache = CandleCache()
+    key = CacheKey(symbol='BTCUSDT', interval='D')
+    df = cache.merge_and_save(key, make_bars(JAN_30, DAY, 5))  # 30.01 .. 03.02
+    assert len(df) == 5
+    assert cache.partitions(key) == ['2024-01', '2024-02']
+    assert df['timestamp_ms'].dtype == 'int64' and df['close'].dtype == 'float64'
+    assert with_iso(df)['start_time_iso'].iloc[0] == '2024-01-30T00:00:00+00:00'
+
+    feb = cache.load(key, start_ms=JAN_30 + 2*DAY)
+    assert list(feb['timestamp_ms']) == [JAN_30 + i*DAY for i in range(2, 5)]
+
+def test_merge_rewrites_only_touched_partitions(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    cache = CandleCache()
+    key = CacheKey(symbol='BTCUSDT', interval='D')
+    cache.merge_and_save(key, make_bars(JAN_30, DAY, 5))
+    jan = cache._partition_path(key, '2024-01')
+    mtime = jan.stat().st_mtime_ns
+    df = cache.merge_and_save(key, make_bars(JAN_30 + 4*DAY, DAY, 3))  # перекрытие на 03.02
+    assert jan.stat().st_mtime_ns == mtime
+    assert len(df) == 7
+    assert df['timestamp_ms'].is_monotonic_increasing
+
+def test_migrate_legacy_csv(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    legacy = tmp_path/'cache'/'ETHUSDT'/'D'/'candles.csv'
+    legacy.parent.mkdir(parents=True)
+    bars = with_iso(CandleCache._bars_to_df(make_bars(JAN_30, DAY, 4)))
+    pd.concat([bars, bars.iloc[:1]]).to_csv(legacy, index=False)
+
+    assert migrate_legacy_cache() == {'ETHUSDT/D': 4}
+    assert not legacy.exists()
+    df = CandleCache().load(CacheKey(symbol='ETHUSDT', interval='D'))
+    assert len(df) == 4
+    assert list(with_iso(df).columns) == CANDLE_COLUMNS
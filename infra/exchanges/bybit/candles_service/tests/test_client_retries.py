@@ -36,3 +36,29 @@ def test_retries(monkeypatch, tmp_path):
     assert resp.status_code == 200, resp.text
     # Убедимся, что было минимум 3 попытки (2 ошибки + успех)
     assert calls['n'] >= 3
+
+def test_rate_limit_detected_by_code_and_status_not_message(monkeypatch):
+    import requests
+    from candles_service.bybit_client import BybitAPIError, is_rate_limited
+    assert is_rate_limited(BybitAPIError(10006, 'Too many visits'))
+    assert not is_rate_limited(BybitAPIError(10001, 'params error'))
+    def http_error(status):
+        resp = requests.Response()
+        resp.status_code = status
+        return requests.HTTPError(f'{status} Error for url: https://api.bybit.com/v5/market/kline?end=1700010006000',
+                                  response=resp)
+    assert not is_rate_limited(http_error(503))
+    assert is_rate_limited(http_error(429))
+
+    client = BybitClient()
+    blocked, slept = [], []
+    monkeypatch.setattr(client.limiter, 'block_for', blocked.append)
+    monkeypatch.setattr('candles_service.bybit_client.time.sleep', slept.append)
+    errors = [http_error(503), BybitAPIError(10006, 'Too many visits')]
+    def fake_request(params):
+        if errors:
+            raise errors.pop(0)
+        return {'list': []}
+    monkeypatch.setattr(client, '_request', fake_request)
+    client.fetch_klines_page(category='linear', symbol='BTCUSDT', interval='60')
+    assert len(slept) == 1 and len(blocked) == 1
@@ -0,0 +1,53 @@
+import os
+import pandas as pd
+from fastapi.testclient import TestClient
+from candles_service.api import app
+from candles_service.cache import CandleCache, CacheKey, FrameLRU
+
+DAY = 24*60*60*1000
+JAN_01 = 1_704_067_200_000
+
+def make_bars(start_ms: int, n: int):
+    return [[str(start_ms + i*DAY), '1','2','0.5','1.5','10','15'] for i in range(n)]
+
+def test_repeat_loads_hit_memory(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    frames = FrameLRU(64 * 1024 * 1024)
+    cache = CandleCache(frames=frames)
+    key = CacheKey(symbol='BTCUSDT', interval='D')
+    cache.append_bars(key, make_bars(JAN_01, 40))  # 2 партиции, write-through
+
+    def no_disk(*a, **kw):
+        raise AssertionError('partition must be served from memory')
+    monkeypatch.setattr(pd, 'read_parquet', no_disk)
+    for _ in range(3):
+        assert len(cache.load(key)) == 40
+    assert frames.stats()['hits'] == 6 and frames.stats()['misses'] == 0
+
+def test_invalidated_by_mtime(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    frames = FrameLRU(64 * 1024 * 1024)
+    key = CacheKey(symbol='BTCUSDT', interval='D')
+    CandleCache(frames=frames).append_bars(key, make_bars(JAN_01, 5))
+    # Другой процесс (свой LRU) дописал партицию
+    CandleCache(frames=FrameLRU(0)).append_bars(key, make_bars(JAN_01 + 5*DAY, 5))
+    path = tmp_path/'cache'/'BTCUSDT'/'D'/'2024-01.parquet'
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert len(CandleCache(frames=frames).load(key)) == 10
+    assert frames.stats()['misses'] == 1
+
+def test_byte_budget_evicts_lru():
+    frames = FrameLRU(3000)
+    df = pd.DataFrame({'timestamp_ms': range(100)}, dtype='int64')  # ~930 байт
+    for i in range(4):
+        frames.put(f'p{i}', (i, 0), df)
+    st = frames.stats()
+    assert st['entries'] == 3 and st['evictions'] == 1 and st['bytes'] <= 3000
+    assert frames.get('p0', (0, 0)) is None
+    assert frames.get('p3', (3, 0)) is not None
+
+def test_stats_endpoint():
+    resp = TestClient(app).get('/candles/cache/stats')
+    assert resp.status_code == 200
+    assert {'hits', 'misses', 'bytes', 'budget_bytes'} <= set(resp.json())
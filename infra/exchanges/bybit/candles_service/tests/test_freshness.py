@@ -0,0 +1,97 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from candles_service import service
+from candles_service.api import app
+from candles_service.bybit_client import BybitClient
+from candles_service.cache import CandleCache, CacheKey
+from candles_service.service import DownloadRequest, download_candles
+
+HOUR = 60*60*1000
+NOW = 1_700_000_000_000 + 30*60*1000  # 2023-11-14 22:43 UTC
+LAST_CLOSED = NOW - NOW % HOUR - HOUR  # бар 21:00, закрылся в 22:00
+
+def bars_at(ts_list):
+    return [[str(t), '1', '2', '0.5', '1.5', '10', '15'] for t in sorted(ts_list, reverse=True)]
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('DATA_DIR', str(tmp_path/'data'))
+    monkeypatch.setattr(service, 'now_ms', lambda: NOW)
+    calls = []
+    def update_forward(self, *, category, symbol, interval, from_exclusive_ms):
+        calls.append('forward')
+        return bars_at(range(from_exclusive_ms + HOUR, NOW - NOW % HOUR + 1, HOUR))
+    def fetch_klines_page(self, *, category, symbol, interval, limit=200, end=None, start=None):
+        calls.append('page')
+        end = NOW if end is None else end
+        return bars_at([end - end % HOUR - i*HOUR for i in range(limit)])
+    monkeypatch.setattr(BybitClient, 'update_forward', update_forward)
+    monkeypatch.setattr(BybitClient, 'fetch_klines_page', fetch_klines_page)
+    return calls
+
+def seed(last_ms, n=10):
+    CandleCache().append_bars(CacheKey('BTCUSDT', '60'), bars_at([last_ms - i*HOUR for i in range(n)]))
+
+def test_current_cache_is_served_without_upstream_calls(upstream):
+    seed(LAST_CLOSED)
+    res = download_candles(DownloadRequest(symbol='BTCUSDT', timeframe='1h', candles_back=5))
+    assert res['rows'] == 5 and upstream == []
+
+def test_stale_cache_fetches_forward_unless_within_max_staleness(upstream):
+    seed(LAST_CLOSED - 3*HOUR)
+    download_candles(DownloadRequest(symbol='BTCUSDT', timeframe='1h', candles_back=5, max_staleness_sec=3*3600))
+    assert upstream == []
+    res = download_candles(DownloadRequest(symbol='BTCUSDT', timeframe='1h', candles_back=5))
+    assert upstream == ['forward'] and res['rows'] == 5
+    assert CandleCache().meta(CacheKey('BTCUSDT', '60'))['last_ms'] == NOW - NOW % HOUR
+
+def test_offline_never_goes_upstream(upstream):
+    client = TestClient(app)
+    resp = client.post('/candles/download', params={'symbol': 'BTCUSDT', 'timeframe': '1h',
+                                                    'candles_back': 5, 'offline': 'true'})
+    assert resp.status_code == 200, resp.text
+    assert resp.json()['rows'] == 0
+    seed(LAST_CLOSED - 5*HOUR, n=3)
+    resp = client.get('/candles', params={'symbol': 'BTCUSDT', 'timeframe': '1h', 'candles_back': 50, 'offline': 'true'})
+    assert resp.status_code == 200 and resp.headers['X-Candles-Rows'] == '3'
+    assert upstream == []
+    resp = client.post('/candles/download', params={'symbol': 'BTCUSDT', 'timeframe': '1h',
+                                                    'candles_back': 5, 'max_staleness_sec': -1})
+    assert resp.status_code == 422
+
+def test_bar_cached_open_is_refetched_after_close(monkeypatch, tmp_path):
+    import pandas as pd
+    from candles_service import cache as cache_mod
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('DATA_DIR', str(tmp_path/'data'))
+    clock = {'now': NOW}
+    monkeypatch.setattr(service, 'now_ms', lambda: clock['now'])
+    monkeypatch.setattr(cache_mod, 'now_ms', lambda: clock['now'])
+    calls = []
+    def update_forward(self, *, category, symbol, interval, from_exclusive_ms):
+        calls.append(from_exclusive_ms)
+        now = clock['now']
+        first = from_exclusive_ms + 1 + (-(from_exclusive_ms + 1)) % HOUR
+        # открытый (текущий) бар — с неполным close=30, закрытые — с окончательным close=99
+        return [[str(t), '1', '2', '0.5', '30' if t + HOUR > now else '99', '10', '15']
+                for t in range(now - now % HOUR, first - 1, -HOUR)]
+    monkeypatch.setattr(BybitClient, 'update_forward', update_forward)
+    key = CacheKey('BTCUSDT', '60')
+    OPEN = NOW - NOW % HOUR
+    seed(LAST_CLOSED)
+    CandleCache().append_bars(key, [[str(OPEN), '1', '2', '0.5', '30', '10', '15']])    # 22:00 записан открытым
+    assert CandleCache().meta(key)['open_ms'] == OPEN
+
+    req = DownloadRequest(symbol='BTCUSDT', timeframe='1h', candles_back=3)
+    download_candles(req)
+    assert calls == []                       # бар ещё открыт — отдаём как есть
+
+    clock['now'] = OPEN + HOUR + 10*60*1000  # 23:10: бар 22:00 закрылся
+    df = pd.read_csv(download_candles(req)['saved_file'])
+    assert calls == [OPEN - 1]
+    assert df.loc[df['timestamp_ms'] == OPEN, 'close'].item() == 99
+    assert CandleCache().meta(key)['open_ms'] == OPEN + HOUR
+    download_candles(req)
+    assert len(calls) == 1
@@ -0,0 +1,58 @@
+import pytest
+from filelock import Timeout
+from fastapi.testclient import TestClient
+from candles_service.api import app
+from candles_service.bybit_client import BybitClient
+from candles_service.cache import CandleCache, CacheKey
+from candles_service.gaps import find_gaps
+
+client = TestClient(app)
+
+STEP = 60*60*1000
+START = 1_699_999_200_000  # кратно часу
+
+def bars_at(ts_list):
+    return [[str(t), '1','2','0.5','1.5','10','15'] for t in sorted(ts_list, reverse=True)]
+
+def test_find_gaps():
+    ts = [START, START + STEP, START + 4*STEP, START + 5*STEP, START + 7*STEP]
+    assert find_gaps(ts, '60') == [(START + 2*STEP, START + 4*STEP - 1), (START + 6*STEP, START + 7*STEP - 1)]
+
+def test_gaps_report_and_repair(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    key = CacheKey(symbol='BTCUSDT', interval='60')
+    CandleCache().append_bars(key, bars_at([START + i*STEP for i in range(10) if i not in (3, 4, 5)]))
+
+    resp = client.get('/candles/gaps', params={'timeframe': '1h'})
+    assert resp.status_code == 200, resp.text
+    [report] = resp.json()
+    assert report['symbol'] == 'BTCUSDT' and report['rows'] == 7
+    assert report['missing_bars'] == 3
+    assert report['gaps'] == [{'start_ms': START + 3*STEP, 'end_ms': START + 6*STEP - 1}]
+
+    requested = []
+    def fake_fetch_range(self, *, category, symbol, interval, start_ms, end_ms):
+        requested.append((start_ms, end_ms))
+        with pytest.raises(Timeout):  # ключ заблокирован на время докачки
+            CandleCache().lock(key).acquire(timeout=0)
+        return bars_at([t for t in range(START, START + 10*STEP, STEP) if start_ms <= t <= end_ms])
+    monkeypatch.setattr(BybitClient, 'fetch_range', fake_fetch_range)
+
+    resp = client.post('/candles/gaps/repair', params={'symbol': 'BTCUSDT', 'timeframe': '1h'})
+    assert resp.status_code == 200, resp.text
+    data = resp.json()
+    assert requested == [(START + 3*STEP, START + 6*STEP - 1)]
+    assert data['repaired_bars'] == 3 and data['gaps'] == [] and data['rows'] == 10
+
+def test_update_forward_pages_until_now(monkeypatch):
+    monkeypatch.setenv('MAX_BARS_PER_REQUEST', '10')
+    import candles_service.bybit_client as bc
+    monkeypatch.setattr(bc, 'now_ms', lambda: START + 25*STEP)
+    calls = []
+    def fake_fetch_range(self, *, category, symbol, interval, start_ms, end_ms):
+        calls.append((start_ms, end_ms))
+        return bars_at(range(start_ms, end_ms + 1, STEP))
+    monkeypatch.setattr(BybitClient, 'fetch_range', fake_fetch_range)
+    bars = BybitClient().update_forward(category='linear', symbol='BTCUSDT', interval='60', from_exclusive_ms=START)
+    assert calls == [(START + 1, START + 25*STEP)]
+    assert len(bars) == 25
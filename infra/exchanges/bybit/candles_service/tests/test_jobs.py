@@ -0,0 +1,92 @@
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from candles_service import jobs
+from candles_service.api import app
+from candles_service.bybit_client import page_progress
+from candles_service.jobs import JobManager, JobStore
+
+def wait_done(mgr, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        p = mgr.progress(job_id)
+        if p['status'] in ('done', 'cancelled'):
+            return p
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} not finished: {mgr.progress(job_id)}')
+
+def fake_download(pages=3, fail=()):
+    calls = []
+    def download(req):
+        calls.append(req.symbol)
+        for _ in range(pages):
+            page_progress.get().add(10)
+        if req.symbol in fail:
+            raise RuntimeError('boom')
+        return {'symbol': req.symbol, 'timeframe': '1h', 'rows': 30, 'saved_file': f'/x/{req.symbol}.csv'}
+    download.calls = calls
+    return download
+
+def test_job_progress_and_results(tmp_path):
+    download = fake_download(fail={'ETHUSDT'})
+    mgr = JobManager(JobStore(tmp_path), max_workers=2, download=download)
+    job = mgr.submit(['btcusdt', 'ETHUSDT', 'SOLUSDT', 'BTCUSDT'], timeframe='1h', hours_back=6)
+    assert job['total'] == 3
+    p = wait_done(mgr, job['job_id'])
+    assert p['status'] == 'done' and p['counts'] == {'done': 2, 'error': 1}
+    assert p['symbols']['BTCUSDT']['pages'] == 3 and p['symbols']['BTCUSDT']['bars_fetched'] == 30
+    assert p['symbols']['ETHUSDT']['error'] == 'boom'
+    res = mgr.results(job['job_id'])
+    assert sorted(r['result']['symbol'] for r in res if r['ok']) == ['BTCUSDT', 'SOLUSDT']
+    assert [r['symbol'] for r in res if not r['ok']] == ['ETHUSDT']
+    # состояние на диске совпадает с памятью
+    assert JobStore(tmp_path).load(job['job_id'])['status'] == 'done'
+
+def test_cancel_stops_running_and_pending(tmp_path):
+    started = threading.Event()
+    def slow_download(req):
+        started.set()
+        while True:
+            page_progress.get().add(1)
+            time.sleep(0.01)
+    mgr = JobManager(JobStore(tmp_path), max_workers=1, download=slow_download)
+    job = mgr.submit(['BTCUSDT', 'ETHUSDT'], timeframe='1h', candles_back=100)
+    assert started.wait(5)
+    mgr.cancel(job['job_id'])
+    p = wait_done(mgr, job['job_id'])
+    assert p['status'] == 'cancelled'
+    assert {s: st['status'] for s, st in p['symbols'].items()} == {'BTCUSDT': 'cancelled', 'ETHUSDT': 'cancelled'}
+    assert p['symbols']['BTCUSDT']['pages'] > 0
+
+def test_resume_runs_only_unfinished_symbols(tmp_path):
+    store = JobStore(tmp_path)
+    state = lambda status: {'status': status, 'pages': 5, 'bars_fetched': 50, 'rows': None, 'started_ms': 1,
+                            'finished_ms': None, 'result': None, 'error': None}
+    store.save({'job_id': 'abc', 'status': 'running', 'created_ms': 1, 'updated_ms': 1, 'started_ms': 1,
+                'finished_ms': None, 'params': {'timeframe': '1h', 'category': 'linear', 'out_dir': None, 'days_back': 1},
+                'symbols': {'BTCUSDT': {**state('done'), 'result': {'symbol': 'BTCUSDT'}}, 'ETHUSDT': state('running'),
+                            'SOLUSDT': state('pending')}})
+    download = fake_download()
+    mgr = JobManager(store, max_workers=2, download=download)
+    assert mgr.resume() == ['abc']
+    p = wait_done(mgr, 'abc')
+    assert sorted(download.calls) == ['ETHUSDT', 'SOLUSDT']
+    assert p['counts'] == {'done': 3}
+    # завершённые задачи повторно не подхватываются
+    assert JobManager(store, download=download).resume() == []
+
+def test_jobs_api(monkeypatch, tmp_path):
+    mgr = JobManager(JobStore(tmp_path), max_workers=2, download=fake_download())
+    monkeypatch.setattr(jobs, '_manager', mgr)
+    client = TestClient(app)
+    resp = client.post('/candles/jobs?symbols=BTCUSDT,ETHUSDT&timeframe=1h&hours_back=6')
+    assert resp.status_code == 202, resp.text
+    job_id = resp.json()['job_id']
+    wait_done(mgr, job_id)
+    assert client.get(f'/candles/jobs/{job_id}').json()['counts'] == {'done': 2}
+    assert len(client.get(f'/candles/jobs/{job_id}/results').json()) == 2
+    assert [j['job_id'] for j in client.get('/candles/jobs').json()] == [job_id]
+    assert client.get('/candles/jobs/nope').status_code == 404
+    assert client.post('/candles/jobs?symbols=BTCUSDT&timeframe=1h').status_code == 422
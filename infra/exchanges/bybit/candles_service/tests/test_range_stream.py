@@ -0,0 +1,96 @@
+import io
+import json
+import pyarrow.ipc as ipc
+from fastapi.testclient import TestClient
+from candles_service.api import app
+from candles_service.bybit_client import BybitClient
+import candles_service.service as service
+
+client = TestClient(app)
+
+STEP = 60*60*1000
+LATEST = 1_700_000_000_000 - (1_700_000_000_000 % STEP)
+
+def fake_fetch_klines_page(self, *, category, symbol, interval, limit=200, end=None, start=None):
+    t = LATEST if end is None else min(LATEST, end - (end % STEP))
+    return [[str(t - i*STEP), '1','2','0.5','1.5','10','15'] for i in range(limit)]
+
+def fake_fetch_range(self, *, category, symbol, interval, start_ms, end_ms):
+    return [[str(t), '1','2','0.5','1.5','10','15'] for t in range(min(LATEST, end_ms - end_ms % STEP), start_ms - 1, -STEP)]
+
+def setup(monkeypatch, tmp_path):
+    monkeypatch.setenv('DATA_DIR', str(tmp_path/'data'))
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setattr(BybitClient, 'fetch_klines_page', fake_fetch_klines_page)
+    monkeypatch.setattr(BybitClient, 'fetch_range', fake_fetch_range)
+    monkeypatch.setattr(service, 'now_ms', lambda: LATEST + STEP - 1)
+    monkeypatch.setattr(BybitClient, 'update_forward', lambda self, **kw: [])
+
+PARAMS = {'symbol': 'BTCUSDT', 'timeframe': '1h', 'candles_back': 5}
+
+def test_stream_csv_default(monkeypatch, tmp_path):
+    setup(monkeypatch, tmp_path)
+    resp = client.get('/candles', params=PARAMS)
+    assert resp.status_code == 200, resp.text
+    assert resp.headers['content-type'].startswith('text/csv')
+    lines = resp.text.strip().split('\n')
+    assert lines[0] == 'timestamp_ms,start_time_iso,open,high,low,close,volume,turnover'
+    assert [int(l.split(',')[0]) for l in lines[1:]] == [LATEST - i*STEP for i in range(4, -1, -1)]
+    assert not (tmp_path/'data'/'BTCUSDT').exists()
+
+def test_stream_ndjson_and_arrow(monkeypatch, tmp_path):
+    setup(monkeypatch, tmp_path)
+    resp = client.get('/candles', params=PARAMS, headers={'Accept': 'application/x-ndjson'})
+    rows = [json.loads(l) for l in resp.text.splitlines()]
+    assert len(rows) == 5 and rows[-1]['timestamp_ms'] == LATEST and rows[0]['close'] == 1.5
+
+    resp = client.get('/candles', params=PARAMS, headers={'Accept': 'application/vnd.apache.arrow.stream'})
+    assert resp.status_code == 200
+    table = ipc.open_stream(io.BytesIO(resp.content)).read_all()
+    assert table.num_rows == 5 and str(table.schema.field('timestamp_ms').type) == 'int64'
+
+def test_stream_explicit_range_and_406(monkeypatch, tmp_path):
+    setup(monkeypatch, tmp_path)
+    resp = client.get('/candles', params={'symbol': 'BTCUSDT', 'timeframe': '1h',
+                                          'start_ms': LATEST - 10*STEP, 'end_ms': LATEST - 8*STEP},
+                      headers={'Accept': 'application/x-ndjson'})
+    assert [json.loads(l)['timestamp_ms'] for l in resp.text.splitlines()] == [LATEST - 10*STEP, LATEST - 9*STEP, LATEST - 8*STEP]
+    assert client.get('/candles', params=PARAMS, headers={'Accept': 'image/png'}).status_code == 406
+    # формат файла Arrow IPC не поддерживается — не подменяем его потоковым
+    assert client.get('/candles', params=PARAMS, headers={'Accept': 'application/vnd.apache.arrow.file'}).status_code == 406
+
+def test_conditional_get_returns_304_until_range_changes(monkeypatch, tmp_path):
+    from candles_service.cache import CandleCache, CacheKey
+    setup(monkeypatch, tmp_path)
+    resp = client.get('/candles', params=PARAMS)
+    etag, last_modified = resp.headers['etag'], resp.headers['last-modified']
+    assert resp.status_code == 200 and resp.headers['cache-control'] == 'no-cache'
+
+    read = []
+    monkeypatch.setattr(CandleCache, 'iter_range', lambda self, *a, **kw: read.append(1) or iter(()))
+    resp = client.get('/candles', params=PARAMS, headers={'If-None-Match': f'W/{etag}, "other"'})
+    assert resp.status_code == 304 and resp.content == b'' and resp.headers['etag'] == etag
+    assert client.get('/candles', params=PARAMS, headers={'If-Modified-Since': last_modified}).status_code == 304
+    # другой формат — другое представление
+    assert client.get('/candles', params=PARAMS, headers={'If-None-Match': etag,
+                                                          'Accept': 'application/x-ndjson'}).status_code == 200
+    assert read == [1]
+    monkeypatch.undo()
+
+    setup(monkeypatch, tmp_path)
+    CandleCache().append_bars(CacheKey('BTCUSDT', '60'), [[str(LATEST - 2*STEP), '9', '9', '9', '9', '9', '9']], prefer_new=True)
+    resp = client.get('/candles', params=PARAMS, headers={'If-None-Match': etag})
+    assert resp.status_code == 200 and resp.headers['etag'] != etag
+
+def test_candles_back_with_past_end_ms_returns_exactly_n(monkeypatch, tmp_path):
+    setup(monkeypatch, tmp_path)
+    def ts(resp):
+        return [json.loads(l)['timestamp_ms'] for l in resp.text.splitlines()]
+    ndjson = {'Accept': 'application/x-ndjson'}
+    assert len(ts(client.get('/candles', params=PARAMS, headers=ndjson))) == 5    # кэш: 5 последних баров
+    # end_ms внутри кэша: до него в кэше 2 бара, остальные доливаются назад
+    resp = client.get('/candles', params={**PARAMS, 'end_ms': LATEST - 3*STEP + 1}, headers=ndjson)
+    assert ts(resp) == [LATEST - i*STEP for i in range(7, 2, -1)]
+    # end_ms раньше начала кэша
+    resp = client.get('/candles', params={**PARAMS, 'end_ms': LATEST - 40*STEP}, headers=ndjson)
+    assert ts(resp) == [LATEST - i*STEP for i in range(44, 39, -1)]
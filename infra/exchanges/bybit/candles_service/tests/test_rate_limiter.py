@@ -0,0 +1,37 @@
+from candles_service.bybit_client import BybitClient
+from candles_service.ratelimit import TokenBucket, get_rate_limiter
+
+class FakeClock:
+    def __init__(self):
+        self.t = 1000.0
+    def __call__(self):
+        return self.t
+    def sleep(self, sec):
+        self.t += sec
+
+def make_bucket(rate, capacity=None):
+    clock = FakeClock()
+    return TokenBucket(rate, capacity, clock=clock, wall_clock=clock, sleep=clock.sleep), clock
+
+def test_bucket_paces_requests():
+    bucket, clock = make_bucket(5, capacity=1)
+    for _ in range(6):
+        bucket.acquire()
+    assert abs((clock.t - 1000.0) - 1.0) < 1e-9
+
+def test_bucket_adapts_to_limit_headers():
+    bucket, clock = make_bucket(5, capacity=1)
+    # осталось 20 запросов на 2 секунды -> 10 rps до сброса окна
+    bucket.update_from_headers({'X-Bapi-Limit-Status': '20', 'X-Bapi-Limit-Reset-Timestamp': str(int((clock.t + 2) * 1000))})
+    assert abs(bucket.rate - 10) < 1e-9
+    clock.t += 2.5
+    assert bucket.rate == 5
+
+def test_bucket_blocks_until_reset_when_exhausted():
+    bucket, clock = make_bucket(5)
+    bucket.update_from_headers({'X-Bapi-Limit-Status': '0', 'X-Bapi-Limit-Reset-Timestamp': str(int((clock.t + 3) * 1000))})
+    waited = bucket.acquire()
+    assert waited >= 3.0
+
+def test_clients_share_process_limiter():
+    assert BybitClient().limiter is BybitClient().limiter is get_rate_limiter()
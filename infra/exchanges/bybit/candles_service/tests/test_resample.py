@@ -0,0 +1,79 @@
+import pandas as pd
+import pytest
+from filelock import Timeout
+from candles_service import service
+from candles_service.bybit_client import BybitClient
+from candles_service.cache import CandleCache, CacheKey
+from candles_service.resample import resample_bars, bucket_starts, can_derive
+from candles_service.service import download_candles, DownloadRequest
+
+HOUR = 60*60*1000
+DAY = 24*HOUR
+T0 = 1_698_796_800_000  # 2023-11-01 00:00 UTC, среда
+
+def hourly(start, n, skip=()):
+    rows = [(start + i*HOUR, 100+i, 101+i, 99+i, 100.5+i, 1.0, 10.0) for i in range(n) if i not in skip]
+    return pd.DataFrame(rows, columns=['timestamp_ms','open','high','low','close','volume','turnover'])
+
+def test_resample_ohlcv_and_completeness():
+    out = resample_bars(hourly(T0, 10), '60', '240')
+    assert out['timestamp_ms'].tolist() == [T0, T0 + 4*HOUR, T0 + 8*HOUR]
+    first = out.iloc[0]
+    assert (first['open'], first['high'], first['low'], first['close']) == (100, 104, 99, 103.5)
+    assert (first['volume'], first['turnover']) == (4.0, 40.0)
+    assert out['complete'].tolist() == [True, True, False]
+
+def test_bucket_alignment_week_and_month():
+    ts = pd.Series([T0, T0 + 5*DAY]).to_numpy()
+    # неделя — с понедельника 2023-10-30 и 2023-11-06
+    assert bucket_starts(ts, 'W').tolist() == [T0 - 2*DAY, T0 + 5*DAY]
+    assert bucket_starts(ts, 'M').tolist() == [T0, T0]
+    assert can_derive('60', 'D') and can_derive('D', 'W') and can_derive('D', 'M')
+    assert not can_derive('W', 'M') and not can_derive('240', '360')
+
+def test_download_derives_from_base_and_fetches_only_uncovered(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('DATA_DIR', str(tmp_path/'data'))
+    monkeypatch.setattr(service, 'now_ms', lambda: T0 + 3*DAY - 1)
+    monkeypatch.setattr(BybitClient, 'update_forward', lambda self, **kw: [])
+    calls = []
+    def fake_fetch_range(self, *, category, symbol, interval, start_ms, end_ms):
+        calls.append((interval, start_ms, end_ms))
+        with pytest.raises(Timeout):  # ключ целевого таймфрейма заблокирован на время докачки
+            CandleCache().lock(CacheKey('BTCUSDT', interval)).acquire(timeout=0)
+        return [[str(start_ms), '1', '2', '0.5', '1.5', '10', '15']]
+    monkeypatch.setattr(BybitClient, 'fetch_range', fake_fetch_range)
+    # в базе 1h дыра в 2023-11-02 08:00-09:59 — четырёхчасовой бар 08:00 собрать нельзя
+    CandleCache().save(CacheKey('BTCUSDT', '60'), hourly(T0, 72, skip={32, 33}))
+
+    req = DownloadRequest(symbol='BTCUSDT', timeframe='4h', start_ms=T0, resample=True)
+    res = download_candles(req)
+    assert res['rows'] == 18 and res['resampled_from'] == '1h'
+    assert calls == [('240', T0 + DAY + 8*HOUR, T0 + DAY + 12*HOUR - 1)]
+    df = pd.read_csv(res['saved_file'])
+    assert df['timestamp_ms'].is_monotonic_increasing
+    assert df.loc[df['timestamp_ms'] == T0 + DAY + 8*HOUR, 'open'].item() == 1.0
+
+    # повторный запрос: недостающий бар уже в кэше 4h, к бирже не ходим
+    download_candles(req)
+    assert len(calls) == 1
+
+def test_past_end_ms_does_not_truncate_closed_bar(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('DATA_DIR', str(tmp_path/'data'))
+    monkeypatch.setattr(service, 'now_ms', lambda: T0 + 3*DAY - 1)
+    monkeypatch.setattr(BybitClient, 'update_forward', lambda self, **kw: [])
+    calls = []
+    def fake_fetch_range(self, *, category, symbol, interval, start_ms, end_ms):
+        calls.append((interval, start_ms, end_ms))
+        return [[str(start_ms), '7', '9', '6', '8', '40', '400']]
+    monkeypatch.setattr(BybitClient, 'fetch_range', fake_fetch_range)
+    CandleCache().save(CacheKey('BTCUSDT', '60'), hourly(T0, 72))
+
+    # end_ms посреди прошлого четырёхчасового бара 08:00: из базы до end_ms в нём только 08:00 и 09:00
+    req = DownloadRequest(symbol='BTCUSDT', timeframe='4h', candles_back=3, end_ms=T0 + DAY + 9*HOUR + 30*60*1000,
+                          resample=True)
+    df = pd.read_csv(download_candles(req)['saved_file'])
+    assert df['timestamp_ms'].tolist() == [T0 + DAY, T0 + DAY + 4*HOUR, T0 + DAY + 8*HOUR]
+    assert calls == [('240', T0 + DAY + 8*HOUR, T0 + DAY + 12*HOUR - 1)]
+    assert df['volume'].iloc[-1] == 40
@@ -0,0 +1,113 @@
+import asyncio
+
+from candles_service import scheduler as sched
+from candles_service.bybit_client import BybitClient
+from candles_service.cache import CandleCache, CacheKey
+from candles_service.scheduler import RefreshScheduler, next_close_ms, staleness_ms, is_watched
+from candles_service.service import _fill_cache
+
+MIN = 60*1000
+HOUR = 60*MIN
+T0 = 1_699_999_200_000  # 2023-11-14 22:00 UTC
+
+def bar(t):
+    return [str(t), '1', '2', '0.5', '1.5', '10', '15']
+
+class FakeClient(BybitClient):
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = []
+    def _bars_until_now(self, interval, start):
+        step = MIN if interval == '1' else HOUR
+        now = self.clock()
+        return [bar(t) for t in range(start - start % step, now - now % step + 1, step)]
+    def update_forward(self, *, category, symbol, interval, from_exclusive_ms):
+        self.calls.append((symbol, interval))
+        return self._bars_until_now(interval, from_exclusive_ms + 1)
+    def fetch_klines_page(self, *, category, symbol, interval, limit=200, end=None, start=None):
+        self.calls.append((symbol, interval))
+        return self._bars_until_now(interval, self.clock() - 3*HOUR)
+
+def test_close_boundaries_and_staleness():
+    now = T0 + 30*MIN + 5
+    assert next_close_ms(now, '1') == T0 + 31*MIN
+    assert next_close_ms(now, '60') == T0 + HOUR
+    assert next_close_ms(now, 'D') == T0 + 2*HOUR
+    # в кэше бар 21:00 — закрыт, бар 22:00 ещё не закрыт: отставания нет
+    assert staleness_ms(T0 - HOUR, '60', now) == 0
+    assert staleness_ms(T0 - 2*HOUR, '60', now) == HOUR
+    s = RefreshScheduler([('BTCUSDT', '1m', 'linear'), ('ETHUSDT', '1h', 'linear')], client=object())
+    assert [i.key.symbol for i in s.due(T0 + HOUR)] == ['BTCUSDT', 'ETHUSDT']
+    assert [i.key.symbol for i in s.due(T0 + 31*MIN)] == ['BTCUSDT']
+
+def test_run_refreshes_on_bar_closes(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    clock = {'now': T0 + 58*MIN + 30_000}
+    client = FakeClient(lambda: clock['now'])
+    seen_watched = []
+
+    async def fake_sleep(sec):
+        clock['now'] += int(sec * 1000)
+        seen_watched.append(is_watched(CacheKey('ETHUSDT', '60')))
+        if clock['now'] > T0 + HOUR + 2*MIN:
+            s.stop()
+
+    s = RefreshScheduler([('BTCUSDT', '1m', 'linear'), ('ETHUSDT', '1h', 'linear')], client=client,
+                         clock=lambda: clock['now'], sleep=fake_sleep)
+    asyncio.run(s.run())
+    # старт + закрытия 22:59, 23:00 (оба ключа), 23:01; на 23:02 планировщик уже остановлен
+    assert client.calls.count(('BTCUSDT', '1')) == 4
+    assert client.calls.count(('ETHUSDT', '60')) == 2
+    assert all(seen_watched) and not is_watched(CacheKey('ETHUSDT', '60'))
+    status = {x['symbol']: x for x in s.status()}
+    assert status['BTCUSDT']['staleness_ms'] == 0 and status['ETHUSDT']['staleness_ms'] == 0
+    assert CandleCache().load(CacheKey('ETHUSDT', '60'))['timestamp_ms'].iloc[-1] == T0 + HOUR
+
+def test_watched_key_trusted_only_while_refresh_is_current(monkeypatch, tmp_path):
+    from candles_service import service
+    from candles_service.scheduler import WatchItem
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setattr(service, 'now_ms', lambda: T0 + 30*MIN)
+    key = CacheKey('BTCUSDT', '60')
+    # по meta.json кэш отстаёт на бар: последний — 20:00, а закрыт уже и 21:00
+    CandleCache().append_bars(key, [bar(T0 - 2*HOUR - i*HOUR) for i in range(5)])
+    forward = []
+    monkeypatch.setattr(BybitClient, 'update_forward', lambda self, **kw: forward.append(1) or [])
+    item = WatchItem(key, 'linear', '1h', last_bar_ms=T0 - HOUR)
+    sched._set_watched([item], True)
+    try:
+        def fill(**kw):
+            return _fill_cache(CandleCache(), BybitClient(), 'BTCUSDT', '60', category='linear',
+                               target_start_ms=None, need_count=5, **kw)
+        assert fill()['rows'] == 5 and forward == []
+        item.error = 'HTTP 503'                      # последнее обновление не удалось
+        fill()
+        assert forward == [1]
+        item.error, item.last_bar_ms = None, T0 - 3*HOUR   # планировщик отстал
+        fill()
+        assert forward == [1, 1]
+        fill(max_staleness_ms=2*HOUR)
+        assert forward == [1, 1]
+    finally:
+        sched._set_watched([item], False)
+
+def test_background_tasks_run_in_one_worker_only(monkeypatch, tmp_path):
+    from filelock import FileLock
+    from fastapi.testclient import TestClient
+    from candles_service.api import app, BACKGROUND_LOCK_NAME
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('WATCHLIST', 'BTCUSDT:1h')
+    started = []
+    async def fake_run(self):
+        started.append(self)
+    monkeypatch.setattr(RefreshScheduler, 'run', fake_run)
+
+    other_worker = FileLock(str(tmp_path/'cache'/BACKGROUND_LOCK_NAME), timeout=0)
+    other_worker.acquire()
+    with TestClient(app) as client:
+        assert client.get('/candles/watchlist').json()['enabled'] is False
+    assert started == []
+    other_worker.release()
+    with TestClient(app) as client:
+        assert client.get('/candles/watchlist').json()['enabled'] is True
+    assert len(started) == 1
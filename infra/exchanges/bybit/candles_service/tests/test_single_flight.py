@@ -0,0 +1,60 @@
+import threading
+import time
+from candles_service.bybit_client import BybitClient
+from candles_service.cache import CandleCache
+from candles_service.service import DownloadRequest, download_candles
+from candles_service.singleflight import SingleFlight
+
+STEP = 60*60*1000
+LATEST = 1_700_000_000_000
+
+def test_single_flight_shares_leader_result():
+    sf = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = {'n': 0}
+    def slow():
+        calls['n'] += 1
+        started.set()
+        release.wait(5)
+        return 42
+    results = []
+    leader = threading.Thread(target=lambda: results.append(sf.do('k', slow)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(sf.do('k', slow))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    while sf.followers < 3:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader, *followers]:
+        t.join(5)
+    assert calls['n'] == 1
+    assert sorted(results, key=lambda r: not r[1]) == [(42, True), (42, False), (42, False), (42, False)]
+
+def test_concurrent_downloads_fetch_once(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setenv('DATA_DIR', str(tmp_path/'data'))
+    calls = {'n': 0}
+    lock = threading.Lock()
+    def fake_fetch_klines_page(self, *, category, symbol, interval, limit=200, end=None, start=None):
+        with lock:
+            calls['n'] += 1
+        time.sleep(0.05)
+        t = LATEST if end is None else end - (end % STEP)
+        return [[str(t - i*STEP), '1','2','0.5','1.5','10','15'] for i in range(limit)]
+    monkeypatch.setattr(BybitClient, 'fetch_klines_page', fake_fetch_klines_page)
+    monkeypatch.setattr(BybitClient, 'update_forward', lambda self, **kw: [])
+
+    results = []
+    req = DownloadRequest(symbol='BTCUSDT', timeframe='1h', candles_back=24)
+    threads = [threading.Thread(target=lambda: results.append(download_candles(req))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert len(results) == 5 and all(r['rows'] == 24 for r in results)
+    assert calls['n'] == 1
+    leftovers = [p.name for p in (tmp_path/'cache'/'BTCUSDT'/'60').iterdir() if p.name.endswith('.tmp')]
+    assert leftovers == []
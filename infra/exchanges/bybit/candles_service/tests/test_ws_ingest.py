@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import pandas as pd
+import websockets
+
+from candles_service import ws_ingest
+from candles_service.bybit_client import BybitClient
+from candles_service.cache import CandleCache, CacheKey
+from candles_service.ws_ingest import KlineIngestor, is_live
+
+STEP = 60*1000
+T0 = 1_700_000_040_000  # кратно минуте
+KEY = CacheKey('BTCUSDT', '1')
+
+def bar(t, close):
+    return [str(t), '1', '2', '0.5', str(close), '10', '15']
+
+def kline_msg(t, close, confirm):
+    return json.dumps({'topic': 'kline.1.BTCUSDT', 'type': 'snapshot', 'data': [{
+        'start': t, 'end': t + STEP - 1, 'interval': '1', 'open': '1', 'high': '2', 'low': '0.5',
+        'close': str(close), 'volume': '10', 'turnover': '15', 'confirm': confirm}]})
+
+class FakeRest(BybitClient):
+    def __init__(self):
+        self.calls = []
+    def update_forward(self, *, category, symbol, interval, from_exclusive_ms):
+        self.calls.append(from_exclusive_ms)
+        # T0+1m — закрытый бар, T0+2m — ещё формируется
+        return [bar(T0 + STEP, 2.0), bar(T0 + 2*STEP, 3.0)]
+
+async def serve(handler):
+    server = await websockets.serve(handler, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f'ws://127.0.0.1:{port}'
+
+def test_ingests_confirmed_bars_after_rest_backfill(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setattr(ws_ingest, 'now_ms', lambda: T0 + 2*STEP + 10)
+    cache = CandleCache()
+    # последний бар сохранён открытым (close=0) — после догрузки его должен заменить закрытый
+    cache.append_bars(KEY, [bar(T0, 1.0), bar(T0 + STEP, 0.0)])
+    subscribed, live_seen = [], []
+
+    async def handler(ws):
+        subscribed.append(json.loads(await ws.recv()))
+        await asyncio.sleep(0.05)
+        live_seen.append(is_live(KEY))
+        await ws.send(kline_msg(T0 + 2*STEP, 3.5, False))
+        await ws.send(kline_msg(T0 + 2*STEP, 4.0, True))
+        await ws.send(json.dumps({'op': 'pong', 'success': True}))
+
+    async def scenario():
+        server, url = await serve(handler)
+        rest = FakeRest()
+        ing = KlineIngestor([('BTCUSDT', '1m')], url=url, cache=cache, client=rest)
+        await ing.run_once()
+        server.close()
+        await server.wait_closed()
+        return ing, rest
+
+    ing, rest = asyncio.run(scenario())
+    assert subscribed == [{'op': 'subscribe', 'args': ['kline.1.BTCUSDT']}]
+    assert live_seen == [True] and not is_live(KEY)
+    assert rest.calls == [T0 + STEP - 1]
+    df = cache.load(KEY)
+    assert df['timestamp_ms'].tolist() == [T0, T0 + STEP, T0 + 2*STEP]
+    assert df['close'].tolist() == [1.0, 2.0, 4.0]
+    assert ing.stats['bars'] == 1 and ing.stats['backfilled_bars'] == 1
+
+def test_reconnects_and_backfills_each_time(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    monkeypatch.setattr(ws_ingest, 'now_ms', lambda: T0 + 2*STEP + 10)
+    cache = CandleCache()
+    cache.append_bars(KEY, [bar(T0, 1.0)])
+    connections = []
+
+    async def scenario():
+        async def handler(ws):
+            await ws.recv()
+            connections.append(1)
+            if len(connections) == 2:
+                await ing.stop()
+        server, url = await serve(handler)
+        rest = FakeRest()
+        ing = KlineIngestor([('BTCUSDT', '1m')], url=url, cache=cache, client=rest, reconnect_delay_sec=0.01)
+        await asyncio.wait_for(ing.run(), timeout=5)
+        server.close()
+        await server.wait_closed()
+        return ing, rest
+
+    ing, rest = asyncio.run(scenario())
+    assert ing.stats['connects'] == 2
+    assert len(rest.calls) == 2
+    assert pd.Series(cache.load(KEY)['timestamp_ms']).tolist() == [T0, T0 + STEP]
@@ -1,17 +1,30 @@
 from __future__ import annotations
 
+import bisect
 import csv
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
 import time
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
-from typing import Dict, Iterable, List, Literal, Optional
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Literal, Optional, Sequence, Tuple, Union
 
+import orjson
 import requests
-from fastapi import FastAPI, HTTPException, Query
+from filelock import FileLock, Timeout
+from fastapi import FastAPI, Header, HTTPException, Query, Response
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, PositiveInt, conint
+from pydantic import BaseModel, Field, PositiveInt, conint, conlist
 
 from settings import settings
 
+log = logging.getLogger(__name__)
+
 # -----------------------------
 # Модель ответа API
 # -----------------------------
@@ -40,6 +53,16 @@ class FuturesListResponse(BaseModel):
     order: Literal["asc", "desc"]
     contract_type: Literal["LinearFutures", "LinearPerpetual", "all"]
     items: List[Instrument]
+    # курсор следующей страницы для after= (последний символ страницы), None — дальше ничего нет
+    next_after: Optional[str] = None
+
+class LookupRequest(BaseModel):
+    symbols: conlist(str, max_length=1000)
+
+class LookupResponse(BaseModel):
+    items: List[Instrument]
+    # запрошенные символы, которых нет в каталоге (в порядке запроса)
+    missing: List[str]
 
 CSV_FIELDS = [
     "symbol","contractType","status","baseCoin","quoteCoin","settleCoin",
@@ -55,16 +78,63 @@ def is_cache_fresh(path: Path, ttl_sec: int) -> bool:
     age = time.time() - stat.st_mtime
     return age < ttl_sec
 
-def write_csv(path: Path, rows: Iterable[Instrument]) -> None:
+def file_signature(path: Path) -> Tuple[int, int]:
+    """Версия CSV-кэша: (mtime_ns, размер)."""
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+def snapshot_validators(signature: Tuple[int, int], *query: object) -> Dict[str, str]:
+    """ETag и Last-Modified ответа по версии CSV-кэша (mtime + размер) и параметрам запроса."""
+    digest = hashlib.sha1(repr(tuple(signature) + query).encode("utf-8")).hexdigest()[:20]
+    return {
+        "ETag": f'"{digest}"',
+        "Last-Modified": formatdate(signature[0] / 1e9, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+def is_not_modified(headers: Dict[str, str], if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+    """Условный GET: If-None-Match (слабое сравнение, '*') важнее If-Modified-Since."""
+    if if_none_match is not None:
+        strip = lambda t: t.strip()[2:] if t.strip().startswith("W/") else t.strip()
+        tags = {strip(t) for t in if_none_match.split(",")}
+        return "*" in tags or strip(headers["ETag"]) in tags
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+        modified = parsedate_to_datetime(headers["Last-Modified"])
+    except (TypeError, ValueError):
+        return False
+    return modified <= since
+
+def _atomic_write(path: Path, write) -> None:
+    """write(f) во временный файл рядом с path, затем rename.
+    У каждого писателя свой временный файл: параллельные воркеры не затирают чужую недописанную копию."""
     path.parent.mkdir(parents=True, exist_ok=True)
-    tmp = path.with_suffix(".tmp")
-    with tmp.open("w", newline="", encoding="utf-8") as f:
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    tmp = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+            write(f)
+        tmp.replace(path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def write_csv(path: Path, rows: Iterable[Instrument]) -> None:
+    def write(f) -> None:
         w = csv.DictWriter(f, fieldnames=CSV_FIELDS)
         w.writeheader()
         for it in rows:
             row = {k: getattr(it, k, None) for k in CSV_FIELDS}
             w.writerow(row)
-    tmp.replace(path)
+    _atomic_write(path, write)
+
+def _signature_or_none(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        return file_signature(path)
+    except FileNotFoundError:
+        return None
 
 def read_csv(path: Path) -> List[Instrument]:
     with path.open("r", newline="", encoding="utf-8") as f:
@@ -92,53 +162,300 @@ def read_csv(path: Path) -> List[Instrument]:
             out.append(item)
         return out
 
+# Поля, по которым снимок держит индексы «значение -> позиции»
+INDEXED_FIELDS = ("contractType", "status", "baseCoin", "quoteCoin", "settleCoin")
+# Поля-метки времени, по которым снимок держит отсортированные массивы для фильтров по диапазону
+RANGE_FIELDS = ("launchTime", "deliveryTime")
+
+class InstrumentSnapshot:
+    """Неизменяемый разобранный снимок CSV-кэша: инструменты, отсортированные по символу, и индексы по ним.
+
+    Строится один раз на версию CSV (signature) и дальше только читается, поэтому его можно без блокировок
+    отдавать параллельным запросам. Индексы хранят позиции в items по возрастанию (то есть в порядке символов):
+    выборка — пересечение индексов, страница — срез позиций. Единственное изменяемое — кэш готовых JSON-ответов
+    (rendered): он живёт вместе со снимком и сбрасывается сам при его подмене. version — версия каталога из журнала,
+    если снимок установлен обновлением в этом процессе; снимок, прочитанный с диска, находит её по signature.
+    """
+    def __init__(self, items: Iterable[Instrument], signature: Tuple[int, int], version: Optional[int] = None) -> None:
+        self.signature = signature
+        self.version = version
+        self.items: Tuple[Instrument, ...] = tuple(sorted(items, key=lambda x: x.symbol))
+        self.symbols: Tuple[str, ...] = tuple(it.symbol for it in self.items)
+        self.by_symbol: Dict[str, Instrument] = {it.symbol: it for it in self.items}
+        self.indexes: Dict[str, Dict[Optional[str], Tuple[int, ...]]] = {}
+        for field in INDEXED_FIELDS:
+            index: Dict[Optional[str], List[int]] = {}
+            for pos, it in enumerate(self.items):
+                index.setdefault(getattr(it, field), []).append(pos)
+            self.indexes[field] = {k: tuple(v) for k, v in index.items()}
+        # метки времени по возрастанию (без пустых) — фильтры по диапазону бисекцией
+        self.ranges: Dict[str, Tuple[Tuple[int, ...], Tuple[int, ...]]] = {}
+        for field in RANGE_FIELDS:
+            pairs = sorted((getattr(it, field), pos) for pos, it in enumerate(self.items) if getattr(it, field) is not None)
+            self.ranges[field] = (tuple(t for t, _ in pairs), tuple(p for _, p in pairs))
+        self.rendered: Dict[Hashable, bytes] = {}
+        self._render_lock = threading.Lock()
+
+    def render(self, key: Hashable, build: Callable[[], Any]) -> bytes:
+        """JSON ответа для нормализованного запроса key: build() сериализуется orjson один раз на снимок.
+        Хранится не больше RESPONSE_CACHE_MAX ответов, при переполнении вытесняется самый старый."""
+        body = self.rendered.get(key)
+        if body is not None:
+            return body
+        body = orjson.dumps(build())
+        with self._render_lock:
+            if key not in self.rendered and len(self.rendered) >= settings.RESPONSE_CACHE_MAX:
+                del self.rendered[next(iter(self.rendered))]
+            self.rendered[key] = body
+        return body
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def lookup(self, symbols: Iterable[str]) -> Tuple[List[Instrument], List[str]]:
+        """Инструменты по символам (без учёта регистра, в порядке запроса, без повторов) и список ненайденных."""
+        found: List[Instrument] = []
+        missing: List[str] = []
+        seen = set()
+        for sym in symbols:
+            sym = sym.strip().upper()
+            if sym in seen:
+                continue
+            seen.add(sym)
+            it = self.by_symbol.get(sym)
+            if it is None:
+                missing.append(sym)
+            else:
+                found.append(it)
+        return found, missing
+
+    def select(self, *, eq: Optional[Dict[str, Union[str, Sequence[str]]]] = None,
+               ranges: Optional[Dict[str, Tuple[Optional[int], Optional[int]]]] = None) -> Sequence[int]:
+        """Позиции инструментов (по возрастанию символа), у которых поле eq равно значению (или одному из списка)
+        и метки времени попадают в ranges[field] = (от, до) включительно (мс, None — без границы)."""
+        sets: List[Sequence[int]] = []
+        for field, value in (eq or {}).items():
+            index = self.indexes[field]
+            if isinstance(value, str):
+                sets.append(index.get(value, ()))
+            else:
+                sets.append(sorted(p for v in set(value) for p in index.get(v, ())))
+        for field, (lo, hi) in (ranges or {}).items():
+            times, positions = self.ranges[field]
+            i = bisect.bisect_left(times, lo) if lo is not None else 0
+            j = bisect.bisect_right(times, hi) if hi is not None else len(times)
+            sets.append(sorted(positions[i:j]))
+        if not sets:
+            return range(len(self.items))
+        if len(sets) == 1:
+            return sets[0]
+        sets.sort(key=len)
+        common = set(sets[0]).intersection(*sets[1:])
+        return sorted(common)
+
+    def page(self, positions: Sequence[int], *, offset: int, limit: int, descending: bool = False) -> List[Instrument]:
+        """Срез выборки select() в нужном порядке без пересортировки."""
+        total = len(positions)
+        if descending:
+            lo, hi = max(0, total - offset - limit), max(0, total - offset)
+            return [self.items[p] for p in reversed(positions[lo:hi])]
+        return [self.items[p] for p in positions[offset:offset + limit]]
+
+    def page_after(self, positions: Sequence[int], *, after: str, limit: int,
+                   descending: bool = False) -> Tuple[List[Instrument], bool]:
+        """Keyset-страница: до limit инструментов выборки строго после символа after (в порядке выдачи).
+        Граница ищется бисекцией, а не срезом от начала; пустой after — с начала выдачи. Возвращает (страница, есть ли ещё)."""
+        if descending:
+            k = bisect.bisect_left(positions, bisect.bisect_left(self.symbols, after)) if after else len(positions)
+            lo = max(0, k - limit)
+            return [self.items[p] for p in reversed(positions[lo:k])], lo > 0
+        k = bisect.bisect_left(positions, bisect.bisect_right(self.symbols, after))
+        return [self.items[p] for p in positions[k:k + limit]], k + limit < len(positions)
+
+def diff_catalogs(old: Iterable[Instrument], new: Iterable[Instrument]) -> Dict[str, Any]:
+    """Разница двух каталогов по символам: added — новые записи целиком, removed — удалённые записи целиком
+    (нужны, чтобы восстановить прошлое состояние), changed — {symbol: {поле: [было, стало]}}."""
+    before = {it.symbol: it.model_dump() for it in old}
+    after = {it.symbol: it.model_dump() for it in new}
+    changed: Dict[str, Dict[str, List[Any]]] = {}
+    for sym in before.keys() & after.keys():
+        fields = {f: [before[sym][f], after[sym][f]] for f in after[sym] if before[sym].get(f) != after[sym][f]}
+        if fields:
+            changed[sym] = fields
+    return {
+        "added": [after[sym] for sym in sorted(after.keys() - before.keys())],
+        "removed": [before[sym] for sym in sorted(before.keys() - after.keys())],
+        "changed": dict(sorted(changed.items())),
+    }
+
+class CatalogJournal:
+    """Версии каталога и диффы между ними: <CSV_PATH>.changes.json, общий для всех воркеров.
+
+    Каждое обновление кэша получает следующий номер версии и запись с диффом к предыдущему снимку; хранятся
+    последние CATALOG_HISTORY_MAX записей. Пишется под той же блокировкой, что и CSV, и после него — версия
+    журнала никогда не опережает данные. Запись хранит сигнатуру CSV своей версии: по ней снимок, прочитанный
+    с диска, узнаёт свою версию, даже если журнал уже ушёл дальше.
+    """
+    def __init__(self, path: Path, max_entries: int) -> None:
+        self.path = path
+        self.max_entries = max(1, max_entries)
+
+    def load(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {"version": 0, "entries": []}
+
+    def record(self, old: Iterable[Instrument], new: Iterable[Instrument], signature: Tuple[int, int]) -> int:
+        data = self.load()
+        version = data["version"] + 1
+        entry = {"version": version, "ts_ms": int(time.time() * 1000), "signature": list(signature),
+                 **diff_catalogs(old, new)}
+        data = {"version": version, "entries": (data["entries"] + [entry])[-self.max_entries:]}
+        _atomic_write(self.path, lambda f: json.dump(data, f))
+        return version
+
+    def version_of(self, signature: Tuple[int, int]) -> Optional[int]:
+        """Версия каталога, которой соответствует CSV с сигнатурой signature; None — журнал её не знает
+        (CSV только что переписан и журнал ещё не дописан, либо запись уже вытеснена)."""
+        for e in reversed(self.load()["entries"]):
+            if e.get("signature") == list(signature):
+                return e["version"]
+        return None
+
+    def changes_since(self, since: int, current: Iterable[Instrument], version: int) -> Optional[Dict[str, Any]]:
+        """Суммарная разница между версией since и каталогом current версии version; более новые записи журнала
+        не учитываются. None — since вне сохранённой истории (нужен полный снимок)."""
+        entries = [e for e in self.load()["entries"] if e["version"] <= version]
+        if since > version or (since < version and (not entries or entries[0]["version"] > since + 1)):
+            return None
+        tail = [e for e in entries if e["version"] > since]
+        touched = {r["symbol"] for e in tail for r in e["added"] + e["removed"]} | {s for e in tail for s in e["changed"]}
+        now = {it.symbol: it.model_dump() for it in current if it.symbol in touched}
+        # откатываем текущее состояние затронутых символов назад по журналу — получаем состояние на since
+        then: Dict[str, Optional[Dict[str, Any]]] = {sym: dict(now[sym]) if sym in now else None for sym in touched}
+        for e in reversed(tail):
+            for rec in e["added"]:
+                then[rec["symbol"]] = None
+            for rec in e["removed"]:
+                then[rec["symbol"]] = dict(rec)
+            for sym, fields in e["changed"].items():
+                if then[sym] is not None:
+                    for f, (old, _) in fields.items():
+                        then[sym][f] = old
+        added, removed, changed = [], [], []
+        for sym in sorted(touched):
+            before, after = then[sym], now.get(sym)
+            if before is None and after is not None:
+                added.append(after)
+            elif before is not None and after is None:
+                removed.append(sym)
+            elif before is not None and after is not None:
+                fields = {f: [before.get(f), v] for f, v in after.items() if before.get(f) != v}
+                if fields:
+                    changed.append({"symbol": sym, "fields": fields, "item": after})
+        return {"version": version, "since": since, "full": False,
+                "added": added, "removed": removed, "changed": changed}
+
 class BybitClient:
-    def __init__(self, base_url: str, timeout: int, max_retries: int) -> None:
+    """Обход instruments-info по страницам (nextPageCursor).
+
+    Каждая страница ретраится отдельно (экспоненциальная задержка с джиттером), и обход продолжается с последнего
+    удачного курсора — упавшая поздняя страница не обнуляет уже полученные. Весь обход ограничен crawl_deadline_sec.
+    Счётчики страниц, ретраев и длительности обходов — в stats().
+    """
+    def __init__(self, base_url: str, timeout: int, max_retries: int, crawl_deadline_sec: float = 120.0,
+                 backoff_base_sec: float = 0.5, backoff_max_sec: float = 10.0) -> None:
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
         self.max_retries = max_retries
+        self.crawl_deadline_sec = crawl_deadline_sec
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": "bybit-futures-microservice/1.0"})
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, float] = {
+            "crawls": 0, "crawls_failed": 0, "pages": 0, "retries": 0,
+            "last_crawl_pages": 0, "last_crawl_retries": 0, "last_crawl_sec": 0.0, "crawl_sec_total": 0.0,
+        }
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _backoff(self, attempt: int) -> float:
+        """Задержка перед attempt-й повторной попыткой: экспонента с потолком и «равным» джиттером."""
+        delay = min(self.backoff_max_sec, self.backoff_base_sec * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _fetch_page(self, endpoint: str, params: Dict, deadline: float) -> Tuple[Dict, int]:
+        """Одна страница с ретраями сетевых/5xx ошибок. Возвращает (result, число ретраев)."""
+        for attempt in range(1, max(1, self.max_retries) + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.Timeout(f"Crawl deadline of {self.crawl_deadline_sec}s exceeded")
+            try:
+                # Normal call; if tests monkeypatch requests.Session.get with a simple function,
+                # signature binding may differ; fall back to calling without args.
+                try:
+                    resp = self.session.get(endpoint, params=params, timeout=min(self.timeout, remaining))
+                except TypeError:
+                    resp = self.session.get()
+                if resp.status_code >= 500:
+                    raise requests.HTTPError(f"Server error {resp.status_code}")
+                resp.raise_for_status()
+            except (requests.Timeout, requests.ConnectionError, requests.HTTPError):
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+                time.sleep(delay)
+                continue
+            payload = resp.json()
+            if payload.get("retCode", 1) != 0:
+                raise RuntimeError(
+                    f"Bybit error: {payload.get('retCode')} {payload.get('retMsg')}"
+                )
+            return payload.get("result") or {}, attempt - 1
+        raise AssertionError("unreachable")
 
     def fetch_linear_instruments(self) -> List[Dict]:
         endpoint = f"{self.base_url}/v5/market/instruments-info"
-        params = {"category": "linear", "limit": 1000}
         items: List[Dict] = []
         cursor: Optional[str] = None
-        for attempt in range(1, self.max_retries + 1):
-            try:
-                items.clear()
-                cursor = None
-                while True:
-                    if cursor:
-                        params["cursor"] = cursor
-                    # Normal call; if tests monkeypatch requests.Session.get with a simple function,
-                    # signature binding may differ; fall back to calling without args.
-                    try:
-                        resp = self.session.get(endpoint, params=params, timeout=self.timeout)
-                    except TypeError:
-                        resp = self.session.get()
-                    if resp.status_code >= 500:
-                        raise requests.HTTPError(f"Server error {resp.status_code}")
-                    resp.raise_for_status()
-                    payload = resp.json()
-                    if payload.get("retCode", 1) != 0:
-                        raise RuntimeError(
-                            f"Bybit error: {payload.get('retCode')} {payload.get('retMsg')}"
-                        )
-                    result = payload.get("result") or {}
-                    lst = result.get("list") or []
-                    items.extend(lst)
-                    cursor = result.get("nextPageCursor") or ""
-                    if not cursor:
-                        break
-                return items
-            except (requests.Timeout, requests.ConnectionError, requests.HTTPError) as e:
-                if attempt >= self.max_retries:
-                    raise
-                time.sleep(0.5 * attempt)
+        pages = retries = 0
+        started = time.monotonic()
+        deadline = started + self.crawl_deadline_sec
+        try:
+            while True:
+                params = {"category": "linear", "limit": 1000}
+                if cursor:
+                    params["cursor"] = cursor
+                result, page_retries = self._fetch_page(endpoint, params, deadline)
+                pages += 1
+                retries += page_retries
+                items.extend(result.get("list") or [])
+                cursor = result.get("nextPageCursor") or ""
+                if not cursor:
+                    break
+        except Exception:
+            self._record_crawl(pages, retries, time.monotonic() - started, ok=False)
+            raise
+        self._record_crawl(pages, retries, time.monotonic() - started, ok=True)
         return items
 
+    def _record_crawl(self, pages: int, retries: int, elapsed: float, *, ok: bool) -> None:
+        with self._stats_lock:
+            st = self._stats
+            st["crawls"] += 1
+            st["crawls_failed"] += 0 if ok else 1
+            st["pages"] += pages
+            st["retries"] += retries
+            st["last_crawl_pages"] = pages
+            st["last_crawl_retries"] = retries
+            st["last_crawl_sec"] = round(elapsed, 3)
+            st["crawl_sec_total"] = round(st["crawl_sec_total"] + elapsed, 3)
+
 def flatten_instrument(rec: Dict) -> Instrument:
     price_filter = rec.get("priceFilter") or {}
     lot_filter = rec.get("lotSizeFilter") or {}
@@ -166,22 +483,126 @@ class FuturesCache:
         self.ttl_sec = ttl_sec
         self.client = client
 
-    def ensure_cache(self) -> None:
+    def ensure_cache(self, background: bool = False) -> None:
+        """Обновить просроченный кэш. background=True — stale-while-revalidate: если есть что отдавать,
+        обновление уходит в фоновый поток, а вызывающий сразу работает со старым снимком."""
         if is_cache_fresh(self.csv_path, self.ttl_sec):
             return
-        raw_items = self.client.fetch_linear_instruments()
-        linear_only = [r for r in raw_items if str(r.get("contractType","")).startswith("Linear")]
-        flat = [flatten_instrument(r) for r in linear_only]
-        write_csv(self.csv_path, flat)
+        if background and self.csv_path.exists():
+            refresh_in_background(self)
+            return
+        self.refresh()
+
+    @property
+    def lock_path(self) -> Path:
+        return self.csv_path.with_name(self.csv_path.name + ".lock")
+
+    @property
+    def journal(self) -> CatalogJournal:
+        return CatalogJournal(self.csv_path.with_name(self.csv_path.name + ".changes.json"),
+                              settings.CATALOG_HISTORY_MAX)
+
+    def refresh(self, wait: bool = True) -> Optional[InstrumentSnapshot]:
+        """Выкачать список из Bybit и подменить CSV и снимок целиком. При ошибке старые остаются как были.
+
+        Между воркерами — файловая блокировка <csv>.lock: выкачивает один. Остальные при wait=True ждут его
+        (до REFRESH_LOCK_TIMEOUT_SEC) и берут его результат, при wait=False сразу возвращают None и продолжают
+        отдавать текущий снимок.
+        """
+        before = _signature_or_none(self.csv_path)
+        lock = FileLock(str(self.lock_path), timeout=settings.REFRESH_LOCK_TIMEOUT_SEC if wait else 0)
+        try:
+            lock.acquire()
+        except Timeout:
+            if not wait:
+                return None
+            raise RuntimeError(f"Timed out waiting for another worker to refresh {self.csv_path}")
+        try:
+            after = _signature_or_none(self.csv_path)
+            if after is not None and after != before and is_cache_fresh(self.csv_path, self.ttl_sec):
+                # пока ждали блокировку, кэш обновил другой воркер
+                return self.snapshot()
+            raw_items = self.client.fetch_linear_instruments()
+            linear_only = [r for r in raw_items if str(r.get("contractType","")).startswith("Linear")]
+            flat = [flatten_instrument(r) for r in linear_only]
+            try:
+                previous: Sequence[Instrument] = load_snapshot(self.csv_path).items
+            except Exception:
+                previous = ()
+            return install_snapshot(self.csv_path, flat, journal=self.journal, previous=previous)
+        finally:
+            lock.release()
 
     def load_all(self) -> List[Instrument]:
         self.ensure_cache()
+        return list(self.snapshot().items)
+
+    def snapshot(self) -> InstrumentSnapshot:
+        """Снимок текущей версии CSV (без похода в сеть). Разбирается один раз на версию файла
+        и подменяется целиком; битый CSV удаляется и загружается заново."""
         try:
-            return read_csv(self.csv_path)
+            return load_snapshot(self.csv_path)
+        except FileNotFoundError:
+            raise
         except Exception:
             self.csv_path.unlink(missing_ok=True)
             self.ensure_cache()
-            return read_csv(self.csv_path)
+            return load_snapshot(self.csv_path)
+
+_snapshot_lock = threading.Lock()
+_snapshot: Optional[Tuple[Path, InstrumentSnapshot]] = None
+
+def install_snapshot(csv_path: Path, items: List[Instrument], journal: Optional[CatalogJournal] = None,
+                     previous: Iterable[Instrument] = ()) -> InstrumentSnapshot:
+    """Записать новый CSV (атомарно) и сразу подменить снимок уже разобранными инструментами — без перечитывания.
+    С journal дифф к previous записывается в журнал до подмены, и снимок публикуется уже со своей версией."""
+    global _snapshot
+    path = csv_path.resolve()
+    with _snapshot_lock:
+        write_csv(path, items)
+        sig = file_signature(path)
+        version = journal.record(previous, items, sig) if journal is not None else None
+        snap = InstrumentSnapshot(items, sig, version)
+        _snapshot = (path, snap)
+        return snap
+
+_refresh_lock = threading.Lock()
+_refresh_thread: Optional[threading.Thread] = None
+
+def refresh_in_background(cache: FuturesCache) -> bool:
+    """Запустить cache.refresh() в фоновом потоке, если обновление ещё не идёт. True — запущено этим вызовом."""
+    global _refresh_thread
+
+    def run() -> None:
+        try:
+            cache.refresh(wait=False)
+        except Exception as e:
+            log.warning("Background refresh of %s failed, serving stale data: %s", cache.csv_path, e)
+
+    with _refresh_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return False
+        _refresh_thread = threading.Thread(target=run, name="futures-refresh", daemon=True)
+        _refresh_thread.start()
+        return True
+
+def load_snapshot(csv_path: Path) -> InstrumentSnapshot:
+    """Текущий снимок для csv_path: если версия файла не менялась — готовый объект, иначе разобрать и подменить."""
+    global _snapshot
+    path = csv_path.resolve()
+    current = _snapshot
+    sig = file_signature(path)
+    if current is not None and current[0] == path and current[1].signature == sig:
+        return current[1]
+    with _snapshot_lock:
+        current = _snapshot
+        if current is not None and current[0] == path and current[1].signature == sig:
+            return current[1]
+        snap = InstrumentSnapshot(read_csv(path), sig)
+        # файл могли переписать во время чтения — тогда снимок получит версию, которую видел до чтения,
+        # и следующий запрос перечитает файл
+        _snapshot = (path, snap)
+        return snap
 
 app = FastAPI(title="Bybit Linear Futures Service", version="1.0.0")
 
@@ -189,6 +610,9 @@ bybit_client = BybitClient(
     base_url=settings.BYBIT_BASE_URL,
     timeout=settings.REQUEST_TIMEOUT_SEC,
     max_retries=settings.MAX_RETRIES,
+    crawl_deadline_sec=settings.CRAWL_DEADLINE_SEC,
+    backoff_base_sec=settings.RETRY_BACKOFF_BASE_SEC,
+    backoff_max_sec=settings.RETRY_BACKOFF_MAX_SEC,
 )
 
 
@@ -216,60 +640,160 @@ cache = _CacheProxy()
 def health() -> Dict[str, str]:
     return {"status": "ok"}
 
-@app.get("/futures", response_model=FuturesListResponse)
-def get_futures(
-    page: PositiveInt = Query(1),
-    page_size: conint(gt=0, le=1000) = Query(settings.PAGE_SIZE_DEFAULT),
-    order: Literal["asc","desc"] = Query("asc"),
-    contract_type: Literal["LinearFutures","LinearPerpetual","all"] = Query("LinearFutures"),
-    minage_years: Optional[PositiveInt] = Query(None, description="Минимальный возраст актива в годах по launchTime")
-) -> FuturesListResponse:
-    csv_path = settings.CSV_PATH
+@app.get("/crawl/stats")
+def crawl_stats() -> Dict[str, float]:
+    """Счётчики обходов Bybit: обходы (и неудачные), страницы, ретраи, длительность последнего и суммарная."""
+    return bybit_client.stats()
+
+def _current_snapshot() -> InstrumentSnapshot:
+    """Снимок для ответа: просроченный кэш обновляется в фоне; в сеть синхронно идём, только если отдавать нечего."""
+    global cache
     try:
-        global cache
         cache = _build_cache()
-        items = cache.load_all()
+        cache.ensure_cache(background=True)
     except (requests.RequestException, RuntimeError) as e:
-        if csv_path.exists():
-            items = read_csv(csv_path)
-        else:
+        if not settings.CSV_PATH.exists():
             raise HTTPException(status_code=502, detail=f"Upstream error: {e}")
+    return cache.snapshot()
+
+def _csv_list(value: Optional[str]) -> Optional[List[str]]:
+    if value is None:
+        return None
+    return [v.strip() for v in value.split(",") if v.strip()]
 
-    if contract_type != "all":
-        items = [it for it in items if it.contractType == contract_type]
+INSTRUMENT_FIELDS = tuple(Instrument.model_fields)
 
+@app.get("/futures", response_model=FuturesListResponse)
+def get_futures(
+    page: PositiveInt = Query(1),
+    page_size: int = Query(settings.PAGE_SIZE_DEFAULT, gt=0, le=1000, description="Размер страницы, не больше 1000"),
+    order: Literal["asc","desc"] = Query("asc"),
+    contract_type: Literal["LinearFutures","LinearPerpetual","all"] = Query("LinearFutures"),
+    minage_years: Optional[PositiveInt] = Query(None, description="Минимальный возраст актива в годах по launchTime"),
+    base_coin: Optional[str] = Query(None, description="baseCoin, несколько — через запятую"),
+    quote_coin: Optional[str] = Query(None, description="quoteCoin, несколько — через запятую"),
+    settle_coin: Optional[str] = Query(None, description="settleCoin, несколько — через запятую"),
+    status: Optional[str] = Query(None, description="status, несколько — через запятую (например Trading)"),
+    launch_from_ms: Optional[int] = Query(None, description="launchTime >= (мс UTC)"),
+    launch_to_ms: Optional[int] = Query(None, description="launchTime <= (мс UTC)"),
+    delivery_from_ms: Optional[int] = Query(None, description="deliveryTime >= (мс UTC)"),
+    delivery_to_ms: Optional[int] = Query(None, description="deliveryTime <= (мс UTC)"),
+    fields: Optional[str] = Query(None, description="Поля инструмента через запятую (symbol отдаётся всегда)"),
+    after: Optional[str] = Query(None, description="Keyset-курсор: символ, после которого начать (вместо page)"),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+) -> Response:
+    """Страница каталога. Готовый JSON кэшируется в снимке по нормализованному запросу: повторный запрос —
+    поиск в словаре и сырой Response, без построения и валидации моделей (response_model — только для схемы)."""
+    projection = _csv_list(fields)
+    if projection is not None:
+        unknown = sorted(set(projection) - set(INSTRUMENT_FIELDS))
+        if unknown:
+            raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+        projection = ["symbol"] + [f for f in INSTRUMENT_FIELDS if f in projection and f != "symbol"]
+
+    snapshot = _current_snapshot()
+
+    # Версия ответа — версия снимка и параметры; для minage_years результат зависит ещё и от текущих суток
+    day = int(time.time() // 86400) if minage_years is not None else None
+    validators = snapshot_validators(
+        snapshot.signature, page, page_size, order, contract_type, minage_years, day, base_coin, quote_coin,
+        settle_coin, status, launch_from_ms, launch_to_ms, delivery_from_ms, delivery_to_ms, projection, after)
+    if is_not_modified(validators, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=validators)
+
+    eq: Dict[str, Union[str, List[str]]] = {"contractType": contract_type} if contract_type != "all" else {}
+    for field, value in (("baseCoin", base_coin), ("quoteCoin", quote_coin),
+                         ("settleCoin", settle_coin), ("status", status)):
+        if value is not None:
+            eq[field] = _csv_list(value)
+    # ключ кэша: списки — как множества; minage_years — с точностью до суток, как и ETag.
+    # page входит в ключ и при after: он отдаётся в теле ответа и входит в ETag
+    key = (page, page_size, order, contract_type, minage_years, day,
+           tuple(sorted((f, v if isinstance(v, str) else tuple(sorted(set(v)))) for f, v in eq.items())),
+           launch_from_ms, launch_to_ms, delivery_from_ms, delivery_to_ms,
+           tuple(projection) if projection is not None else None, after)
+    body = snapshot.render(key, lambda: _futures_page(
+        snapshot, page=page, page_size=page_size, order=order, contract_type=contract_type, eq=eq,
+        minage_years=minage_years, launch_from_ms=launch_from_ms, launch_to_ms=launch_to_ms,
+        delivery_from_ms=delivery_from_ms, delivery_to_ms=delivery_to_ms, projection=projection, after=after))
+    return Response(content=body, media_type="application/json", headers=validators)
+
+def _futures_page(snapshot: InstrumentSnapshot, *, page: int, page_size: int, order: str, contract_type: str,
+                  eq: Dict[str, Union[str, List[str]]], minage_years: Optional[int],
+                  launch_from_ms: Optional[int], launch_to_ms: Optional[int],
+                  delivery_from_ms: Optional[int], delivery_to_ms: Optional[int],
+                  projection: Optional[List[str]], after: Optional[str]) -> Dict[str, Any]:
+    """Тело ответа GET /futures (в том же виде, что FuturesListResponse, items — словари)."""
     # Фильтр по возрасту актива по launchTime (мс с эпохи)
     if minage_years is not None:
         now_ms = int(time.time() * 1000)
-        min_age_ms = int(minage_years * 365.2425 * 24 * 60 * 60 * 1000)
-        items = [it for it in items if (it.launchTime is not None and (now_ms - int(it.launchTime)) >= min_age_ms)]
-
-    items.sort(key=lambda x: x.symbol)
-    if order == "desc":
-        items.reverse()
-
-    if page_size > 1000:
-        page_size = 1000
-    total = len(items)
-    start = (page-1)*page_size
-    end = start+page_size
-    page_items = items[start:end]
-    return FuturesListResponse(
-        total=total,
-        page=page,
-        page_size=page_size,
-        order=order,
-        contract_type=contract_type,
-        items=page_items,
-    )
+        launched_before = now_ms - int(minage_years * 365.2425 * 24 * 60 * 60 * 1000)
+        launch_to_ms = launched_before if launch_to_ms is None else min(launch_to_ms, launched_before)
+    ranges = {}
+    if launch_from_ms is not None or launch_to_ms is not None:
+        ranges["launchTime"] = (launch_from_ms, launch_to_ms)
+    if delivery_from_ms is not None or delivery_to_ms is not None:
+        ranges["deliveryTime"] = (delivery_from_ms, delivery_to_ms)
+    positions = snapshot.select(eq=eq, ranges=ranges)
+
+    total = len(positions)
+    next_after = None
+    if after is not None:
+        page_items, more = snapshot.page_after(positions, after=after, limit=page_size, descending=order == "desc")
+        if more and page_items:
+            next_after = page_items[-1].symbol
+    else:
+        page_items = snapshot.page(positions, offset=(page-1)*page_size, limit=page_size, descending=order == "desc")
+    return {
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "order": order,
+        "contract_type": contract_type,
+        "items": [it.model_dump(include=set(projection)) if projection is not None else it.model_dump() for it in page_items],
+        "next_after": next_after,
+    }
+
+@app.get("/futures/changes")
+def get_futures_changes(
+    since: Optional[int] = Query(None, ge=0, description="Версия каталога, которая уже есть у клиента"),
+) -> Dict[str, Any]:
+    """Изменения каталога после версии since: added (записи), removed (символы), changed (поля было/стало и запись).
+    Без since или если since старше сохранённой истории — полный снимок (full=true, items) с его версией.
+    Версия берётся у того же снимка, что и записи (обновление между чтениями их не рассогласует); version=null —
+    журнал ещё не знает версию этого CSV, отдаётся полный снимок."""
+    snapshot = _current_snapshot()
+    journal = _build_cache().journal
+    version = snapshot.version if snapshot.version is not None else journal.version_of(snapshot.signature)
+    delta = journal.changes_since(since, snapshot.items, version) if since is not None and version is not None else None
+    if delta is not None:
+        return delta
+    return {"version": version, "since": since, "full": True,
+            "items": [it.model_dump() for it in snapshot.items]}
+
+@app.post("/futures/lookup", response_model=LookupResponse)
+def lookup_futures(req: LookupRequest) -> LookupResponse:
+    """Параметры инструментов по списку символов одним вызовом — по словарю снимка, без выборки и пагинации."""
+    items, missing = _current_snapshot().lookup(req.symbols)
+    return LookupResponse(items=items, missing=missing)
+
+# объявлен после /futures/changes, иначе "changes" ушёл бы сюда как символ
+@app.get("/futures/{symbol}", response_model=Instrument)
+def get_future(symbol: str) -> Instrument:
+    item = _current_snapshot().by_symbol.get(symbol.strip().upper())
+    if item is None:
+        raise HTTPException(status_code=404, detail=f"Unknown symbol: {symbol}")
+    return item
 
 @app.post("/refresh")
 def refresh() -> JSONResponse:
+    """Принудительное обновление: новый снимок строится целиком и только потом подменяет текущий —
+    параллельные читатели всё это время видят старый, при ошибке Bybit он и остаётся."""
     try:
         global cache
         cache = _build_cache()
-        settings.CSV_PATH.unlink(missing_ok=True)
-        cache.ensure_cache()
+        snapshot = cache.refresh()
     except (requests.RequestException, RuntimeError) as e:
         raise HTTPException(status_code=502, detail=f"Upstream error: {e}")
-    return JSONResponse({"ok": True, "csv": str(settings.CSV_PATH.resolve())})
+    return JSONResponse({"ok": True, "csv": str(settings.CSV_PATH.resolve()), "total": len(snapshot)})
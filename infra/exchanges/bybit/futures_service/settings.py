@@ -23,6 +23,17 @@ class Settings(BaseSettings):
     REQUEST_TIMEOUT_SEC: int = 15
     MAX_RETRIES: int = 3
     PAGE_SIZE_DEFAULT: int = 50
+    # сколько воркер ждёт, пока другой воркер обновляет кэш (файловая блокировка <CSV_PATH>.lock)
+    REFRESH_LOCK_TIMEOUT_SEC: int = 60
+    # общий лимит времени на обход всех страниц instruments-info
+    CRAWL_DEADLINE_SEC: float = 120.0
+    # задержка перед повтором страницы: base * 2^(попытка-1), не больше max, с джиттером
+    RETRY_BACKOFF_BASE_SEC: float = 0.5
+    RETRY_BACKOFF_MAX_SEC: float = 10.0
+    # сколько последних версий каталога хранить для GET /futures/changes
+    CATALOG_HISTORY_MAX: int = 500
+    # сколько готовых JSON-ответов /futures держать на одну версию снимка
+    RESPONSE_CACHE_MAX: int = 256
 
     @classmethod
     def settings_customise_sources(
@@ -1,4 +1,5 @@
 import os
+import time
 from pathlib import Path
 import pytest
 from fastapi.testclient import TestClient
@@ -66,3 +67,319 @@ def test_endpoint(monkeypatch, tmp_path):
     data=resp.json()
     assert "items" in data
     assert data["total"]==2
+
+def test_conditional_get(monkeypatch, tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    def fake_get(url, params=None, timeout=0):
+        items=[{
+            "symbol":"BTCUSDT","contractType":"LinearFutures","status":"Trading",
+            "baseCoin":"BTC","quoteCoin":"USDT","launchTime":"0","deliveryTime":"0",
+            "priceScale":"2","priceFilter":{"tickSize":"0.1"},
+            "lotSizeFilter":{"minOrderQty":"0.001","maxOrderQty":"10","qtyStep":"0.001","minNotionalValue":"5"},
+            "fundingInterval":0,
+        }]
+        return DummyResp(200, make_payload(items))
+    monkeypatch.setattr(service.requests.Session, "get", fake_get)
+    client = TestClient(service.app)
+    resp = client.get("/futures")
+    etag, last_modified = resp.headers["etag"], resp.headers["last-modified"]
+    assert resp.status_code == 200 and resp.headers["cache-control"] == "no-cache"
+
+    read_csv = service.read_csv
+    def boom(path):
+        raise AssertionError("CSV read for an unchanged snapshot")
+    monkeypatch.setattr(service, "read_csv", boom)
+    resp = client.get("/futures", headers={"If-None-Match": etag})
+    assert resp.status_code == 304 and resp.content == b"" and resp.headers["etag"] == etag
+    assert client.get("/futures", headers={"If-Modified-Since": last_modified}).status_code == 304
+    monkeypatch.setattr(service, "read_csv", read_csv)
+    # другая страница — другое представление
+    assert client.get("/futures", params={"page": 2}, headers={"If-None-Match": etag}).headers["etag"] != etag
+
+def _inst(symbol, contract_type="LinearFutures", launch=None, **kw):
+    return service.Instrument(symbol=symbol, contractType=contract_type, status=kw.get("status", "Trading"),
+                              baseCoin=kw.get("baseCoin", symbol[:3]), quoteCoin="USDT", launchTime=launch)
+
+def test_snapshot_indexes_and_paging():
+    snap = service.InstrumentSnapshot([
+        _inst("SOLUSDT", launch=300), _inst("BTCUSDT", launch=100), _inst("ETHPERP", "LinearPerpetual", launch=200),
+        _inst("ADAUSDT", status="Closed"), _inst("XRPUSDT", launch=50),
+    ], (1, 1))
+    assert snap.symbols == ("ADAUSDT", "BTCUSDT", "ETHPERP", "SOLUSDT", "XRPUSDT")
+    futures = snap.select(eq={"contractType": "LinearFutures"})
+    assert [snap.symbols[p] for p in futures] == ["ADAUSDT", "BTCUSDT", "SOLUSDT", "XRPUSDT"]
+    old = snap.select(eq={"contractType": "LinearFutures", "status": "Trading"}, ranges={"launchTime": (None, 100)})
+    assert [snap.symbols[p] for p in old] == ["BTCUSDT", "XRPUSDT"]
+    assert [it.symbol for it in snap.page(futures, offset=1, limit=2, descending=True)] == ["SOLUSDT", "BTCUSDT"]
+    assert [it.symbol for it in snap.page(futures, offset=3, limit=2, descending=True)] == ["ADAUSDT"]
+    assert snap.page(futures, offset=10, limit=2) == []
+
+def test_snapshot_parsed_once_per_csv_version(monkeypatch, tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    service.write_csv(service.settings.CSV_PATH, [_inst("BTCUSDT"), _inst("ETHUSDT")])
+    reads = []
+    read_csv = service.read_csv
+    monkeypatch.setattr(service, "read_csv", lambda path: reads.append(path) or read_csv(path))
+    client = TestClient(service.app)
+    for order in ("asc", "desc", "asc"):
+        assert client.get("/futures", params={"order": order}).json()["total"] == 2
+    assert len(reads) == 1
+    first = service.load_snapshot(service.settings.CSV_PATH)
+
+    service.write_csv(service.settings.CSV_PATH, [_inst("BTCUSDT"), _inst("ETHUSDT"), _inst("SOLUSDT")])
+    data = client.get("/futures", params={"order": "desc"}).json()
+    assert [x["symbol"] for x in data["items"]] == ["SOLUSDT", "ETHUSDT", "BTCUSDT"]
+    assert len(reads) == 2 and service.load_snapshot(service.settings.CSV_PATH) is not first
+
+def test_stale_cache_served_while_refreshing_in_background(monkeypatch, tmp_path):
+    import threading
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    service.write_csv(service.settings.CSV_PATH, [_inst("BTCUSDT")])
+    os.utime(service.settings.CSV_PATH, (0, 0))  # просрочен
+    release = threading.Event()
+    calls = {"n": 0}
+    def slow_get(*a, **kw):
+        calls["n"] += 1
+        assert release.wait(5)
+        items = [{"symbol": s, "contractType": "LinearFutures", "status": "Trading", "baseCoin": s[:3],
+                  "quoteCoin": "USDT"} for s in ("BTCUSDT", "ETHUSDT")]
+        return DummyResp(200, make_payload(items))
+    monkeypatch.setattr(service.requests.Session, "get", slow_get)
+    client = TestClient(service.app)
+    # оба запроса отвечают старым снимком, не дожидаясь Bybit; обновление одно
+    assert client.get("/futures").json()["total"] == 1
+    assert client.get("/futures").json()["total"] == 1
+    release.set()
+    service._refresh_thread.join(5)
+    assert calls["n"] == 1
+    assert client.get("/futures").json()["total"] == 2
+
+def test_refresh_failure_keeps_current_snapshot(monkeypatch, tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    service.write_csv(service.settings.CSV_PATH, [_inst("BTCUSDT")])
+    def down(*a, **kw):
+        raise service.requests.ConnectionError("down")
+    monkeypatch.setattr(service.requests.Session, "get", down)
+    monkeypatch.setattr(service.time, "sleep", lambda s: None)
+    client = TestClient(service.app)
+    assert client.post("/refresh").status_code == 502
+    assert service.settings.CSV_PATH.exists()
+    assert client.get("/futures").json()["total"] == 1
+
+def test_concurrent_refresh_fetches_once_across_workers(monkeypatch, tmp_path):
+    import threading
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    calls = {"n": 0}
+    def slow_get(*a, **kw):
+        calls["n"] += 1
+        time.sleep(0.2)
+        items = [{"symbol": "BTCUSDT", "contractType": "LinearFutures", "status": "Trading", "baseCoin": "BTC",
+                  "quoteCoin": "USDT"}]
+        return DummyResp(200, make_payload(items))
+    monkeypatch.setattr(service.requests.Session, "get", slow_get)
+    # отдельные экземпляры FuturesCache, как в разных воркерах
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(service._build_cache().load_all())) for _ in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join(5)
+    assert calls["n"] == 1
+    assert [len(r) for r in results] == [1, 1, 1, 1]
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+
+def test_background_refresh_skips_when_another_worker_holds_lock(monkeypatch, tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    service.write_csv(service.settings.CSV_PATH, [_inst("BTCUSDT")])
+    def boom(*a, **kw):
+        raise AssertionError("fetched while another worker refreshes")
+    monkeypatch.setattr(service.requests.Session, "get", boom)
+    import threading
+    cache = service._build_cache()
+    result = []
+    with service.FileLock(str(cache.lock_path)):
+        # другой поток — отдельный дескриптор блокировки, как у другого воркера
+        t = threading.Thread(target=lambda: result.append(cache.refresh(wait=False)))
+        t.start()
+        t.join(5)
+    assert result == [None]
+
+def test_crawl_retries_failed_page_and_resumes_from_cursor(monkeypatch):
+    pages = {None: ("p2", ["AUSDT"]), "p2": ("p3", ["BUSDT"]), "p3": ("", ["CUSDT"])}
+    seen = []
+    fail = {"p3": 2}
+    def fake_get(self, url, params=None, timeout=0):
+        cursor = params.get("cursor")
+        seen.append(cursor)
+        if fail.get(cursor):
+            fail[cursor] -= 1
+            raise service.requests.ConnectionError("flaky")
+        nxt, syms = pages[cursor]
+        return DummyResp(200, make_payload([{"symbol": s} for s in syms], nxt))
+    monkeypatch.setattr(service.requests.Session, "get", fake_get)
+    sleeps = []
+    monkeypatch.setattr(service.time, "sleep", sleeps.append)
+    client = service.BybitClient("http://x", timeout=1, max_retries=3, backoff_base_sec=1, backoff_max_sec=10)
+    items = client.fetch_linear_instruments()
+    assert [i["symbol"] for i in items] == ["AUSDT", "BUSDT", "CUSDT"]
+    # упала только третья страница — первые две не перекачивались
+    assert seen == [None, "p2", "p3", "p3", "p3"]
+    assert 0.5 <= sleeps[0] <= 1 and 1 <= sleeps[1] <= 2
+    st = client.stats()
+    assert (st["crawls"], st["pages"], st["retries"], st["last_crawl_retries"]) == (1, 3, 2, 2)
+
+def test_crawl_deadline(monkeypatch):
+    def slow_fail(self, url, params=None, timeout=0):
+        raise service.requests.Timeout("slow")
+    monkeypatch.setattr(service.requests.Session, "get", slow_fail)
+    monkeypatch.setattr(service.time, "sleep", lambda s: None)
+    client = service.BybitClient("http://x", timeout=1, max_retries=100, crawl_deadline_sec=0.05,
+                                 backoff_base_sec=0.1)
+    with pytest.raises(service.requests.Timeout):
+        client.fetch_linear_instruments()
+    assert client.stats()["crawls_failed"] == 1
+    assert TestClient(service.app).get("/crawl/stats").status_code == 200
+
+def test_filters_projection_and_keyset_pages(tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    rows = [service.Instrument(symbol=f"{c}USD{q}", contractType="LinearFutures", status="Trading",
+                               baseCoin=c, quoteCoin=f"USD{q}", settleCoin=f"USD{q}", launchTime=i * 10,
+                               tickSize="0.1")
+            for i, (c, q) in enumerate((c, q) for c in ("AAA", "BBB", "CCC", "DDD") for q in ("C", "T"))]
+    rows.append(service.Instrument(symbol="EEEUSDT", contractType="LinearFutures", status="Closed",
+                                   baseCoin="EEE", quoteCoin="USDT"))
+    service.write_csv(service.settings.CSV_PATH, rows)
+    client = TestClient(service.app)
+
+    data = client.get("/futures", params={"quote_coin": "USDT", "status": "Trading"}).json()
+    assert [x["symbol"] for x in data["items"]] == ["AAAUSDT", "BBBUSDT", "CCCUSDT", "DDDUSDT"]
+    data = client.get("/futures", params={"base_coin": "AAA,CCC", "launch_from_ms": 10, "launch_to_ms": 50}).json()
+    assert [x["symbol"] for x in data["items"]] == ["AAAUSDT", "CCCUSDC", "CCCUSDT"]
+
+    data = client.get("/futures", params={"settle_coin": "USDC", "fields": "tickSize,baseCoin"}).json()
+    assert data["items"][0] == {"symbol": "AAAUSDC", "baseCoin": "AAA", "tickSize": "0.1"}
+    assert client.get("/futures", params={"fields": "nope"}).status_code == 422
+    assert [client.get("/futures", params={"page_size": n}).status_code for n in (0, 1001)] == [422, 422]
+
+    for order, expected in (("asc", sorted(r.symbol for r in rows)), ("desc", sorted((r.symbol for r in rows), reverse=True))):
+        seen, after = [], ""
+        while after is not None:
+            data = client.get("/futures", params={"after": after, "page_size": 3, "order": order}).json()
+            seen += [x["symbol"] for x in data["items"]]
+            after = data["next_after"]
+        assert seen == expected
+
+def test_changes_since_version_and_truncated_history(monkeypatch, tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    monkeypatch.setattr(service.settings, "CATALOG_HISTORY_MAX", 2)
+    catalog = {}
+    def raw(symbol, tick):
+        return {"symbol": symbol, "contractType": "LinearFutures", "status": "Trading", "baseCoin": symbol[:3],
+                "quoteCoin": "USDT", "priceFilter": {"tickSize": tick}, "lotSizeFilter": {}}
+    monkeypatch.setattr(service.requests.Session, "get",
+                        lambda *a, **kw: DummyResp(200, make_payload([raw(s, t) for s, t in catalog.items()])))
+    client = TestClient(service.app)
+
+    catalog.update(BTCUSDT="0.1", ETHUSDT="0.01")
+    service._build_cache().refresh()                                  # v1
+    catalog.update(BTCUSDT="0.5", SOLUSDT="0.001")
+    service._build_cache().refresh()                                  # v2
+    del catalog["ETHUSDT"]
+    catalog["BTCUSDT"] = "0.1"
+    service._build_cache().refresh()                                  # v3
+
+    data = client.get("/futures/changes", params={"since": 1}).json()
+    assert data["version"] == 3 and not data["full"]
+    assert [x["symbol"] for x in data["added"]] == ["SOLUSDT"] and data["removed"] == ["ETHUSDT"]
+    assert data["changed"] == []                                      # 0.1 -> 0.5 -> 0.1 схлопывается
+    data = client.get("/futures/changes", params={"since": 2}).json()
+    assert data["added"] == [] and data["removed"] == ["ETHUSDT"]
+    assert data["changed"][0]["symbol"] == "BTCUSDT" and data["changed"][0]["fields"] == {"tickSize": ["0.5", "0.1"]}
+    data = client.get("/futures/changes", params={"since": 3}).json()
+    assert (data["full"], data["added"], data["removed"], data["changed"]) == (False, [], [], [])
+
+    # v1 и старше вытеснены из журнала (хранится 2 записи) — полный снимок
+    for since in (0, None):
+        data = client.get("/futures/changes", params={} if since is None else {"since": since}).json()
+        assert data["full"] and data["version"] == 3
+        assert [x["symbol"] for x in data["items"]] == ["BTCUSDT", "SOLUSDT"]
+
+def test_changes_version_matches_snapshot_when_refresh_interleaves(monkeypatch, tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    catalog = {}
+    def raw(symbol, tick):
+        return {"symbol": symbol, "contractType": "LinearFutures", "status": "Trading", "baseCoin": symbol[:3],
+                "quoteCoin": "USDT", "priceFilter": {"tickSize": tick}, "lotSizeFilter": {}}
+    monkeypatch.setattr(service.requests.Session, "get",
+                        lambda *a, **kw: DummyResp(200, make_payload([raw(s, t) for s, t in catalog.items()])))
+    client = TestClient(service.app)
+
+    catalog.update(BTCUSDT="0.1")
+    service._build_cache().refresh()                                  # v1
+    catalog.update(ETHUSDT="0.01")
+    service._build_cache().refresh()                                  # v2
+
+    # обновление до v3 успевает пройти между чтением снимка (v2) и журнала
+    current = service._current_snapshot
+    def racing():
+        snap = current()
+        catalog.update(SOLUSDT="0.001")
+        service._build_cache().refresh()
+        return snap
+    monkeypatch.setattr(service, "_current_snapshot", racing)
+
+    data = client.get("/futures/changes", params={"since": 1}).json()
+    assert data["version"] == 2 and [x["symbol"] for x in data["added"]] == ["ETHUSDT"]
+    data = client.get("/futures/changes").json()
+    assert data["version"] == 3 and [x["symbol"] for x in data["items"]] == ["BTCUSDT", "ETHUSDT", "SOLUSDT"]
+
+    # снимок, прочитанный с диска (другой воркер), находит свою версию по сигнатуре CSV
+    monkeypatch.setattr(service, "_snapshot", None)
+    catalog.update(XRPUSDT="0.0001")
+    data = client.get("/futures/changes", params={"since": 2}).json()
+    assert data["version"] == 4 and [x["symbol"] for x in data["added"]] == ["SOLUSDT"]
+
+def test_symbol_lookup(tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    service.write_csv(service.settings.CSV_PATH, [_inst("BTCUSDT"), _inst("ETHUSDT"), _inst("SOLUSDT")])
+    client = TestClient(service.app)
+    resp = client.post("/futures/lookup", json={"symbols": ["solusdt", "NOPE", "BTCUSDT", "SOLUSDT"]})
+    assert resp.status_code == 200, resp.text
+    data = resp.json()
+    assert [x["symbol"] for x in data["items"]] == ["SOLUSDT", "BTCUSDT"] and data["missing"] == ["NOPE"]
+    assert client.post("/futures/lookup", json={"symbols": "BTCUSDT"}).status_code == 422
+
+    assert client.get("/futures/ethusdt").json()["symbol"] == "ETHUSDT"
+    assert client.get("/futures/NOPE").status_code == 404
+    assert "full" in client.get("/futures/changes").json()
+
+def test_rendered_pages_cached_per_snapshot(monkeypatch, tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    service.write_csv(service.settings.CSV_PATH, [_inst("BTCUSDT"), _inst("ETHUSDT")])
+    client = TestClient(service.app)
+    first = client.get("/futures", params={"base_coin": "BTC,ETH", "page_size": 1})
+    assert first.status_code == 200 and first.headers["content-type"] == "application/json"
+    assert first.json()["items"][0]["symbol"] == "BTCUSDT" and first.json()["total"] == 2
+
+    builds = []
+    page = service._futures_page
+    monkeypatch.setattr(service, "_futures_page", lambda *a, **kw: builds.append(kw) or page(*a, **kw))
+    # тот же запрос с другим порядком значений — попадание в кэш, тело байт в байт
+    again = client.get("/futures", params={"base_coin": "ETH,BTC", "page_size": 1})
+    assert builds == [] and again.content == first.content
+    client.get("/futures", params={"page_size": 1, "page": 2})
+    assert len(builds) == 1
+
+    # новый CSV — новый снимок, кэш ответов начинается заново
+    service.write_csv(service.settings.CSV_PATH, [_inst("BTCUSDT"), _inst("ETHUSDT"), _inst("SOLUSDT")])
+    assert client.get("/futures", params={"base_coin": "BTC,ETH", "page_size": 1}).json()["total"] == 2
+    assert len(builds) == 2
+
+def test_rendered_keyset_page_keeps_requested_page(tmp_path):
+    service.settings.CSV_PATH = tmp_path / "cache.csv"
+    service.write_csv(service.settings.CSV_PATH, [_inst("BTCUSDT"), _inst("ETHUSDT"), _inst("SOLUSDT")])
+    client = TestClient(service.app)
+    first = client.get("/futures", params={"after": "BTCUSDT", "page": 1})
+    other = client.get("/futures", params={"after": "BTCUSDT", "page": 5})
+    assert first.json()["page"] == 1 and other.json()["page"] == 5
+    assert first.json()["items"] == other.json()["items"] and first.headers["etag"] != other.headers["etag"]